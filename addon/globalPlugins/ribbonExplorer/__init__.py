@@ -9,13 +9,30 @@ import ui
 import api
 import speech
 from keyboardHandler import KeyboardInputGesture as InputGesture
-import braille
-import inspect
-from NVDAObjects import NVDAObject
 from NVDAObjects.IAccessible import IAccessible
 import review
 import scriptHandler
+import core
 from .utils import *
+from .trace import traced
+from . import trace
+from .recorder import recorded, recorder, recordTree
+from .model import RibbonModel, MENUBAR, TAB
+from .uiaCache import SubtreeCache, walkSubtree
+from .search import CommandIndex, SEARCH_CHARS, MAX_MENUS, PATH_VISITS, TAB_CLASS
+from .prefetch import Prefetcher
+from .focusPlan import FocusPlanner, TAB_KEYS, MENU_KEYS
+from .transaction import Transaction, LATE_DEADLINE
+from .coalesce import EventCoalescer
+from .query import QueryWorker, QueryTimeout, staleOnTimeout, RETRY_DELAY, MAX_RETRIES
+from .layoutStore import LayoutStore, getStoreKey, waitWrites
+from .context import ExplorationContext, ContextCache, RESUME_LAST_TAB
+from .appInfo import AppInfoCache, getRibbonView, QUIRK_MISSING_FOCUS
+from .repeat import KeyRepeat, repeatable
+from .gallery import Gallery, PAGE_SIZE, ITEM_ROLES
+from .snapshot import snapshotted, read, forget as forgetReads
+from .reporter import Reporter
+from .rules import RULES, OVERLAY, RuleEngine
 # for compatibility
 REASON_FOCUS = ct.OutputReason.FOCUS if hasattr(ct, "OutputReason") else ct.REASON_FOCUS
 if hasattr(ct, 'Role'):
@@ -65,16 +82,14 @@ It's all, for now...
 # todo: return to menubar consistently
 # todo: fix alt+downArrow in v1 and v3 expanding menubar items
 
-# speed-up
-content = NVDAObject.presType_content
-layout = NVDAObject.presType_layout
-unavailable = NVDAObject.presType_unavailable
-
 class GlobalPlugin(globalPluginHandler.GlobalPlugin):
 
 	# starting variables
 	# to speed-up negative check in event_focusEntered
 	supportedApp = False
+	# what is known about foreground process (see appInfo.py)
+	appInfos = None
+	appInfo = None
 	# determine if Ribbon exploration is active
 	exploring = False
 	# save and then restore initial review mode
@@ -83,119 +98,132 @@ class GlobalPlugin(globalPluginHandler.GlobalPlugin):
 	userObj = None
 	# keep of userObj focus status (see reportUser)
 	userObjHasFocus = False
+	# stacks of Ribbon objects, per exploration (see resetStacks)
 	# to go back on expanded tab in menubar (see collapseMenu)
-	menubar = []
+	menubar = None
 	# list of objects to hide keeping their children
-	layoutableObj = []
+	layoutableObj = None
 	# to adjust focus when expanding a menu tab
 	isExpandingMenu = False
 	# list expanded menu tab (ideally one)
-	expandedMenu = []
+	expandedMenu = None
 	# to adjust focus when expanding a submenu
 	isExpandingSubmenu = False
 	# list expanded submenus (potentially nested)
-	expandedSubmenu = []
+	expandedSubmenu = None
 	# to control events and avoid focus problems/lost
 	isCollapsingSubmenu = False
 	# list of initial menu item(s) expanded in a submenu
-	collapsingMenuItem = []
+	collapsingMenuItem = None
+	# snapshot of Ribbon explored so far (see model.py)
+	model = None
+	# properties prefetched when a tab/submenu expands (see uiaCache.py)
+	uiaCache = None
+	# presentationType rules, compiled once
+	ruleEngine = RuleEngine(RULES)
+	# windows of Ribbon, recorded at exploration start
+	ribbonScope = None
+	# commands seen so far, for search (see search.py)
+	commandIndex = None
+	# Ribbon layout of last session (see layoutStore.py)
+	layoutStore = None
+	# model, caches and index of windows explored before (see context.py)
+	contexts = None
+	# search mode: typed text, results and current one
+	searching = False
+	searchText = ""
+	searchResults = []
+	searchPos = 0
+	# path still to follow to reach a search result,
+	# and obj to expand when it gets focus
+	pendingPath = None
+	pendingExpansion = None
+	# times a path step was tried again, Office being busy (see retryPathStep)
+	pathRetries = 0
+	# idle-time prefetch of neighbour tabs and Ribbon (see prefetch.py)
+	prefetcher = None
+	# tab stops of expanded tab/submenus, to force focus (see focusPlan.py)
+	focusPlanner = None
+	# obj of last gainFocus, that is where focus really is
+	focusObj = None
+	# obj to be reached by keys sent in forceFocus,
+	# with number of keys sent and of gainFocus received since then
+	pendingFocus = None
+	focusPlanned = 0
+	focusMoves = 0
+	# expansion/collapse/focus move waiting for Office (see transaction.py)
+	transaction = None
+	# focusEntered events queued while waiting Office (see coalesce.py)
+	coalescer = None
+	# thread of live Ribbon queries (see query.py)
+	queryWorker = None
+	# held navigation keys (see repeat.py)
+	keyRepeat = None
+	# runtime id of obj focused by last report of held keys,
+	# whose gainFocus can come after next script started (see commitRepeat)
+	repeatFocusId = None
+	# items of gallery explored last (see gallery.py)
+	gallery = None
+	# speech and braille from cached properties (see reporter.py)
+	reporter = None
+
+	def __init__(self):
+		super(GlobalPlugin, self).__init__()
+		self.appInfos = AppInfoCache()
+		self.contexts = ContextCache()
+		self.resetStacks()
+
+	def resetStacks(self, model=None):
+		# objects are kept as handles, by model when given (see utils.ObjStack);
+		# new stacks at every exploration start, so nothing is left
+		# by a previous one ended without explorationEnd
+		self.menubar = ObjStack(16, model)
+		# for membership only, never resolved
+		self.layoutableObj = ObjStack(256)
+		self.expandedMenu = ObjStack(16, model)
+		self.expandedSubmenu = ObjStack(32, model)
+		self.collapsingMenuItem = ObjStack(32, model)
+
+	def getScript(self, gesture):
+		# a key is pressed: user is not idle anymore
+		if self.prefetcher:
+			self.prefetcher.cancel()
+		if self.queryWorker:
+			self.queryWorker.cancel()
+		if self.transaction and self.transaction.late:
+			# stop waiting a late expansion
+			self.transaction.flush()
+		script = super(GlobalPlugin, self).getScript(gesture)
+		if self.keyRepeat and getattr(script, "__name__", None) != self.keyRepeat.scriptName:
+			# not a repeat: userObj must be reported before
+			self.keyRepeat.flush()
+		return script
 
 	def chooseNVDAObjectOverlayClasses(self, obj, clsList):
 		if not self.exploring:
 			return
 		if not obj:
 			return
-#		debugLog("Running %s for obj %s,%s"%(inspect.currentframe().f_code.co_name,obj.name, obj.role))
-		# speed-up
-		global content, layout, unavailable
-		objRole = obj.role
-		if objRole == roles.EDITABLETEXT and isRibbonRoot(obj.simpleParent):
-			clsList.insert(0, EditWithoutSelection)
+		# early-out for document, task panes, status bar...
+		if not self.ribbonScope.contains(obj):
 			return
-		if isRibbonRoot(obj):
-			# to simplify check of menubar items
-#			debugLog("Root, set content")
-			obj.presentationType = content
-			# speed-up: always return immediately
-			return
-		elif obj in self.layoutableObj:
-#			debugLog("Redundant obj whose we want children of, set layout")
-			obj.presentationType = layout
-			return
-		elif not obj.name and objRole == roles.MENUITEM:
-#			debugLog("Anonymous menuitem, set layout")
-			obj.presentationType = layout
-			return
-		elif objRole == roles.TABCONTROL:
-			# to simplify menubar exploration (enforcing)
-#			debugLog("Role tabcontrol, set layout")
-			obj.presentationType = layout
-			return
-		elif isSubtab(obj):
-#			debugLog("Subtab, set content")
-			obj.presentationType = content
-			return
-		elif obj in self.expandedMenu:
-			# for expanded menu
-#			debugLog("ExpandedMenu, set layout")
-			obj.presentationType = layout
-			return
-		elif objRole == roles.POPUPMENU and not obj.states:
-			# to select this as simpleParent when closing submenu
-#			debugLog("Role popupmenu without states, set content")
-			obj.presentationType = content
-			return
-		elif hasattr(obj, "UIAElement") and obj.UIAElement.cachedClassName in ("NetUIRepeatButton", "NetUIScrollBar", "NetUIAppFrameHelper"):
-			# to hide scrolling and window-action buttons
-#			debugLog("CachedClassName %s, set unavailable"%obj.UIAElement.cachedClassName)
-			obj.presentationType = unavailable
-			return
-		elif not obj.name or obj.name.isspace():
-			# generic
-#			debugLog("Anonymous obj, set layout")
-			obj.presentationType = layout
-			return
-		elif obj.presentationType == unavailable:
-			# for menu items not currently available,
-			# but which we want to show to users
-#			debugLog("PresType unavailable, set content")
-			obj.presentationType = content
-			return
-		elif objRole == roles.DATAGRID and obj.description:
-			# to hide in grouping (it should be a grid associated to a visible button)
-#			debugLog("Role datagrid has description, set unavailable")
-			obj.presentationType = unavailable
-			return
-		elif objRole == roles.DATAGRID and not obj.description:
-			# to show in submenu
-			if allObjPassCheck(lambda i: i.role == roles.GROUPING and i.presentationType == i.presType_content, obj.children):
-				obj.presentationType = layout
-			else:
-				# ...manage other cases
-#				debugLog("...set content")
-				obj.presentationType = content
-			return
-		elif objRole == roles.LIST:
-			# to explore children only
-#			debugLog("Role list, set layout")
-			obj.presentationType = layout
+		# see rules.py
+		rule = self.ruleEngine.classify(obj, self)
+		if rule is None:
 			return
-		elif objRole == roles.GROUPING:
-#			debugLog("Role grouping, set content")
-			obj.presentationType = content
-			return
-		elif objRole in (roles.GRAPHIC, roles.STATICTEXT):
-			# rare and useless, hide
-#			debugLog("Role %s, set unavailable"%objRole)
-			obj.presentationType = unavailable
+		elif rule.result == OVERLAY:
+			clsList.insert(0, EditWithoutSelection)
+		else:
+			obj.presentationType = rule.result
 
 	def event_foreground(self, obj, nextHandler):
 		nextHandler()
-		if isOfficeApp(obj):
-			self.supportedApp = True
-		else:
-			self.supportedApp = False
+		self.appInfo = self.appInfos.get(obj)
+		self.supportedApp = self.appInfo.supported
 
+	@recorded
+	@traced
+	@snapshotted
 	def event_focusEntered(self, obj, nextHandler):
 		if not self.supportedApp:
 			nextHandler()
@@ -203,46 +231,67 @@ class GlobalPlugin(globalPluginHandler.GlobalPlugin):
 		elif not self.exploring and isRibbonRoot(obj):
 			debugLog("Exploration starts")
 			obj.presentationType = obj.presType_content
-			self.explorationStart()
+			self.explorationStart(obj)
 			return
 		elif not self.exploring:
 			# stop immediately
 			nextHandler()
 			return
-		debugLog("Running %s for obj %s,%s"%(inspect.currentframe().f_code.co_name,obj.name,obj.role))
-		if obj.role == roles.MENUITEM and isRibbonRoot(obj.parent):
+		if read(obj, "role") == roles.MENUITEM and isRibbonRoot(obj.parent):
 			# in v1
 			obj.presentationType = obj.presType_layout
 			return
-		elif obj.role == roles.TABCONTROL:
-			debugLog("Mute %s"%obj.role)
+		elif read(obj, "role") == roles.TABCONTROL:
+			debugLog(lambda: "Mute %s"%obj.role)
 			obj.presentationType = obj.presType_layout
 			return
-		elif self.isExpandingMenu:
-			# self.userObj should be a menu tab, set by last gainFocus
-			# while obj the child of lower multi tab, containing current menu items
-			if isSubtab(obj.parent):
-				debugLog("Found groupMenu %s"%obj.name)
-				self.expandedMenu.append(obj)
-			debugLog("Ignore event")
-			return
-		elif self.isExpandingSubmenu:
-			if obj.role in (roles.TOOLBAR, roles.POPUPMENU):
-				debugLog("Found submenu")
-				self.expandedSubmenu.append(obj)
-			debugLog("Ignore event")
-			return
-		elif self.isCollapsingSubmenu:
-			debugLog("Ignore event")
+		elif self.isExpandingMenu or self.isExpandingSubmenu or self.isCollapsingSubmenu:
+			# part of a burst, see focusEnteredBurst
+			debugLog("Queue event")
+			self.coalescer.add(obj)
 			return
 		debugLog("Process event")
 		nextHandler()
 
+	def focusEnteredBurst(self, objs):
+		# objs ignored while waiting Office, deepest first;
+		# returns how many were handled, others are dropped
+		handled = 0
+		if self.isExpandingMenu:
+			# self.userObj should be a menu tab, set by last gainFocus
+			# while obj the child of lower multi tab, containing current menu items
+			for obj in objs:
+				handled += 1
+				if isSubtab(obj.parent):
+					debugLog(lambda: "Found groupMenu %s"%obj.name)
+					self.expandedMenu.append(obj)
+					break
+		elif self.isExpandingSubmenu:
+			for obj in objs:
+				handled += 1
+				if read(obj, "role") in (roles.TOOLBAR, roles.POPUPMENU):
+					debugLog("Found submenu")
+					self.expandedSubmenu.append(obj)
+					break
+		return handled
+
+	@recorded
+	@traced
+	@snapshotted
 	def event_gainFocus(self, obj, nextHandler):
 		if not self.exploring:
 			nextHandler()
 			return
-		debugLog("Running %s for obj %s,%s"%(inspect.currentframe().f_code.co_name,obj.name,obj.role))
+		self.focusObj = obj
+		# focusEntered events before this one
+		self.coalescer.flush()
+		if self.repeatFocusId is not None:
+			repeatFocus = getRuntimeId(obj) == self.repeatFocusId
+			self.repeatFocusId = None
+			if repeatFocus and (self.isExpandingMenu or self.isExpandingSubmenu):
+				# expansion started by next script is still to come
+				debugLog("Focus of held keys report, wait expansion")
+				return
 		if self.isExpandingMenu:
 			# first gainFocus after expandMenu claims expansion as terminated
 			# and performs action for adjusting focus
@@ -258,134 +307,401 @@ class GlobalPlugin(globalPluginHandler.GlobalPlugin):
 			if obj == self.collapsingMenuItem[-1]:
 				# focus returned on menu
 				self.isCollapsingSubmenu = False
+				self.endTransaction()
 				self.collapsingMenuItem.pop()
-				debugLog("Set %s as userObj"%obj.name)
+				debugLog(lambda: "Set %s as userObj"%obj.name)
 				self.userObj = obj
 				nextHandler()
 				debugLog("Successfully closing submenu without exploration exit")
 			return
-		elif not isRibbonInAncestors() or obj.role in (roles.EDITABLETEXT,):
+		elif self.pendingFocus is not None:
+			self.focusPlanStep(obj, nextHandler)
+			return
+		elif not self.ribbonScope.inFocusAncestors() or read(obj, "role") in (roles.EDITABLETEXT,):
 			self.explorationEnd()
 		else:
-			debugLog("Set %s as userObj"%obj.name)
+			debugLog(lambda: "Set %s as userObj"%obj.name)
 			self.userObj = obj
+			if self.pendingExpansion is not None and getRuntimeId(obj) == getRuntimeId(self.pendingExpansion):
+				# focus arrived on a step of search path
+				self.pendingExpansion = None
+				nextHandler()
+				self.expandPathStep(obj)
+				return
 		debugLog("Process event")
 		nextHandler()
 
+	@recorded
+	@traced
+	@snapshotted
 	def event_loseFocus(self, obj, nextHandler):
 		if not self.exploring:
 			nextHandler()
 			return
-		debugLog("Running %s for obj %s,%s"%(inspect.currentframe().f_code.co_name,obj.name,obj.role))
-		if not obj.name and obj.role == roles.MENUITEM:
+		if not read(obj, "name") and read(obj, "role") == roles.MENUITEM:
 			debugLog("Collapsing submenu. Ignore event to avoid exploration ending")
 			return
 		nextHandler()
 
-	def explorationStart(self):
-		debugLog("Running %s"%inspect.currentframe().f_code.co_name)
+	@traced
+	def explorationStart(self, root):
+		if self.queryWorker:
+			# previous exploration not ended (an error): its thread is stopped,
+			# not left waiting with Ribbon objects of its last query
+			self.queryWorker.stop()
+		self.ribbonScope = RibbonScope(root)
+		self.queryWorker = QueryWorker()
+		context = self.contexts.take(root.windowHandle, getRuntimeId(root))
+		if context:
+			self.resumeContext(context)
+		else:
+			self.uiaCache = SubtreeCache()
+			self.model = RibbonModel(root.windowHandle, self.uiaCache, self.queryWorker)
+			self.commandIndex = CommandIndex()
+			storeKey = getStoreKey(self.appInfo)
+			if storeKey:
+				self.layoutStore = LayoutStore(storeKey, [rule.name for rule in RULES])
+				if self.layoutStore.load():
+					self.ruleEngine.importMemo(self.layoutStore.rules)
+		self.prefetcher = Prefetcher(self)
+		self.focusPlanner = FocusPlanner()
+		self.coalescer = EventCoalescer(self.focusEnteredBurst)
+		self.keyRepeat = KeyRepeat(self.commitRepeat)
+		self.reporter = Reporter(self.uiaCache)
+		self.resetStacks(self.model)
+		recordTree(root)
 		self.exploring = True
 		self.startReviewMode = review.getCurrentMode()
 		review.setCurrentMode("object", updateReviewPosition=False)
 		self.userObj = api.getFocusObject()
 		self.userObjHasFocus = True
+		self.bindExplorationGestures()
+		self.prefetcher.schedule()
+		if context:
+			# after focus of Ribbon is reported
+			core.callLater(0, self.verifyContext, context.lastTab)
+
+	def resumeContext(self, context):
+		debugLog("Resume context of window")
+		# properties prefetched before are not valid anymore
+		self.uiaCache = SubtreeCache()
+		self.model = context.model
+		self.model.source = self.uiaCache
+		self.model.worker = self.queryWorker
+		self.commandIndex = context.commandIndex
+		self.layoutStore = context.layoutStore
+		# tab content changed, or collapsed, while user was away
+		self.model.invalidateTab()
+
+	def verifyContext(self, lastTab):
+		# tabs may be changed too (contextual ones), so links between them:
+		# only tabs are checked, content is refreshed when tabs expand.
+		# Kept tabs get live objs from the same walk, with no live step
+		if not self.exploring or self.menubar or self.isExpandingMenu:
+			# user is already in a tab
+			return
+		index = self.commandIndex
+		elements = {}
+		try:
+			tabs = self.walkTabs(elements)
+		except QueryTimeout:
+			tabs = None
+		tabNames = [name for key, name, props in tabs] if tabs is not None else None
+		if tabNames is None or (index.tabNames and tabNames != index.tabNames) or not self.tabsKept(tabs):
+			debugLog("Tabs changed, forget them")
+			self.model.clear()
+			if tabNames:
+				index.addTabs(tabNames)
+			return
+		if not index.tabNames:
+			index.addTabs(tabNames)
+		# objs created from elements are classified with walked properties
+		self.uiaCache.addProps((key, None, props) for key, name, props in tabs)
+		self.model.rebind(elements)
+		node = self.model.nodes.get(lastTab) if lastTab else None
+		if RESUME_LAST_TAB and node is not None and getRuntimeId(self.userObj) != lastTab:
+			# context keeps no live obj, tab is found again
+			try:
+				tab = self.findMenu(self.userObj, node.name)
+			except QueryTimeout:
+				# Office busy (this is a timer, no script catches it):
+				# user stays on focused tab, as in a cold start
+				debugLog("Last tab not found in time, forget tabs")
+				self.model.clear()
+				return
+			if tab is not None:
+				self.reportUser(tab)
+
+	def walkTabs(self, elements):
+		# (runtime id, name, props) of tabs, in order, in one call for their list;
+		# None if user is not on a tab. elements gets their UIA elements
+		tab = self.userObj
+		if self.uiaCache.getProp(tab, "className") != TAB_CLASS:
+			return None
+		nodes = walkSubtree(self.model.rawParent(tab), elements)
+		if nodes is None:
+			return None
+		return [(runtimeId, props["name"], props) for runtimeId, parentId, props in nodes if props.get("className") == TAB_CLASS and props.get("name")]
+
+	def tabsKept(self, tabs):
+		# tab nodes of model against walked tabs: none gone or renamed,
+		# and links between them to the same neighbours
+		nodes = self.model.nodes
+		names = dict((key, name) for key, name, props in tabs)
+		for key, node in nodes.items():
+			if node.className == TAB_CLASS and names.get(key) != node.name:
+				return False
+		for (prevKey, prevName, prevProps), (nextKey, nextName, nextProps) in zip(tabs, tabs[1:]):
+			prevNode = nodes.get(prevKey)
+			nextNode = nodes.get(nextKey)
+			if prevNode is not None and prevNode.links.get("simpleNext", nextNode) is not nextNode:
+				return False
+			if nextNode is not None and nextNode.links.get("simplePrevious", prevNode) is not prevNode:
+				return False
+		return True
+
+	def terminate(self):
+		if self.exploring:
+			self.explorationEnd()
+		self.contexts.clear()
+		self.appInfos.clear()
+		waitWrites()
+		super(GlobalPlugin, self).terminate()
+
+	def crawlRibbon(self, nodes):
+		# index of tabs and shown content, completed by last session if same Ribbon
+		index = self.commandIndex
+		index.crawl(nodes)
+		info = self.appInfo
+		if info and not info.view:
+			info.view = getRibbonView(nodes)
+			debugLog(lambda: "Ribbon view: %s"%info.view)
+		store = self.layoutStore
+		if store and store.validate(index.tabNames, index.contentCounts):
+			index.addStored(store.tabs)
+			debugLog(lambda: "Layout of %d tabs restored"%len(store.tabs))
+
+	def saveLayout(self):
+		index = self.commandIndex
+		if not index or not index.crawled:
+			# tab names unknown, so no fingerprint
+			return
+		store = self.layoutStore
+		# nothing indexed or classified since last save: layout not built again
+		revision = (index.revision, self.ruleEngine.revision)
+		if revision == store.revision:
+			return
+		store.revision = revision
+		counts = dict(store.counts) if store.trusted else {}
+		counts.update(index.contentCounts)
+		store.save(index.tabNames, counts, index.getLayout(), self.ruleEngine.exportMemo())
+
+	def bindExplorationGestures(self):
 		# simple gestures
 		for gesture in ("tab", "escape", "enter", "downArrow", "leftArrow", "rightArrow", "upArrow"):
 			self.bindGesture("kb:%s"%gesture, gesture)
 		self.bindGesture("kb:shift+tab", "shiftTab")
 		self.bindGesture("kb:alt+upArrow", "altUpArrow")
 		self.bindGesture("kb:alt+downArrow", "altDownArrow")
+		self.bindGesture("kb:pageDown", "pageDown")
+		self.bindGesture("kb:pageUp", "pageUp")
 		self.bindGesture("kb:NVDA+space", "toggleExploration")
+		self.bindGesture("kb:control+f", "search")
+		if trace.ENABLED:
+			self.bindGesture("kb:NVDA+control+shift+d", "dumpTrace")
 		# for debug
 #		self.bindGesture("kb:i", "debug")
 
+	@traced
 	def explorationEnd(self):
-		debugLog("Running %s"%inspect.currentframe().f_code.co_name)
 		self.exploring = False
+		engine = self.ruleEngine
+		debugLog(lambda: "Classified %d objects in %.1f ms, %d from memo, rules: %s"%(engine.classified, engine.totalTime*1000, engine.memoHits, engine.ruleHits))
+		if self.prefetcher:
+			self.prefetcher.cancel()
+			debugLog(lambda: "Prefetched %d steps, %d times cancelled"%(self.prefetcher.done, self.prefetcher.cancelled))
+			self.prefetcher = None
+		if self.focusPlanner:
+			planner = self.focusPlanner
+			debugLog(lambda: "Focus planned %d times, %d keys, %d failed"%(planner.plans, planner.plannedKeys, planner.failures))
+			self.focusPlanner = None
+		if self.coalescer:
+			coalescer = self.coalescer
+			coalescer.cancel()
+			debugLog(lambda: "Coalesced %d focusEntered events, %d dropped, about %.1f ms saved"%(coalescer.queued, coalescer.dropped, coalescer.savedTime()))
+			self.coalescer = None
+		if self.queryWorker:
+			worker = self.queryWorker
+			worker.stop()
+			debugLog(lambda: "Queried %d times, %d timed out, %d late, %d cancelled"%(worker.queries, worker.timeouts, worker.late, worker.cancelled))
+			self.queryWorker = None
+		if self.keyRepeat:
+			keyRepeat = self.keyRepeat
+			keyRepeat.cancel()
+			debugLog(lambda: "Key repeats: %d reports deferred, %d committed"%(keyRepeat.repeats, keyRepeat.commits))
+			self.keyRepeat = None
+		if self.reporter:
+			reporter = self.reporter
+			debugLog(lambda: "Reported %d objects from cache, %d by NVDA"%(reporter.cached, reporter.live))
+			self.reporter = None
+		if self.gallery:
+			gallery = self.gallery
+			debugLog(lambda: "Gallery of %d items: %d moves, %d items walked"%(gallery.count, gallery.moves, gallery.walked))
+			self.gallery = None
+		if self.ribbonScope:
+			scope = self.ribbonScope
+			debugLog(lambda: "Ribbon in focus ancestors: %d times at same position, %d walks"%(scope.ancestorHits, scope.ancestorWalks))
+		self.focusObj = None
+		self.repeatFocusId = None
+		self.pendingFocus = None
+		if self.transaction:
+			self.transaction.cancel()
+			self.transaction = None
 		review.setCurrentMode(self.startReviewMode, updateReviewPosition=False)
 		self.startReviewMode = None
+		lastTab = self.menubar[0] if self.menubar else self.userObj
+		lastTabNode = self.model.cachedNode(lastTab) if self.model and lastTab else None
 		self.userObj = None
 		self.userObjHasFocus = False
-		self.menubar.clear()
-		self.layoutableObj.clear()
 		self.isExpandingMenu = False
-		self.expandedMenu.clear()
 		self.isExpandingSubmenu = False
-		self.expandedSubmenu.clear()
 		self.isCollapsingSubmenu = False
-		self.collapsingMenuItem.clear()
+		self.resetStacks()
+		if self.layoutStore:
+			self.saveLayout()
+		if self.model:
+			model = self.model
+			debugLog(lambda: "Searched focusable %d times, %d objects visited, %d from memo"%(model.focusableSearches, model.focusableVisits, model.focusableMemoHits))
+			model.worker = None
+			model.source = None
+			# tab content is refreshed at resume anyway (see resumeContext),
+			# so context keeps menubar nodes only, and no live obj
+			model.invalidateTab()
+			model.dropObjs()
+			# kept for next exploration of this window
+			lastTabId = lastTabNode.key if lastTabNode is not None and lastTabNode.scope == MENUBAR else None
+			self.contexts.put(ExplorationContext(model.windowHandle, getRuntimeId(self.ribbonScope.root), model, self.commandIndex, self.layoutStore, lastTabId))
+			contexts = self.contexts
+			debugLog(lambda: "%d contexts kept, %d resumed, %d evicted"%(len(contexts.contexts), contexts.resumed, contexts.evicted))
+		self.model = None
+		self.uiaCache = None
+		self.ribbonScope = None
+		self.layoutStore = None
+		self.commandIndex = None
+		self.searching = False
+		self.searchResults = []
+		self.pendingPath = None
+		self.pendingExpansion = None
 		self.clearGestureBindings()
+		recorder.close()
 
+	@recorded
+	@traced
+	@snapshotted
+	@staleOnTimeout
+	@repeatable
 	def script_tab(self, gesture):
 		self.nextItem()
 
+	@recorded
+	@traced
+	@snapshotted
+	@staleOnTimeout
+	@repeatable
 	def script_shiftTab(self, gesture):
 		self.prevItem()
 
+	@recorded
+	@traced
+	@snapshotted
 	def script_escape(self, gesture):
-		debugLog("Running %s"%inspect.currentframe().f_code.co_name)
 		superEsc = True
 		try:
-			if isRibbonRoot(self.userObj.simpleParent) or isSubtab(self.userObj.parent):
+			if self.model.isRibbonRoot(self.model.parent(self.userObj)) or self.model.isSubtab(self.model.rawParent(self.userObj)):
 				debugLog("isRibbon or isTab, pass escape")
 				gesture.send()
 			elif superEsc:
 				debugLog("SuperEsc, go to main menu")
 				self.collapseMenu()
-			elif self.userObj.parent in self.expandedMenu:
+			elif self.model.rawParent(self.userObj) in self.expandedMenu:
 				debugLog("Escaping from expandedMenu, focus menu in menubar")
 				self.collapseMenu()
 			else:
 				debugLog("Go to parent")
 				self.parentItem()
+		except QueryTimeout:
+			self.reportStale()
 		except: # ensure end in case of problems
 			debugLog("Exception, terminate exploration")
 			self.explorationEnd()
 
+	@recorded
+	@traced
+	@snapshotted
+	@staleOnTimeout
+	@repeatable
 	def script_downArrow(self, gesture):
-		debugLog("Running %s"%inspect.currentframe().f_code.co_name)
-		if isRibbonRoot(self.userObj.simpleParent):
+		if self.model.isRibbonRoot(self.model.parent(self.userObj)):
 			self.expandMenu(self.userObj)
 		else:
 			self.nextItem()
 
+	@recorded
+	@traced
+	@snapshotted
+	@staleOnTimeout
+	@repeatable
 	def script_upArrow(self, gesture):
-		debugLog("Running %s"%inspect.currentframe().f_code.co_name)
-		if isRibbonRoot(self.userObj.simpleParent):
+		if self.model.isRibbonRoot(self.model.parent(self.userObj)):
 			self.expandMenu(self.userObj)
 		else:
 			self.prevItem()
 
+	@recorded
+	@traced
+	@snapshotted
+	@staleOnTimeout
+	@repeatable
 	def script_leftArrow(self, gesture):
-		debugLog("Running %s"%inspect.currentframe().f_code.co_name)
-		if isRibbonRoot(self.userObj.simpleParent):
+		if self.model.isRibbonRoot(self.model.parent(self.userObj)):
 			self.prevMenu()
 		else:
 			self.parentItem()
 
+	@recorded
+	@traced
+	@snapshotted
+	@staleOnTimeout
+	@repeatable
 	def script_rightArrow(self, gesture):
-		debugLog("Running %s"%inspect.currentframe().f_code.co_name)
-		if isRibbonRoot(self.userObj.simpleParent):
+		if self.model.isRibbonRoot(self.model.parent(self.userObj)):
 			self.nextMenu()
 		else:
 			self.childItem()
 
+	@recorded
+	@traced
+	@snapshotted
+	@staleOnTimeout
 	def script_enter(self, gesture):
-		debugLog("Running %s"%inspect.currentframe().f_code.co_name)
-		if states.OFFSCREEN in self.userObj.states:
+		if states.OFFSCREEN in read(self.userObj, "states"):
 			self.userObj.doAction()
-		elif not self.userObjHasFocus or states.UNAVAILABLE in self.userObj.states:
+		elif not self.userObjHasFocus or states.UNAVAILABLE in read(self.userObj, "states"):
 			ui.message(NVDALocale("No action"))
-		elif isRibbonRoot(self.userObj.simpleParent):
+		elif self.model.isRibbonRoot(self.model.parent(self.userObj)):
 			self.expandMenu(self.userObj)
 		# splitbutton must perform default action on enter
-		elif states.COLLAPSED in self.userObj.states and self.userObj.role != roles.SPLITBUTTON:
+		elif states.COLLAPSED in read(self.userObj, "states") and read(self.userObj, "role") != roles.SPLITBUTTON:
 			self.expandSubmenu(self.userObj)
 		else:
+			# command can change Ribbon
+			self.uiaCache.dropPrefetched()
 			gesture.send()
 
+	@recorded
+	@traced
+	@snapshotted
 	def script_altUpArrow(self, gesture):
-		debugLog("Running %s"%inspect.currentframe().f_code.co_name)
 		if self.expandedSubmenu:
 			self.collapseSubmenu()
 		elif self.expandedMenu:
@@ -393,44 +709,244 @@ class GlobalPlugin(globalPluginHandler.GlobalPlugin):
 		else:
 			ui.message(NVDALocale("No action"))
 
+	@recorded
+	@traced
+	@snapshotted
+	@staleOnTimeout
+	@repeatable
+	def script_pageDown(self, gesture):
+		self.pageMove(gesture, PAGE_SIZE)
+
+	@recorded
+	@traced
+	@snapshotted
+	@staleOnTimeout
+	@repeatable
+	def script_pageUp(self, gesture):
+		self.pageMove(gesture, -PAGE_SIZE)
+
+	def pageMove(self, gesture, offset):
+		gallery = self.getGallery()
+		if gallery is None:
+			self.settleRepeat()
+			gesture.send()
+			return
+		self.reportUser(gallery.moveTo(gallery.index+offset))
+
+	def getGallery(self):
+		# gallery of userObj, None if it is not a gallery item
+		# items are not model nodes (see gallery.py), so role and parent
+		# are not asked to model, that would make nodes of them
+		obj = self.userObj
+		if self.uiaCache.getProp(obj, "role") not in ITEM_ROLES:
+			return None
+		gallery = self.gallery
+		if gallery is not None and gallery.version == self.model.version:
+			index = gallery.find(obj)
+			if index is not None:
+				# an item seen, so in same container
+				gallery.index = index
+				return gallery
+		container = self.model.liveRelative(obj, "parent")
+		positionInfo = read(obj, "positionInfo") or {}
+		index = positionInfo.get("indexInGroup")
+		count = positionInfo.get("similarItemsInGroup")
+		if not index or not count or count <= 1:
+			return None
+		if gallery is not None and gallery.isValid(container) and gallery.count == count:
+			# user moved by arrows out of items seen
+			gallery.items[index-1] = obj
+			gallery.index = index-1
+			return gallery
+		self.gallery = Gallery(self.model, container, obj, index-1, count)
+		return self.gallery
+
+	@recorded
+	@traced
+	@snapshotted
+	@staleOnTimeout
 	def script_altDownArrow(self, gesture):
-		debugLog("Running %s"%inspect.currentframe().f_code.co_name)
-		if not self.userObjHasFocus or states.UNAVAILABLE in self.userObj.states:
+		if not self.userObjHasFocus or states.UNAVAILABLE in read(self.userObj, "states"):
 			ui.message(NVDALocale("No action"))
-		elif isRibbonRoot(self.userObj.simpleParent):
+		elif self.model.isRibbonRoot(self.model.parent(self.userObj)):
 			self.expandMenu(self.userObj)
-		elif states.COLLAPSED in self.userObj.states:
+		elif states.COLLAPSED in read(self.userObj, "states"):
 			self.expandSubmenu(self.userObj)
 
+	@recorded
+	@traced
+	@snapshotted
 	def script_toggleExploration(self, gesture):
-		debugLog("Running %s"%inspect.currentframe().f_code.co_name)
 		if self.exploring:
 			# Translators: a message when user manually disable exploration (NVDA+space)
 			ui.message(_("Exploration end"))
 			self.explorationEnd()
 
+	@recorded
+	@traced
+	@snapshotted
+	def script_search(self, gesture):
+		if not self.commandIndex.crawled:
+			# tabs, and content of selected one, from the Ribbon walk:
+			# when not done yet, it runs on query thread,
+			# and commands known so far are searched meanwhile (see refreshSearch)
+			nodes = self.uiaCache.prefetchedSubtree(getRuntimeId(self.ribbonScope.root))
+			if nodes:
+				self.crawlRibbon(nodes)
+			else:
+				self.prefetcher.walkRibbon()
+		self.searching = True
+		self.searchText = ""
+		self.searchResults = []
+		self.searchPos = 0
+		self.pendingPath = None
+		self.pendingExpansion = None
+		self.clearGestureBindings()
+		for char in SEARCH_CHARS:
+			self.bindGesture("kb:%s"%char, "searchChar")
+		self.bindGesture("kb:space", "searchChar")
+		self.bindGesture("kb:backspace", "searchBackspace")
+		self.bindGesture("kb:downArrow", "searchNext")
+		self.bindGesture("kb:upArrow", "searchPrevious")
+		self.bindGesture("kb:enter", "searchEnter")
+		self.bindGesture("kb:escape", "searchEscape")
+		self.bindGesture("kb:NVDA+space", "toggleExploration")
+		# Translators: a message when search starts (control+f), with number of commands known
+		ui.message(_("Search in %d commands")%len(self.commandIndex))
+
+	@recorded
+	@traced
+	@snapshotted
+	def script_searchChar(self, gesture):
+		key = gesture.mainKeyName
+		char = " " if key == "space" else key
+		if len(char) != 1:
+			return
+		self.searchText += char
+		self.updateSearch()
+
+	@recorded
+	@traced
+	@snapshotted
+	def script_searchBackspace(self, gesture):
+		self.searchText = self.searchText[:-1]
+		if self.searchText:
+			self.updateSearch()
+		else:
+			self.searchResults = []
+			speech.cancelSpeech()
+			# Translators: reported when search text is deleted
+			ui.message(_("Blank"))
+
+	@recorded
+	@traced
+	@snapshotted
+	def script_searchNext(self, gesture):
+		if self.searchResults:
+			self.searchPos = (self.searchPos+1)%len(self.searchResults)
+		self.reportSearchResult()
+
+	@recorded
+	@traced
+	@snapshotted
+	def script_searchPrevious(self, gesture):
+		if self.searchResults:
+			self.searchPos = (self.searchPos-1)%len(self.searchResults)
+		self.reportSearchResult()
+
+	@recorded
+	@traced
+	@snapshotted
+	@staleOnTimeout
+	def script_searchEnter(self, gesture):
+		if not self.searchResults:
+			self.reportSearchResult()
+			return
+		entry = self.searchResults[self.searchPos]
+		self.searchEnd()
+		self.goTo(entry)
+
+	@recorded
+	@traced
+	@snapshotted
+	def script_searchEscape(self, gesture):
+		self.searchEnd()
+		# Translators: a message when user leaves search (escape)
+		ui.message(_("Search end"))
+
+	def searchEnd(self):
+		self.searching = False
+		self.searchResults = []
+		self.clearGestureBindings()
+		self.bindExplorationGestures()
+
+	def updateSearch(self):
+		self.searchResults = self.commandIndex.search(self.searchText)
+		self.searchPos = 0
+		self.reportSearchResult()
+
+	def refreshSearch(self):
+		# index completed during search: results again, without speech,
+		# user stays on the result reported last, if still found
+		if not self.searchText:
+			return
+		current = self.searchResults[self.searchPos] if self.searchResults else None
+		self.searchResults = self.commandIndex.search(self.searchText)
+		self.searchPos = self.searchResults.index(current) if current in self.searchResults else 0
+
+	def reportSearchResult(self):
+		speech.cancelSpeech()
+		if not self.searchResults:
+			# Translators: reported when nothing matches search text
+			ui.message(_("No results for %s")%self.searchText)
+			return
+		entry = self.searchResults[self.searchPos]
+		location = entry.getLocation()
+		# Translators: a search result, with name, where it is (tab and group), position and number of results
+		ui.message(_("{name}, {location}, {pos} of {count}").format(
+			name=entry.name,
+			# Translators: location of a search result when it's a tab
+			location=location if location is not None else _("tab"),
+			pos=self.searchPos+1,
+			count=len(self.searchResults)
+		))
+
+	def script_dumpTrace(self, gesture):
+		count = trace.dumpSpans()
+		ui.message("%d spans in log"%count)
+
 	def script_debug(self, gesture):
 		ui.message("Performing debug script")
 		obj = api.getNavigatorObject()
 		obj.UIALegacyIAccessiblePattern.Select(2)
 
-	def reportUser(self, obj):
+	@traced
+	def reportUser(self, obj, cancel=True):
+		# cancel: previous speech is stale (not a message just given)
 		# it should not happen, but anyway...
 		if obj is None:
 			return
 		self.userObj = obj
 		self.userObjHasFocus = False
-		debugLog("Report obj: %s,%s"%(obj.name,obj.role))
+		if self.pendingFocus is not None:
+			# a planned focus move is superseded
+			self.pendingFocus = None
+			self.endTransaction(reached=False)
+		if self.keyRepeat and self.keyRepeat.active:
+			self.reportRepeat(obj)
+			return
+		if self.prefetcher:
+			self.prefetcher.schedule()
+		debugLog(lambda: "Report obj: %s,%s"%(obj.name,obj.role))
 		# unconditionally set as navigator object
 		api.setNavigatorObject(obj)
-		if not obj.isFocusable:
-			speech.speakObject(obj, reason=REASON_FOCUS)
+		if not read(obj, "isFocusable"):
+			self.reporter.report(obj, withBraille=False, cancel=cancel)
 			return
 		api.setFocusObject(obj)
 		if obj.hasFocus:
 			self.userObjHasFocus = True
-			speech.speakObject(obj, reason=REASON_FOCUS)
-			braille.handler.handleGainFocus(obj)
+			self.reporter.report(obj, cancel=cancel)
 		if not self.userObjHasFocus:
 			try:
 				obj.setFocus()
@@ -439,18 +955,59 @@ class GlobalPlugin(globalPluginHandler.GlobalPlugin):
 				debugLog("SetFocus failed, try forcing")
 				self.forceFocus(obj)
 
+	def reportRepeat(self, obj):
+		# a held key: only name, if known; focus when keys stop (see repeat.py)
+		self.keyRepeat.defer()
+		node = self.model.cachedNode(obj)
+		name = node.name if node is not None else read(obj, "name")
+		speech.cancelSpeech()
+		if name:
+			speech.speakText(name)
+
+	def commitRepeat(self):
+		if self.exploring and self.userObj:
+			speech.cancelSpeech()
+			obj = self.userObj
+			self.reportUser(obj)
+			if self.userObjHasFocus and (self.focusObj is None or getRuntimeId(self.focusObj) != getRuntimeId(obj)):
+				# focus moved by setFocus, its event comes later:
+				# maybe after next script started an expansion (see event_gainFocus)
+				self.repeatFocusId = getRuntimeId(obj)
+
+	def settleRepeat(self):
+		# before acting on real focus (expansion, collapse, keys sent):
+		# a report deferred by held keys must focus userObj first
+		if self.keyRepeat:
+			self.keyRepeat.flush()
+
+	def reportStale(self):
+		# Office did not answer in time: user is still on userObj,
+		# reported with what model knows, without asking Office
+		node = self.model.cachedNode(self.userObj) if self.model else None
+		if node is not None and node.name:
+			# Translators: a message when Office is busy, with the name of object where user still is
+			ui.message(_("Office busy, still on %s")%node.name)
+		else:
+			# Translators: a message when Office is busy and the add-on cannot move
+			ui.message(_("Office busy"))
+
+	@traced
 	def forceFocus(self, obj):
-		debugLog("Forcing focus on %s,%s"%(obj.name, obj.role))
+		debugLog(lambda: "Forcing focus on %s,%s"%(obj.name, obj.role))
 		# offscreen obj can be reported only
-		if states.OFFSCREEN in obj.states:
-			speech.speakObject(obj, reason=REASON_FOCUS)
-			braille.handler.handleGainFocus(obj)
+		if states.OFFSCREEN in read(obj, "states"):
+			self.reporter.report(obj)
+			return
+		# keys from current focus, if its tab stops are known
+		plan = self.focusPlanner.plan(getRuntimeId(self.focusObj), getRuntimeId(obj)) if self.focusObj else None
+		if plan:
+			self.sendFocusPlan(obj, *plan)
 			return
 		# workaround: find previous/next focusable obj,
 		# focus it, then simulate a tab/shift+tab
 		# to get focus on obj we want
 		tryAgain = True
-		if obj.positionInfo: #and obj.positionInfo["indexInGroup"] not in (1, obj.positionInfo["similarItemsInGroup"]):
+		if read(obj, "positionInfo"): #and obj.positionInfo["indexInGroup"] not in (1, obj.positionInfo["similarItemsInGroup"]):
 			scriptRef = scriptHandler._lastScriptRef
 			if scriptRef and scriptRef().__name__ in ("script_downArrow",): #"script_rightArrow"):
 				debugLog("Send downArrow in list")
@@ -459,8 +1016,7 @@ class GlobalPlugin(globalPluginHandler.GlobalPlugin):
 			elif scriptRef and scriptRef().__name__ in ("script_upArrow",):
 				debugLog("Send upArrow in list")
 				InputGesture.fromName("upArrow").send()
-				speech.speakObject(obj, reason=REASON_FOCUS)
-				braille.handler.handleGainFocus(obj)
+				self.reporter.report(obj)
 				tryAgain = False
 		if tryAgain:
 			prevObj = findFocusablePrevious(obj)
@@ -474,9 +1030,10 @@ class GlobalPlugin(globalPluginHandler.GlobalPlugin):
 				debugLog("nextObj.setFocus() success; send shift+tab")
 				InputGesture.fromName("shift+tab").send()
 				tryAgain = False
-		if tryAgain:
+		if tryAgain and not self.focusPlanner.knows(getRuntimeId(obj)):
 			# the last hope: send tab/shift+tab without knowing where the focus is
 			# but first, understand what direction we're moving to
+			# (if tab stops are known, it would not land on obj)
 			scriptRef = scriptHandler._lastScriptRef
 			if scriptRef and scriptRef().__name__ in ("script_tab", "script_downArrow", "script_rightArrow"):
 				debugLog("Send tab blindly")
@@ -486,7 +1043,7 @@ class GlobalPlugin(globalPluginHandler.GlobalPlugin):
 				InputGesture.fromName("shift+tab").send()
 		# and now, see where focus is
 		curFocus = api.getFocusObject()
-		if (curFocus.name, curFocus.role) == (obj.name, obj.role):
+		if (curFocus.name, curFocus.role) == (read(obj, "name"), read(obj, "role")):
 			debugLog("Focus moved successfully")
 			self.userObj = curFocus
 			self.userObjHasFocus = True
@@ -495,32 +1052,83 @@ class GlobalPlugin(globalPluginHandler.GlobalPlugin):
 			debugLog("Moving focus definitely failed")
 			self.userObj = obj
 			self.userObjHasFocus = False
-			speech.speakObject(obj, reason=REASON_FOCUS)
-			braille.handler.handleGainFocus(obj)
+			self.reporter.report(obj)
+
+	def sendFocusPlan(self, obj, key, times):
+		debugLog(lambda: "Send %s %d times"%(key, times))
+		self.userObj = obj
+		self.userObjHasFocus = False
+		self.pendingFocus = obj
+		self.focusPlanned = times
+		self.focusMoves = 0
+		self.beginTransaction("focusPlan", self.focusPlanTimeout)
+		# in a batch, gainFocus events will come later
+		gesture = InputGesture.fromName(key)
+		for i in range(times):
+			gesture.send()
 
+	def focusPlanStep(self, obj, nextHandler):
+		# a gainFocus after sendFocusPlan: intermediate ones are muted
+		target = self.pendingFocus
+		self.focusMoves += 1
+		reached = getRuntimeId(obj) == getRuntimeId(target)
+		if not reached and self.focusMoves < self.focusPlanned:
+			return
+		self.pendingFocus = None
+		self.endTransaction(planned=self.focusPlanned, actual=self.focusMoves, reached=reached)
+		if reached:
+			debugLog("Focus moved successfully")
+			self.userObj = obj
+			self.userObjHasFocus = True
+			nextHandler()
+			return
+		self.focusPlanFailed(target)
+
+	def focusPlanTimeout(self):
+		target = self.pendingFocus
+		self.pendingFocus = None
+		self.endTransaction(planned=self.focusPlanned, actual=self.focusMoves, reached=False)
+		if target is not None:
+			self.focusPlanFailed(target)
+
+	def focusPlanFailed(self, target):
+		# guarantee an output
+		debugLog("Planned focus path failed")
+		self.focusPlanner.failures += 1
+		self.userObj = target
+		self.userObjHasFocus = False
+		self.reporter.report(target)
+
+	@traced
 	def expandMenu(self, menu):
-		debugLog("Running %s"%inspect.currentframe().f_code.co_name)
-		if menu.UIAElement.cachedClassName != "NetUIRibbonTab" and menu.role != roles.MENUITEM and states.COLLAPSED not in menu.states:
+		if menu.UIAElement.cachedClassName != "NetUIRibbonTab" and read(menu, "role") != roles.MENUITEM and states.COLLAPSED not in read(menu, "states"):
 			return
+		self.settleRepeat()
 		# consider expandable menuitem in main menubar as submenu
 		# (like View options)
-		if menu.role == roles.MENUITEM:
+		# if still waiting a previous expansion (see expandMenuTimeout),
+		# menu is already listed
+		if read(menu, "role") == roles.MENUITEM:
+			if not self.isExpandingSubmenu:
+				self.collapsingMenuItem.append(menu)
 			self.isExpandingSubmenu = True
-			self.collapsingMenuItem.append(menu)
+			self.beginTransaction("expandSubmenu", self.expandSubmenuTimeout)
 		# no post action for File tab
-		elif menu.role != roles.BUTTON:
+		elif read(menu, "role") != roles.BUTTON:
+			if not self.isExpandingMenu:
+				self.menubar.append(menu)
 			self.isExpandingMenu = True
-			self.menubar.append(menu)
-		debugLog("List %s as in menubar"%menu.name)
-		if menu.role == roles.MENUITEM:
+			self.beginTransaction("expandMenu", self.expandMenuTimeout)
+		debugLog(lambda: "List %s as in menubar"%menu.name)
+		if read(menu, "role") == roles.MENUITEM:
 			InputGesture.fromName("alt+downArrow").send()
-		elif states.SELECTED not in menu.states:
+		elif states.SELECTED not in read(menu, "states"):
 			menu.doAction()
 		else:
 			InputGesture.fromName("downArrow").send()
 
+	@traced
 	def expandedMenuAction(self):
-		debugLog("Running %s"%inspect.currentframe().f_code.co_name)
 		try:
 			groupMenu = self.expandedMenu[-1]
 		except IndexError:
@@ -528,38 +1136,64 @@ class GlobalPlugin(globalPluginHandler.GlobalPlugin):
 			ui.message(_("Exploration end"))
 			self.explorationEnd()
 			return
+		# new tab content, forget the previous one
+		self.model.invalidateTab()
+		self.model.pushScope(TAB)
+		self.uiaCache.clear()
+		nodes = self.uiaCache.fetch(groupMenu)
+		self.focusPlanner.clear()
+		if nodes:
+			self.focusPlanner.addScope(nodes, TAB_KEYS)
+		if nodes and self.menubar:
+			self.commandIndex.addTabContent(self.uiaCache.getProp(self.menubar[-1], "name"), nodes)
 		newObj = groupMenu.simpleFirstChild
-		if newObj.name in groupMenu.name:
+		if read(newObj, "name") in read(groupMenu, "name"):
 			self.layoutableObj.append(newObj)
+			self.model.forget(newObj)
+			forgetReads(newObj)
 			newObj = newObj.simpleFirstChild
 		self.isExpandingMenu = False
+		self.endTransaction()
+		if self.pendingPath:
+			self.followPendingPath(newObj)
+			return
 		self.reportUser(newObj)
 
-	def collapseMenu(self):
-		debugLog("Running %s"%inspect.currentframe().f_code.co_name)
+	@traced
+	def collapseMenu(self, report=True):
 		newObj = self.menubar.pop()
+		self.model.invalidateTab()
+		self.uiaCache.clear()
+		self.focusPlanner.clear()
 		self.expandedMenu.clear()
 		self.expandedSubmenu.clear()
 		self.collapsingMenuItem.clear()
-		self.reportUser(newObj)
+		if report:
+			self.reportUser(newObj)
+		return newObj
 
+	@traced
 	def expandSubmenu(self, submenu):
-		debugLog("Running %s"%inspect.currentframe().f_code.co_name)
-		if states.UNAVAILABLE in submenu.states:
+		if states.UNAVAILABLE in read(submenu, "states"):
 			# submenu cannot be expanded
 			return
-		self.collapsingMenuItem.append(submenu)
-		if not self.userObjHasFocus and submenu.role == roles.COMBOBOX:
+		self.settleRepeat()
+		if not self.isExpandingSubmenu:
+			self.collapsingMenuItem.append(submenu)
+		tryObj = None
+		if not self.userObjHasFocus and read(submenu, "role") == roles.COMBOBOX:
+			tryObj = self.model.firstFocusable(submenu)
+		if tryObj is not None:
 			debugLog("Try to focus a child")
-			tryObj = findFirstFocusable(submenu)
 			tryObj.setFocus()
 		else:
 			debugLog("Expanding submenu")
 			self.isExpandingSubmenu = True
+			self.beginTransaction("expandSubmenu", self.expandSubmenuTimeout)
 			InputGesture.fromName("alt+downArrow").send()
 
+	@traced
 	def expandedSubmenuAction(self):
-		debugLog("Running %s"%inspect.currentframe().f_code.co_name)
 		try:
 			groupMenu = self.expandedSubmenu[-1]
 		except IndexError:
@@ -567,78 +1201,163 @@ class GlobalPlugin(globalPluginHandler.GlobalPlugin):
 			ui.message(_("Exploration end"))
 			self.explorationEnd()
 			return
+		self.model.pushScope(getRuntimeId(groupMenu))
+		nodes = self.uiaCache.fetch(groupMenu)
+		if nodes:
+			self.focusPlanner.addScope(nodes, MENU_KEYS)
+		if nodes and self.collapsingMenuItem:
+			self.commandIndex.addSubmenu(self.collapsingMenuItem[-1], nodes)
 		newObj = groupMenu.simpleFirstChild
-		if not newObj.isFocusable and newObj.name in groupMenu.name:
+		if not read(newObj, "isFocusable") and read(newObj, "name") in read(groupMenu, "name"):
 			self.layoutableObj.append(newObj)
+			self.model.forget(newObj)
+			forgetReads(newObj)
 			newObj = newObj.simpleFirstChild
 		self.isExpandingSubmenu = False
+		self.endTransaction()
+		if self.pendingPath:
+			self.followPendingPath(newObj)
+			return
 		self.reportUser(newObj)
 
+	@traced
 	def collapseSubmenu(self):
-		debugLog("Running %s"%inspect.currentframe().f_code.co_name)
+		self.settleRepeat()
 		self.expandedSubmenu.pop()
+		self.model.invalidateSubmenu()
 		self.isCollapsingSubmenu = True
+		self.beginTransaction("collapseSubmenu", self.collapseSubmenuTimeout)
 		InputGesture.fromName("alt+upArrow").send()
 
+	def beginTransaction(self, name, fallback):
+		if self.transaction:
+			self.transaction.cancel()
+		self.transaction = Transaction(name, fallback)
+
+	def endTransaction(self, **extra):
+		transaction = self.transaction
+		if transaction is not None:
+			self.transaction = None
+			transaction.done(**extra)
+
+	def expandMenuTimeout(self):
+		self.coalescer.flush()
+		if self.expandedMenu:
+			# focusEntered found tab content, gainFocus is missing
+			self.expandedMenuAction()
+			return
+		# nothing yet: tab again, while waiting late events
+		self.noteQuirk(QUIRK_MISSING_FOCUS)
+		if self.menubar:
+			self.reporter.report(self.menubar[-1], withBraille=False)
+		self.transaction.extend(LATE_DEADLINE, self.expandMenuGiveUp)
+
+	def expandMenuGiveUp(self):
+		# tab already reported, focus is left where Office put it
+		self.isExpandingMenu = False
+		self.endTransaction()
+		if self.menubar:
+			self.menubar.pop()
+
+	def expandSubmenuTimeout(self):
+		self.coalescer.flush()
+		if self.expandedSubmenu:
+			# focusEntered found submenu, gainFocus is missing
+			self.expandedSubmenuAction()
+			return
+		if self.collapsingMenuItem:
+			self.reporter.report(self.collapsingMenuItem[-1], withBraille=False)
+		self.noteQuirk(QUIRK_MISSING_FOCUS)
+		self.transaction.extend(LATE_DEADLINE, self.expandSubmenuGiveUp)
+
+	def expandSubmenuGiveUp(self):
+		self.isExpandingSubmenu = False
+		self.endTransaction()
+		if self.collapsingMenuItem:
+			self.collapsingMenuItem.pop()
+
+	def noteQuirk(self, quirk):
+		if self.appInfo and quirk not in self.appInfo.quirks:
+			debugLog(lambda: "Quirk of %s: %s"%(self.appInfo.appName, quirk))
+			self.appInfo.quirks.add(quirk)
+
+	def collapseSubmenuTimeout(self):
+		# focus did not return on menu item
+		self.noteQuirk(QUIRK_MISSING_FOCUS)
+		self.isCollapsingSubmenu = False
+		self.endTransaction()
+		if self.collapsingMenuItem:
+			self.reportUser(self.collapsingMenuItem.pop())
+		else:
+			# Translators: a message when something goes wrong and exploration ends
+			ui.message(_("Exploration end"))
+			self.explorationEnd()
+
+	@traced
 	def nextItem(self):
-		debugLog("Running %s"%inspect.currentframe().f_code.co_name)
-		nextObj = self.userObj.simpleNext
+		nextObj = self.model.next(self.userObj)
 		# for circular scrolling
 		if not nextObj:
-			nextObj = self.userObj.simpleParent.simpleFirstChild
+			nextObj = self.model.firstChild(self.model.parent(self.userObj))
 		self.reportUser(nextObj)
 
+	@traced
 	def nextMenu(self):
-		debugLog("Running %s"%inspect.currentframe().f_code.co_name)
-		curMenu = self.userObj
-		nextMenu = curMenu.simpleNext
-		if nextMenu and isSubtab(nextMenu):
+		self.reportUser(self.getNextMenu(self.userObj))
+
+	def getNextMenu(self, curMenu):
+		nextMenu = self.model.next(curMenu)
+		if nextMenu and self.model.isSubtab(nextMenu):
 			debugLog("subtab case")
-			nextMenu = nextMenu.simpleNext
+			nextMenu = self.model.next(nextMenu)
 		if not nextMenu:
-			if curMenu.parent.role == roles.UNKNOWN:
+			curMenuParent = self.model.rawParent(curMenu)
+			if self.model.roleOf(curMenuParent) == roles.UNKNOWN:
 				# in v1
-				nextMenu = curMenu.parent.simpleFirstChild
+				nextMenu = self.model.firstChild(curMenuParent)
 			else:
-				nextMenu = curMenu.simpleParent.simpleFirstChild
-		self.reportUser(nextMenu)
+				nextMenu = self.model.firstChild(self.model.parent(curMenu))
+		return nextMenu
 
+	@traced
 	def prevItem(self):
-		debugLog("Running %s"%inspect.currentframe().f_code.co_name)
-		prevObj = self.userObj.simplePrevious
+		prevObj = self.model.previous(self.userObj)
 		# for circular scrolling
 		if not prevObj:
-			prevObj = self.userObj.simpleParent.simpleLastChild
+			prevObj = self.model.lastChild(self.model.parent(self.userObj))
 		self.reportUser(prevObj)
 
+	@traced
 	def prevMenu(self):
-		debugLog("Running %s"%inspect.currentframe().f_code.co_name)
-		curMenu = self.userObj
-		prevMenu = curMenu.simplePrevious
+		self.reportUser(self.getPrevMenu(self.userObj))
+
+	def getPrevMenu(self, curMenu):
+		prevMenu = self.model.previous(curMenu)
 		if prevMenu:
-			if isSubtab(prevMenu):
+			if self.model.isSubtab(prevMenu):
 				debugLog("menu under PanViewer, go previous")
-				prevMenu = prevMenu.simplePrevious
-			elif prevMenu.parent.role == roles.MENUITEM:
+				prevMenu = self.model.previous(prevMenu)
+			elif self.model.roleOf(self.model.rawParent(prevMenu)) == roles.MENUITEM:
 				# in v1
 				debugLog("Full screen, too up! Refer to old parent")
-				prevMenu = curMenu.parent.simpleLastChild
+				prevMenu = self.model.lastChild(self.model.rawParent(curMenu))
 		if not prevMenu:
 			debugLog("No prevMenu, go to simpleParent.simpleLastChild")
-			prevMenu = curMenu.simpleParent.simpleLastChild
-		self.reportUser(prevMenu)
+			prevMenu = self.model.lastChild(self.model.parent(curMenu))
+		return prevMenu
 
+	@traced
 	def parentItem(self):
-		debugLog("Running %s"%inspect.currentframe().f_code.co_name)
-		if self.userObj.parent in self.expandedMenu or isSubtab(self.userObj.parent):
+		rawParent = self.model.rawParent(self.userObj)
+		if rawParent in self.expandedMenu or self.model.isSubtab(rawParent):
 			debugLog("Avoid expanded menu")
 			return
-		parObj = self.userObj.simpleParent
-		if isSubtab(parObj):
+		parObj = self.model.parent(self.userObj)
+		if self.model.isSubtab(parObj):
 			return
 		try:
 			curSubmenu = self.expandedSubmenu[-1]
-			debugLog("curSubmenu is %s"%curSubmenu.name)
+			debugLog(lambda: "curSubmenu is %s"%curSubmenu.name)
 		except IndexError:
 			debugLog("No curSubmenu")
 			curSubmenu = None
@@ -648,16 +1367,146 @@ class GlobalPlugin(globalPluginHandler.GlobalPlugin):
 			return
 		self.reportUser(parObj)
 
+	@traced
 	def childItem(self):
-		debugLog("Running %s"%inspect.currentframe().f_code.co_name)
-		if states.COLLAPSED in self.userObj.states:
+		if states.COLLAPSED in read(self.userObj, "states"):
 			self.expandSubmenu(self.userObj)
 			return
 		else:
-			childObj = self.userObj.simpleFirstChild
+			childObj = self.model.firstChild(self.userObj)
 		if childObj:
 			self.reportUser(childObj)
 
+	@traced
+	def goTo(self, entry):
+		# reaches a search result, expanding its tab and submenus
+		self.pathRetries = 0
+		if self.menubar and entry.path and not self.expandedSubmenu and self.expandedMenu and self.uiaCache.getProp(self.menubar[-1], "name") == entry.tab:
+			# already in its tab
+			self.pendingPath = list(entry.path)
+			self.followPendingPath(self.model.firstChild(self.expandedMenu[-1]))
+			return
+		start = self.collapseMenu(report=False) if self.menubar else self.userObj
+		menu = self.findMenu(start, entry.tab)
+		if menu is None:
+			# Translators: reported when a search result cannot be reached
+			ui.message(_("%s not found")%entry.tab)
+			self.reportUser(start, cancel=False)
+			return
+		if not entry.path:
+			self.reportUser(menu)
+			return
+		self.pendingPath = list(entry.path)
+		self.reportPathStep(menu)
+
+	def findMenu(self, start, name):
+		# tab in menubar with given name, from start
+		getProp = self.uiaCache.getProp
+		startId = getRuntimeId(start)
+		menu = start
+		for i in range(MAX_MENUS):
+			if getProp(menu, "name") == name:
+				return menu
+			menu = self.getNextMenu(menu)
+			if menu is None or getRuntimeId(menu) == startId:
+				break
+		return None
+
+	def reportPathStep(self, obj):
+		# obj must have focus before expanding it
+		hasFocus = obj.hasFocus
+		self.reportUser(obj)
+		if hasFocus:
+			self.expandPathStep(obj)
+		elif self.userObjHasFocus:
+			# see event_gainFocus
+			self.pendingExpansion = obj
+		else:
+			self.pendingPath = None
+
+	def expandPathStep(self, obj):
+		try:
+			isTab = self.model.isRibbonRoot(self.model.parent(obj))
+		except QueryTimeout:
+			self.retryPathStep(self.expandPathStep, obj)
+			return
+		if isTab:
+			self.expandMenu(obj)
+		else:
+			self.expandSubmenu(obj)
+		if not (self.isExpandingMenu or self.isExpandingSubmenu):
+			self.pendingPath = None
+
+	def followPendingPath(self, start):
+		steps = self.pendingPath
+		self.pendingPath = None
+		try:
+			target, remaining = self.followPath(start, steps) if start else (None, None)
+		except QueryTimeout:
+			self.pendingPath = steps
+			self.retryPathStep(self.followPendingPath, start)
+			return
+		if target is None:
+			ui.message(_("%s not found")%steps[-1][0])
+			self.reportUser(start, cancel=False)
+			return
+		if remaining:
+			self.pendingPath = remaining
+			self.reportPathStep(target)
+			return
+		self.reportUser(target)
+
+	def retryPathStep(self, step, obj):
+		# Office busy while following a path from an event (no script to report it):
+		# step(obj) is tried again later, unless a key is pressed meanwhile
+		if self.pathRetries >= MAX_RETRIES:
+			self.pendingPath = None
+			self.reportStale()
+			return
+		self.pathRetries += 1
+		worker = self.queryWorker
+		generation = worker.generation
+		def retry():
+			if self.exploring and self.queryWorker is worker and worker.generation == generation and self.pendingPath:
+				step(obj)
+		core.callLater(RETRY_DELAY, retry)
+
+	def followPath(self, obj, steps):
+		# looks for names in steps from obj and its next siblings, going down;
+		# containers not in path are crossed, and names not found skipped;
+		# stops on a submenu opener, returning steps still to follow
+		return self.findStep(obj, steps, [PATH_VISITS]) or (None, None)
+
+	def findStep(self, obj, steps, budget):
+		siblings = []
+		while obj is not None and budget[0] > 0:
+			budget[0] -= 1
+			siblings.append(obj)
+			obj = self.model.next(obj)
+		name, opensSubmenu = steps[0]
+		getProp = self.uiaCache.getProp
+		for sibling in siblings:
+			if getProp(sibling, "name") != name:
+				continue
+			elif len(steps) == 1:
+				return sibling, []
+			elif opensSubmenu:
+				return sibling, steps[1:]
+			child = self.model.firstChild(sibling)
+			res = self.findStep(child, steps[1:], budget) if child else None
+			if res:
+				return res
+		for sibling in siblings:
+			if budget[0] <= 0:
+				return None
+			child = self.model.firstChild(sibling)
+			res = self.findStep(child, steps, budget) if child else None
+			if res:
+				return res
+		if len(steps) > 1 and siblings:
+			return self.findStep(siblings[0], steps[1:], budget)
+		return None
+
 class EditWithoutSelection(IAccessible):
 
 	def script_caret_moveByLine(self, gesture):
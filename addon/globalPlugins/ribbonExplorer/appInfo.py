@@ -0,0 +1,114 @@
+# -*- coding: UTF-8 -*-
+# Author: Alberto Buffolino
+# License: GPLv2
+import ctypes
+import locale
+import appModuleHandler
+from .utils import *
+try:
+	import winreg
+except ImportError:
+	winreg = None
+
+"""
+What we know about foreground applications, per process.
+event_foreground arrives at every switch, system-wide: isOfficeApp is asked
+once per process, then a dict lookup answers, for Office and any other app.
+A record is valid while its app module is the running one for its process id,
+so it is forgotten when process exits (and its id can be reused).
+For Office, record keeps what later code can consult without asking again:
+application name, version, UI language, Ribbon view (when a Ribbon walk
+shows it) and quirks seen while exploring.
+"""
+
+# Office did not send focus after an expansion or collapse (see transaction.py)
+QUIRK_MISSING_FOCUS = "missingFocus"
+
+def getRibbonView(nodes):
+	# "v1", "v2" or "v3" from nodes of a Ribbon walk (see uiaCache.walkSubtree), None if no tab
+	props = {}
+	view = None
+	for runtimeId, parentId, nodeProps in nodes:
+		props[runtimeId] = nodeProps
+		parent = props.get(parentId, {})
+		className = nodeProps.get("className")
+		if className == "NetUIRibbonTab" and not view:
+			if parent.get("role") == roles.UNKNOWN:
+				# tabs in full screen mode
+				return "v1"
+			view = "v2"
+		elif className == "NetUIPanViewer" and not nodeProps.get("name") and parent.get("name") and parent.get("role") == roles.GROUPING and parent.get("className") == "NetUIElement":
+			# anonymous subtab always shown (see utils.isSubtab)
+			return "v3"
+	return view
+
+def lcidToTag(lcid):
+	return locale.windows_locale[lcid].replace("_", "-").lower()
+
+def getOfficeLanguage(version):
+	# UI language of Office (not the NVDA one), as lowercase tag, None if unknown:
+	# the one chosen in Office options, shared by its applications,
+	# else Windows display language, that Office follows by default
+	if winreg is None or not version:
+		return None
+	keyPath = r"Software\Microsoft\Office\%s.0\Common\LanguageResources"%version.split(".")[0]
+	try:
+		with winreg.OpenKey(winreg.HKEY_CURRENT_USER, keyPath) as key:
+			try:
+				return winreg.QueryValueEx(key, "UILanguageTag")[0].lower()
+			except OSError:
+				# older versions keep a LCID only
+				return lcidToTag(winreg.QueryValueEx(key, "UILanguage")[0])
+	except (OSError, KeyError, AttributeError):
+		pass
+	try:
+		return lcidToTag(ctypes.windll.kernel32.GetUserDefaultUILanguage())
+	except (KeyError, AttributeError):
+		return None
+
+class AppInfo(object):
+
+	__slots__ = ("processID", "appModule", "supported", "appName", "version", "language", "view", "quirks")
+
+	def __init__(self, obj):
+		self.processID = obj.processID
+		self.appModule = obj.appModule
+		self.supported = isOfficeApp(obj)
+		self.appName = None
+		self.version = None
+		self.language = None
+		if self.supported:
+			try:
+				self.appName = self.appModule.appName
+				self.version = self.appModule.productVersion
+			except:
+				pass
+			self.language = getOfficeLanguage(self.version)
+		# "v1", "v2" or "v3", None until known
+		self.view = None
+		self.quirks = set()
+
+class AppInfoCache(object):
+
+	def __init__(self):
+		# process id -> AppInfo
+		self.apps = {}
+
+	def get(self, obj):
+		processID = obj.processID
+		info = self.apps.get(processID)
+		if info is not None and appModuleHandler.runningTable.get(processID) is info.appModule:
+			return info
+		# new process, or an exited one
+		self.prune()
+		info = self.apps[processID] = AppInfo(obj)
+		return info
+
+	def prune(self):
+		runningTable = appModuleHandler.runningTable
+		for processID, info in list(self.apps.items()):
+			if runningTable.get(processID) is not info.appModule:
+				del self.apps[processID]
+
+	def clear(self):
+		self.apps.clear()
@@ -0,0 +1,71 @@
+# -*- coding: UTF-8 -*-
+# Author: Alberto Buffolino
+# License: GPLv2
+import time
+import core
+from . import trace
+
+"""
+Coalescing of focusEntered bursts.
+Expanding a tab or a submenu makes Office move focus deep inside new content,
+so NVDA sends a focusEntered for every new ancestor (content, groupings...), then gainFocus.
+While an expansion or collapse waits (see transaction.py), all of them are ignored,
+but one: the deepest child of subtab, or the deepest submenu, used by expanded*Action.
+So they are only queued: event_focusEntered still reads role of each one
+(and parent of menu items), to mute tab controls and v1 tabs,
+but the handler, that walks parents looking for what it needs, runs in one pass
+from the deepest, stopping at what is needed: when gainFocus ends the burst,
+when the deadline of expansion expires, or at most WINDOW ms after the first one.
+Other events are dropped; handler time saved is estimated
+with the average time of handled ones.
+"""
+
+# max ms an event waits in queue
+WINDOW = 50
+
+class EventCoalescer(object):
+
+	def __init__(self, handler):
+		# handler gets queued objs, deepest first, and returns how many it handled
+		self.handler = handler
+		self.queue = []
+		self.timer = None
+		# for stats
+		self.queued = 0
+		self.handled = 0
+		self.dropped = 0
+		self.handlerTime = 0.0
+
+	def add(self, obj):
+		self.queue.append(obj)
+		self.queued += 1
+		if self.timer is None:
+			self.timer = core.callLater(WINDOW, self.flush)
+
+	def flush(self):
+		if self.timer is not None:
+			self.timer.Stop()
+			self.timer = None
+		if not self.queue:
+			return
+		objs = self.queue
+		self.queue = []
+		start = time.perf_counter()
+		handled = self.handler(reversed(objs))
+		ms = (time.perf_counter()-start)*1000
+		self.handled += handled
+		self.dropped += len(objs)-handled
+		self.handlerTime += ms
+		trace.addSpan("focusEntered burst", "coalesce", ms, events=len(objs), dropped=len(objs)-handled)
+
+	def savedTime(self):
+		# in ms, dropped events at the average cost of handled ones
+		if not self.handled:
+			return 0.0
+		return self.dropped*self.handlerTime/self.handled
+
+	def cancel(self):
+		if self.timer is not None:
+			self.timer.Stop()
+			self.timer = None
+		del self.queue[:]
@@ -0,0 +1,84 @@
+# -*- coding: UTF-8 -*-
+# Author: Alberto Buffolino
+# License: GPLv2
+from collections import OrderedDict
+from .utils import *
+
+"""
+Exploration contexts kept per Office window, to resume warm.
+At exploration end, model (its menubar nodes), search index and layout store
+of the window are kept here, instead of being cleared; pressing alt again
+in the same window (or coming back with alt+tab) resumes them.
+Navigation stacks are not kept: when user leaves, Office collapses everything;
+neither are prefetched properties, not valid anymore on resume.
+On resume, nodes of tab content are dropped, and the tab list is walked again,
+in one call, to check tabs (contextual tabs come and go): if they changed,
+links between them are dropped too (see GlobalPlugin.verifyContext).
+Contexts keep no live object of Office, only runtime ids
+(see RibbonModel.dropObjs): the same walk gives objs of kept tabs back,
+so moving between them needs no live step (see RibbonModel.rebind).
+Contexts are in LRU order, bounded in number and in entries held.
+"""
+
+# max contexts kept
+MAX_CONTEXTS = 8
+# max entries (model nodes, indexed commands) held by all contexts
+MAX_OBJECTS = 50000
+# to put user on tab explored last, instead of the one Office selects
+RESUME_LAST_TAB = False
+
+class ExplorationContext(object):
+
+	def __init__(self, windowHandle, rootId, model, commandIndex, layoutStore, lastTab):
+		self.windowHandle = windowHandle
+		# runtime id of Ribbon root, as windows handles can be reused
+		self.rootId = rootId
+		self.model = model
+		self.commandIndex = commandIndex
+		self.layoutStore = layoutStore
+		# runtime id of tab explored last
+		self.lastTab = lastTab
+
+	def size(self):
+		return len(self.model.nodes)+len(self.commandIndex)
+
+	def release(self):
+		self.model.clear()
+		self.commandIndex.clear()
+
+class ContextCache(object):
+
+	def __init__(self):
+		# window handle -> ExplorationContext, least recently used first
+		self.contexts = OrderedDict()
+		# for stats
+		self.resumed = 0
+		self.evicted = 0
+
+	def take(self, windowHandle, rootId):
+		# context of window, removed from cache while in use; None if missing
+		context = self.contexts.pop(windowHandle, None)
+		if context is None:
+			return None
+		elif context.rootId != rootId:
+			# another window, with same handle
+			context.release()
+			return None
+		self.resumed += 1
+		return context
+
+	def put(self, context):
+		self.contexts.pop(context.windowHandle, None)
+		self.contexts[context.windowHandle] = context
+		total = sum(item.size() for item in self.contexts.values())
+		while len(self.contexts) > MAX_CONTEXTS or (total > MAX_OBJECTS and len(self.contexts) > 1):
+			windowHandle, oldest = self.contexts.popitem(last=False)
+			total -= oldest.size()
+			oldest.release()
+			self.evicted += 1
+			debugLog(lambda: "Context of window %s evicted"%windowHandle)
+
+	def clear(self):
+		for context in self.contexts.values():
+			context.release()
+		self.contexts.clear()
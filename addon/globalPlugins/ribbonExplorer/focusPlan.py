@@ -0,0 +1,75 @@
+# -*- coding: UTF-8 -*-
+# Author: Alberto Buffolino
+# License: GPLv2
+from .utils import *
+
+"""
+Focus path planner, for objects that refuse setFocus (see GlobalPlugin.forceFocus).
+Every subtree fetched at tab/submenu expansion gives the order of its tab stops
+(keyboard focusable, available, on screen, not inside another tab stop),
+as a ring: Office moves focus through it with tab/shift+tab in tab content,
+and with arrows in submenus, wrapping at the end.
+So the shortest key sequence between current focus and a target
+is the shortest way around the ring, known without asking Office.
+"""
+
+# keys moving focus forward/backward
+TAB_KEYS = ("tab", "shift+tab")
+MENU_KEYS = ("downArrow", "upArrow")
+# items moved with arrows inside their list, not tab stops
+LIST_ITEM_ROLES = set([roles.LISTITEM, roles.DATAITEM])
+# longer paths are left to other ways (see GlobalPlugin.forceFocus)
+MAX_KEYS = 8
+
+class FocusPlanner(object):
+
+	def __init__(self):
+		# runtime id -> (ring, index in ring)
+		self.positions = {}
+		# for stats
+		self.plans = 0
+		self.plannedKeys = 0
+		self.failures = 0
+
+	def addScope(self, nodes, keys):
+		# nodes as returned by uiaCache.walkSubtree, parents first
+		ring = []
+		inside = set()
+		for runtimeId, parentId, props in nodes:
+			if parentId in inside:
+				inside.add(runtimeId)
+				continue
+			objStates = props.get("states", ())
+			if states.FOCUSABLE not in objStates or states.UNAVAILABLE in objStates or states.OFFSCREEN in objStates:
+				continue
+			elif props.get("role") in LIST_ITEM_ROLES:
+				continue
+			ring.append(runtimeId)
+			inside.add(runtimeId)
+		if len(ring) < 2:
+			return
+		entry = (ring, keys)
+		for index, runtimeId in enumerate(ring):
+			self.positions[runtimeId] = (entry, index)
+
+	def knows(self, runtimeId):
+		return runtimeId in self.positions
+
+	def plan(self, fromId, toId):
+		# returns (key, times), None if a path is not known
+		start = self.positions.get(fromId)
+		end = self.positions.get(toId)
+		if start is None or end is None or start[0] is not end[0]:
+			return None
+		(ring, keys), index = end
+		forward = (index-start[1])%len(ring)
+		backward = len(ring)-forward
+		if not forward or min(forward, backward) > MAX_KEYS:
+			return None
+		self.plans += 1
+		res = (keys[0], forward) if forward <= backward else (keys[1], backward)
+		self.plannedKeys += res[1]
+		return res
+
+	def clear(self):
+		self.positions.clear()
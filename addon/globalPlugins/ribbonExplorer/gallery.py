@@ -0,0 +1,92 @@
+# -*- coding: UTF-8 -*-
+# Author: Alberto Buffolino
+# License: GPLv2
+from .utils import *
+
+"""
+Paged navigation in galleries (styles, shapes, table and chart styles...).
+A gallery can have hundreds of items, so they are never fetched all:
+from the item where user is, whose position comes from Office,
+pageUp/pageDown walk PAGE_SIZE siblings at most, keeping items seen
+near current position only (MAX_ITEMS), so latency and memory of a move
+do not depend on gallery size. First and last item are reached
+from the container, so a jump near gallery end is not a walk from start.
+Items are not model nodes: they would be kept until the submenu collapses.
+"""
+
+# items moved by pageUp/pageDown
+PAGE_SIZE = 20
+# items kept around current position
+MAX_ITEMS = 3*PAGE_SIZE
+# roles of gallery items
+ITEM_ROLES = (roles.DATAITEM, roles.LISTITEM)
+
+class Gallery(object):
+
+	def __init__(self, model, container, item, index, count):
+		self.model = model
+		self.container = container
+		self.containerId = getRuntimeId(container)
+		# model invalidations make positions unreliable
+		self.version = model.version
+		# 0-based position -> item, near current one
+		self.items = {index: item}
+		self.index = index
+		self.count = count
+		# for stats
+		self.moves = 0
+		self.walked = 0
+
+	def isValid(self, container):
+		return self.version == self.model.version and getRuntimeId(container) == self.containerId
+
+	def find(self, obj):
+		# position of obj if seen, None otherwise
+		runtimeId = getRuntimeId(obj)
+		for index, item in self.items.items():
+			if getRuntimeId(item) == runtimeId:
+				return index
+		return None
+
+	def moveTo(self, target):
+		# item at target position (clamped), walking from nearest known one
+		target = max(0, min(self.count-1, target))
+		if target not in self.items:
+			start = min(self.items, key=lambda index: abs(index-target))
+			if target < abs(start-target):
+				start = self.addEdge(0, "firstChild")
+			elif self.count-1-target < abs(start-target):
+				start = self.addEdge(self.count-1, "lastChild")
+			target = self.walk(start, target)
+		self.index = target
+		self.moves += 1
+		self.prune()
+		return self.items[target]
+
+	def addEdge(self, index, relation):
+		item = self.model.liveRelative(self.container, relation)
+		if item:
+			self.items[index] = item
+			return index
+		return self.index
+
+	def walk(self, start, target):
+		# returns position reached, target if gallery is not shorter than expected
+		step = 1 if target > start else -1
+		relation = "next" if step > 0 else "previous"
+		index = start
+		item = self.items[start]
+		while index != target:
+			item = self.model.liveRelative(item, relation)
+			if not item:
+				break
+			index += step
+			self.items[index] = item
+			self.walked += 1
+		return index
+
+	def prune(self):
+		if len(self.items) <= MAX_ITEMS:
+			return
+		for index in sorted(self.items, key=lambda index: abs(index-self.index))[MAX_ITEMS:]:
+			del self.items[index]
@@ -0,0 +1,155 @@
+# -*- coding: UTF-8 -*-
+# Author: Alberto Buffolino
+# License: GPLv2
+import marshal
+import os
+import threading
+import time
+import globalVars
+from .utils import *
+from . import trace
+
+"""
+Ribbon layout saved across sessions, for warm starts.
+At exploration end, commands of tabs and submenus seen so far (see search.py)
+and classification decisions of rules (see rules.py) are saved with marshal,
+in a file per Office application, version and UI language
+(the Office one, see appInfo.getOfficeLanguage: tab and command names
+follow it, not NVDA language), so next session can search in tabs not visited yet.
+Stored commands are trusted only when the Ribbon walked at start
+has the same fingerprint: same tab names, and same number of commands
+in the tab whose content is shown; otherwise they are ignored,
+and overwritten at exploration end. Runtime ids change between sessions,
+so only names and paths are stored, and a tab visited again replaces its commands.
+Rule decisions depend on static properties only, so they are valid
+while rules are the same (names of rules are stored with them).
+A file is written only when its content changed since loaded or saved,
+and by a thread: a slow disk does not delay speech after leaving the Ribbon.
+"""
+
+# stored data format
+FORMAT = 1
+# path -> data not written yet; one writer thread at a time,
+# so two stores of the same file do not write it together
+pendingWrites = {}
+writeLock = threading.Lock()
+writer = None
+
+def getLayoutFolder():
+	return os.path.join(globalVars.appArgs.configPath, "ribbonExplorer", "layouts")
+
+def getStoreKey(appInfo):
+	# (application, version, language), None if not available
+	if not appInfo or not appInfo.appName or not appInfo.version or not appInfo.language:
+		return None
+	return (appInfo.appName, appInfo.version, appInfo.language)
+
+class LayoutStore(object):
+
+	def __init__(self, key, ruleNames):
+		self.key = key
+		self.ruleNames = tuple(ruleNames)
+		self.path = os.path.join(getLayoutFolder(), "%s.layout"%"-".join(str(part) for part in key))
+		# Ribbon of last session: tab names, tab -> number of commands, tab -> paths of commands
+		self.tabNames = ()
+		self.counts = {}
+		self.tabs = {}
+		# ((class name, role, automation id, name kind, parent signature), rule name or None)
+		self.rules = ()
+		self.loaded = False
+		# fingerprint matched, so stored commands are in use
+		self.trusted = False
+		# content of file, as loaded or last saved, to skip writes of same content
+		self.stored = None
+		# revisions of command index and rule memo at last save (see GlobalPlugin.saveLayout)
+		self.revision = None
+
+	def load(self):
+		start = time.perf_counter()
+		with writeLock:
+			# saved by a previous session, not written yet
+			data = pendingWrites.get(self.path)
+		try:
+			if data is None:
+				# one read: marshal.load would read the file object by small pieces
+				with open(self.path, "rb") as f:
+					data = marshal.loads(f.read())
+			dataFormat, key, ruleNames, tabNames, counts, tabs, rules = data
+		except:
+			# no file, or not readable
+			return False
+		if dataFormat != FORMAT or key != self.key:
+			return False
+		self.tabNames = tabNames
+		self.counts = counts
+		self.tabs = tabs
+		# decisions of other rules are not valid anymore
+		self.rules = rules if ruleNames == self.ruleNames else ()
+		self.loaded = True
+		self.stored = data
+		trace.addSpan("layoutStore", "load", (time.perf_counter()-start)*1000, tabs=len(tabs), rules=len(rules))
+		return True
+
+	def validate(self, tabNames, counts):
+		# fingerprint of live Ribbon against the stored one
+		if not self.loaded or tuple(tabNames) != self.tabNames:
+			return False
+		for tab, count in counts.items():
+			if tab in self.counts and self.counts[tab] != count:
+				return False
+		self.trusted = True
+		return True
+
+	def save(self, tabNames, counts, tabs, rules):
+		# returns True if a write is started
+		data = (FORMAT, self.key, self.ruleNames, tuple(tabNames), counts, tabs, rules)
+		if data == self.stored:
+			debugLog("Layout not changed")
+			return False
+		self.stored = data
+		global writer
+		with writeLock:
+			pendingWrites[self.path] = data
+			if writer is not None:
+				# running writer takes it
+				return True
+			writer = threading.Thread(target=writePending, name="ribbonExplorer layouts")
+			writer.daemon = True
+		writer.start()
+		return True
+
+def writeLayout(path, data):
+	start = time.perf_counter()
+	folder = os.path.dirname(path)
+	tempPath = path+".tmp"
+	try:
+		if not os.path.isdir(folder):
+			os.makedirs(folder)
+		with open(tempPath, "wb") as f:
+			f.write(marshal.dumps(data))
+		os.replace(tempPath, path)
+	except:
+		debugLog("Layout not saved")
+		return False
+	trace.addSpan("layoutStore", "save", (time.perf_counter()-start)*1000, tabs=len(data[5]), rules=len(data[6]))
+	return True
+
+def writePending():
+	global writer
+	while True:
+		with writeLock:
+			if not pendingWrites:
+				writer = None
+				return
+			path, data = next(iter(pendingWrites.items()))
+		writeLayout(path, data)
+		with writeLock:
+			# unless saved again meanwhile
+			if pendingWrites.get(path) is data:
+				del pendingWrites[path]
+
+def waitWrites():
+	# before NVDA exits, so last layouts are not lost
+	thread = writer
+	if thread is not None:
+		thread.join()
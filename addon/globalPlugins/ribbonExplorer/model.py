@@ -0,0 +1,391 @@
+# -*- coding: UTF-8 -*-
+# Author: Alberto Buffolino
+# License: GPLv2
+from .utils import *
+from .trace import countRemoteRead
+from .recorder import recordRead
+from .query import StepPending
+from .uiaCache import hasRawRelations, rawRelative, objFromElement
+
+"""
+In-memory model of the Ribbon, to avoid asking Office again and again
+for relations already discovered (simpleNext, simpleParent, etc).
+Every node is a snapshot of a live object (name, role, states, class name)
+plus the links found so far, already filtered by presentationType rules
+(they are retrieved using .simple* properties of live objects).
+Nodes are grouped in scopes: menubar, current tab and expanded submenus;
+when a scope is closed, its nodes are discarded, with live objects
+pinned by the plugin in that scope (see utils.ObjStack).
+A model kept for next exploration holds no live object (see dropObjs);
+on resume, nodes get them again from elements of one walk (see rebind),
+so links already found need no live step.
+Live relations are read on a worker thread, when given (see query.py):
+there, only raw UIA relations are walked (next, parent, etc), as elements;
+NVDAObjects are created back on main thread, where NVDA creates them
+(overlay classes, with add-on rules, are chosen at creation),
+and .simple* relations are found from them as NVDA does.
+Idle prefetch cannot wait on main thread: with postSteps, a live step
+is posted and StepPending raised; the relation is asked again
+when its result came (see postedSteps).
+"""
+
+# scope of menubar nodes, always present
+MENUBAR = "menubar"
+# scope of expanded tab content
+TAB = "tab"
+# marker for links already fetched, whose result is None
+NOTHING = object()
+# links that can be deduced from the opposite one
+# (not simpleParent from simpleFirstChild: obj could be a layout one)
+REVERSED = {
+	"simpleNext": "simplePrevious",
+	"simplePrevious": "simpleNext",
+}
+
+class RibbonNode(object):
+
+	__slots__ = ("key", "obj", "name", "role", "states", "className", "scope", "links", "subtab")
+
+	def __init__(self, key, obj, scope, source):
+		self.key = key
+		# None while model is kept by a context (see dropObjs)
+		self.obj = obj
+		self.name = source.getProp(obj, "name")
+		self.role = source.getProp(obj, "role")
+		self.states = source.getProp(obj, "states")
+		self.className = source.getProp(obj, "className")
+		self.scope = scope
+		self.links = {}
+		# isSubtab result, computed on request
+		self.subtab = None
+
+class RibbonModel(object):
+
+	def __init__(self, windowHandle, source, worker=None):
+		self.windowHandle = windowHandle
+		# where properties are read from (see uiaCache.py), None while kept by a context
+		self.source = source
+		# where live relations are read, None for main thread
+		self.worker = worker
+		# runtime id -> RibbonNode
+		self.nodes = {}
+		self.scopes = [MENUBAR]
+		# runtime id -> (scope, obj), live objs kept for the plugin
+		self.pinned = {}
+		# increased at every invalidation
+		self.version = 0
+		# increased when tab changes
+		self.tabVersion = 0
+		# (runtime id, tabVersion) -> first focusable descendant, or NOTHING
+		self.focusables = {}
+		# (runtime id, raw relation) -> element read after its query timed out,
+		# for next key
+		self.lateSteps = {}
+		# while set, live steps are posted instead of waited (see prefetch.py)
+		self.postSteps = False
+		# (runtime id, raw relation) -> obj (or None) read by a posted step
+		self.postedSteps = {}
+		# runtime id -> UIA element of a node without live obj (see rebind)
+		self.elements = {}
+		# for stats
+		self.focusableSearches = 0
+		self.focusableVisits = 0
+		self.focusableMemoHits = 0
+
+	def getNode(self, obj):
+		if not obj:
+			return None
+		key = getRuntimeId(obj)
+		if key is None:
+			return None
+		node = self.nodes.get(key)
+		if node is None:
+			node = self.nodes[key] = RibbonNode(key, obj, self.scopes[-1], self.source)
+		else:
+			# keep the most recent instance
+			node.obj = obj
+		return node
+
+	def relative(self, obj, relation):
+		node = self.getNode(obj)
+		if node is None:
+			return self.liveRelative(obj, relation)
+		target = node.links.get(relation)
+		if target is NOTHING:
+			return None
+		elif target is not None and self.nodeObj(target) is not None:
+			return target.obj
+		res = self.liveRelative(obj, relation, node)
+		self.link(node, relation, res)
+		return res
+
+	def nodeObj(self, node):
+		# live obj of node, created from its element if rebound
+		if node.obj is None and node.key in self.elements:
+			node.obj = objFromElement(self.elements.pop(node.key))
+		return node.obj
+
+	def link(self, node, relation, res):
+		target = self.getNode(res)
+		if target is not None:
+			node.links[relation] = target
+			reverse = REVERSED.get(relation)
+			if reverse and reverse not in target.links:
+				target.links[reverse] = node
+		elif not res:
+			node.links[relation] = NOTHING
+
+	def liveRelative(self, obj, relation, node=None):
+		if self.worker is None or not hasRawRelations(obj):
+			countRemoteRead()
+			res = getattr(obj, relation)
+		elif relation == "simpleParent":
+			res = self.simpleParent(obj)
+		elif relation in ("simpleNext", "simplePrevious"):
+			res = self.findSimpleNext(obj, goPrevious=relation == "simplePrevious")
+		elif relation in ("simpleFirstChild", "simpleLastChild"):
+			res = self.simpleChild(obj, relation == "simpleLastChild")
+		else:
+			res = self.liveStep(obj, relation)
+		recordRead(obj, relation, res)
+		return res
+
+	def liveStep(self, obj, relation):
+		# a raw relation, read on worker thread;
+		# QueryTimeout if Office is busy, the element, if any, is kept for next key;
+		# StepPending while posting (see postSteps)
+		key = (getRuntimeId(obj), relation)
+		if self.postSteps and key in self.postedSteps:
+			# kept: the relation asking it can be asked again
+			res = self.postedSteps[key]
+		else:
+			countRemoteRead()
+			if key in self.lateSteps:
+				res = objFromElement(self.lateSteps.pop(key))
+			elif self.postSteps:
+				self.postStep(key, obj, relation)
+				raise StepPending()
+			else:
+				version = self.version
+				def onLate(element):
+					if self.version == version and element:
+						self.lateSteps[key] = element
+				res = objFromElement(self.worker.call(rawRelative, (obj.UIAElement, relation), onLate))
+		recordRead(obj, relation, res)
+		return res
+
+	def postStep(self, key, obj, relation):
+		version = self.version
+		def onDone(element):
+			# on main thread: obj created once, for every time it is asked
+			if self.version == version:
+				self.postedSteps[key] = objFromElement(element)
+		self.worker.post(rawRelative, (obj.UIAElement, relation), onDone)
+
+	# as NVDAObject simple navigation, with live steps
+
+	def simpleParent(self, obj):
+		parent = self.liveStep(obj, "parent")
+		while parent and parent.presentationType != parent.presType_content:
+			parent = self.liveStep(parent, "parent")
+		return parent
+
+	def findSimpleNext(self, obj, useChild=False, useParent=True, goPrevious=False):
+		nextPrevRelation = "next" if not goPrevious else "previous"
+		firstLastChildRelation = "firstChild" if not goPrevious else "lastChild"
+		found = None
+		if useChild:
+			child = self.liveStep(obj, firstLastChildRelation)
+			childPresType = child.presentationType if child else None
+			if childPresType == obj.presType_content:
+				found = child
+			elif childPresType == obj.presType_layout:
+				found = self.findSimpleNext(child, useChild=True, useParent=False, goPrevious=goPrevious)
+			elif child:
+				found = self.findSimpleNext(child, useChild=False, useParent=False, goPrevious=goPrevious)
+			if found:
+				return found
+		next = self.liveStep(obj, nextPrevRelation)
+		nextPresType = next.presentationType if next else None
+		if nextPresType == obj.presType_content:
+			found = next
+		elif nextPresType == obj.presType_layout:
+			found = self.findSimpleNext(next, useChild=True, useParent=False, goPrevious=goPrevious)
+		elif next:
+			found = self.findSimpleNext(next, useChild=False, useParent=False, goPrevious=goPrevious)
+		if found:
+			return found
+		parent = self.liveStep(obj, "parent") if useParent else None
+		while parent and parent.presentationType != obj.presType_content:
+			next = self.findSimpleNext(parent, useChild=False, useParent=False, goPrevious=goPrevious)
+			if next:
+				return next
+			parent = self.liveStep(parent, "parent")
+		return None
+
+	def simpleChild(self, obj, goPrevious):
+		child = self.liveStep(obj, "firstChild" if not goPrevious else "lastChild")
+		if not child:
+			return None
+		presType = child.presentationType
+		if presType != obj.presType_content:
+			return self.findSimpleNext(child, useChild=(presType != obj.presType_unavailable), useParent=False, goPrevious=goPrevious)
+		return child
+
+	def cachedNode(self, obj):
+		# node of obj if already known, without asking Office
+		key = getattr(obj, "_ribbonRuntimeId", None)
+		return self.nodes.get(key) if key is not None else None
+
+	def next(self, obj):
+		return self.relative(obj, "simpleNext")
+
+	def previous(self, obj):
+		return self.relative(obj, "simplePrevious")
+
+	def parent(self, obj):
+		return self.relative(obj, "simpleParent")
+
+	def rawParent(self, obj):
+		# real parent, without presentationType filtering
+		return self.relative(obj, "parent")
+
+	def firstChild(self, obj):
+		return self.relative(obj, "simpleFirstChild")
+
+	def lastChild(self, obj):
+		return self.relative(obj, "simpleLastChild")
+
+	def roleOf(self, obj):
+		node = self.getNode(obj)
+		return node.role if node is not None else obj.role
+
+	def isRibbonRoot(self, obj):
+		node = self.getNode(obj)
+		return isRibbonRoot(node if node is not None else obj)
+
+	def isSubtab(self, obj):
+		node = self.getNode(obj)
+		if node is None:
+			return isSubtab(obj)
+		if node.subtab is None:
+			node.subtab = isSubtab(obj)
+		return node.subtab
+
+	def firstFocusable(self, obj):
+		# see findFirstFocusable; memoized while tab does not change,
+		# so expanding the same combobox again needs no walk
+		key = (getRuntimeId(obj), self.tabVersion)
+		res = self.focusables.get(key)
+		if res is not None:
+			self.focusableMemoHits += 1
+			return res if res is not NOTHING else None
+		res, visits = findFirstFocusable(obj, self.isFocusable)
+		self.focusableSearches += 1
+		self.focusableVisits += visits
+		if key[0] is not None:
+			self.focusables[key] = res if res is not None else NOTHING
+		return res
+
+	def isFocusable(self, obj):
+		# from prefetched states, if any
+		return states.FOCUSABLE in self.source.getProp(obj, "states")
+
+	def forget(self, obj):
+		# obj presentation changed, so links to/from it are not valid anymore
+		key = getRuntimeId(obj) if obj else None
+		if key in self.nodes:
+			self.dropNodes([key])
+
+	def pin(self, obj):
+		# keep obj until its scope is closed, if not a node already
+		key = getRuntimeId(obj)
+		if key is not None and key not in self.nodes:
+			self.pinned[key] = (self.scopes[-1], obj)
+
+	def liveObj(self, key):
+		node = self.nodes.get(key)
+		if node is not None and self.nodeObj(node) is not None:
+			return node.obj
+		entry = self.pinned.get(key)
+		return entry[1] if entry is not None else None
+
+	def release(self, key):
+		self.pinned.pop(key, None)
+
+	def unpin(self, keep=None):
+		# drop pinned objs, except those of keep scopes
+		for key, (scope, obj) in list(self.pinned.items()):
+			if keep is None or scope not in keep:
+				del self.pinned[key]
+
+	def pushScope(self, scope):
+		# a tab or a submenu is expanded
+		self.scopes.append(scope)
+
+	def invalidateSubmenu(self):
+		# a submenu is collapsed
+		if len(self.scopes) <= 1:
+			return
+		scope = self.scopes.pop()
+		self.unpin(keep=self.scopes)
+		self.dropNodes([key for key, node in self.nodes.items() if node.scope == scope])
+
+	def invalidateTab(self):
+		# tab changed, keep menubar only
+		del self.scopes[1:]
+		self.tabVersion += 1
+		self.focusables.clear()
+		self.lateSteps.clear()
+		self.postedSteps.clear()
+		self.unpin(keep=self.scopes)
+		self.dropNodes([key for key, node in self.nodes.items() if node.scope != MENUBAR])
+
+	def dropNodes(self, keys):
+		if not keys:
+			return
+		self.version += 1
+		dropped = set()
+		for key in keys:
+			node = self.nodes.pop(key, None)
+			if node is not None:
+				dropped.add(id(node))
+				node.links.clear()
+			self.elements.pop(key, None)
+		for node in self.nodes.values():
+			for relation, target in list(node.links.items()):
+				if id(target) in dropped:
+					del node.links[relation]
+
+	def dropObjs(self):
+		# model kept by a context (see context.py): nodes and their links
+		# by runtime id only, without live objs; these are taken again
+		# from a walk on resume (see rebind), or by live steps
+		for node in self.nodes.values():
+			node.obj = None
+		self.focusables.clear()
+		self.lateSteps.clear()
+		self.postedSteps.clear()
+		self.elements.clear()
+		self.pinned.clear()
+
+	def rebind(self, elements):
+		# runtime id -> element, of a walk (see uiaCache.walkSubtree):
+		# nodes without live obj take it from there when a relation reaches them
+		for key, element in elements.items():
+			node = self.nodes.get(key)
+			if node is not None and node.obj is None:
+				self.elements[key] = element
+
+	def clear(self):
+		self.version += 1
+		self.tabVersion += 1
+		self.focusables.clear()
+		self.lateSteps.clear()
+		self.postedSteps.clear()
+		for node in self.nodes.values():
+			node.links.clear()
+		self.nodes.clear()
+		self.elements.clear()
+		self.pinned.clear()
+		del self.scopes[1:]
@@ -0,0 +1,216 @@
+# -*- coding: UTF-8 -*-
+# Author: Alberto Buffolino
+# License: GPLv2
+import sys
+from array import array
+
+"""
+Compact store of a Ribbon walk (see uiaCache.walkSubtree).
+A whole Ribbon can have thousands of objects, and a dict of properties
+(with a set of states) per object, kept between expansions and in contexts
+of other windows (see context.py), costs far more than the data itself.
+So the walk is kept as a table: one position per object, strings interned
+(names repeat among tabs and sessions), roles as small ints, states as bits,
+runtime ids packed in one int each (see runtimeKey),
+and parent/first child/next sibling as arrays of positions,
+walked with ints only. NodeView reads one position as a read-only dict,
+where properties of walkSubtree nodes are expected (states as a frozenset,
+shared by positions with same states).
+Only the walk is kept here: model nodes (see model.py) are few per exploration,
+created when the user reaches them, and hold live objs and links, so they stay objects.
+"""
+
+# bit of states mask telling states were available
+STATES_KNOWN = 1<<63
+# bits for states, below STATES_KNOWN
+MAX_STATE_BITS = 63
+# bits per part of a runtime id (UIA gives 32 bit ints)
+RUNTIME_ID_BITS = 32
+_runtimeIdMask = (1<<RUNTIME_ID_BITS)-1
+# state -> bit, and bit -> state, shared by all tables
+_stateBits = {}
+_bitStates = []
+# int -> role, to give back what was stored
+_roles = {}
+# states mask -> frozenset of states, read many times (a set per read costs)
+_maskStates = {}
+
+def _intern(value):
+	return sys.intern(value) if type(value) is str else value
+
+def _stateMask(objStates):
+	# 0 (states not kept, so read live) when a new state has no bit left
+	mask = STATES_KNOWN
+	for state in objStates:
+		bit = _stateBits.get(state)
+		if bit is None:
+			if len(_bitStates) >= MAX_STATE_BITS:
+				return 0
+			bit = _stateBits[state] = len(_bitStates)
+			_bitStates.append(state)
+		mask |= 1<<bit
+	return mask
+
+def runtimeKey(runtimeId):
+	# runtime id as one int: a tuple, and an int object per part, cost more;
+	# leading 1 keeps length (parts can be 0); None when not available
+	if not runtimeId:
+		return None
+	key = 1
+	for part in runtimeId:
+		key = (key<<RUNTIME_ID_BITS) | (part & _runtimeIdMask)
+	return key
+
+def _runtimeId(key):
+	# back from runtimeKey, with signed parts as UIA gives
+	parts = []
+	while key > 1:
+		part = key & _runtimeIdMask
+		parts.append(part-(1<<RUNTIME_ID_BITS) if part >> (RUNTIME_ID_BITS-1) else part)
+		key >>= RUNTIME_ID_BITS
+	parts.reverse()
+	return tuple(parts)
+
+class NodeTable(object):
+
+	def __init__(self, nodes):
+		# nodes as walkSubtree returns them, parents first
+		# position -> runtime key (see runtimeKey)
+		self.keys = []
+		# runtime key -> position, same int objects
+		self.positions = {}
+		self.parent = array("i")
+		self.firstChild = array("i")
+		self.nextSibling = array("i")
+		self.roles = array("i")
+		self.states = array("Q")
+		self.names = []
+		self.classNames = []
+		self.automationIds = []
+		self.descriptions = []
+		self.keyboardShortcuts = []
+		# positionInfo, 0 when not given
+		self.indexesInGroup = array("i")
+		self.similarItems = array("i")
+		lastChild = array("i")
+		for runtimeId, parentId, props in nodes:
+			key = runtimeKey(runtimeId)
+			if key is None or key in self.positions:
+				continue
+			pos = len(self.keys)
+			self.keys.append(key)
+			self.positions[key] = pos
+			parent = self.positions.get(runtimeKey(parentId), -1)
+			self.parent.append(parent)
+			self.firstChild.append(-1)
+			self.nextSibling.append(-1)
+			lastChild.append(-1)
+			if parent >= 0:
+				if lastChild[parent] < 0:
+					self.firstChild[parent] = pos
+				else:
+					self.nextSibling[lastChild[parent]] = pos
+				lastChild[parent] = pos
+			role = props.get("role")
+			if role is None:
+				self.roles.append(-1)
+			else:
+				self.roles.append(int(role))
+				_roles.setdefault(int(role), role)
+			self.states.append(_stateMask(props["states"]) if "states" in props else 0)
+			self.names.append(_intern(props.get("name")))
+			self.classNames.append(_intern(props.get("className")))
+			self.automationIds.append(_intern(props.get("automationId")))
+			self.descriptions.append(_intern(props.get("description")))
+			self.keyboardShortcuts.append(_intern(props.get("keyboardShortcut")))
+			positionInfo = props.get("positionInfo") or {}
+			self.indexesInGroup.append(positionInfo.get("indexInGroup", 0))
+			self.similarItems.append(positionInfo.get("similarItemsInGroup", 0))
+
+	def __len__(self):
+		return len(self.keys)
+
+	def __contains__(self, runtimeId):
+		return runtimeKey(runtimeId) in self.positions
+
+	def view(self, runtimeId):
+		pos = self.positions.get(runtimeKey(runtimeId))
+		return NodeView(self, pos) if pos is not None else None
+
+	def subtree(self, runtimeId):
+		# nodes under runtimeId, as walkSubtree returns them (props as NodeView)
+		pos = self.positions.get(runtimeKey(runtimeId))
+		if pos is None:
+			return None
+		keys = self.keys
+		parent = self.parent
+		firstChild = self.firstChild
+		nextSibling = self.nextSibling
+		nodes = [(runtimeId, None, NodeView(self, pos))]
+		# runtime ids given back once each, also as parent ids
+		runtimeIds = {pos: runtimeId}
+		# depth-first, in order, as walkSubtree
+		stack = [firstChild[pos]]
+		while stack:
+			child = stack.pop()
+			if child < 0:
+				continue
+			stack.append(nextSibling[child])
+			stack.append(firstChild[child])
+			childId = runtimeIds[child] = _runtimeId(keys[child])
+			nodes.append((childId, runtimeIds[parent[child]], NodeView(self, child)))
+		return nodes
+
+class NodeView(object):
+	# properties of a table position, read as the dict of walkSubtree nodes
+
+	__slots__ = ("table", "pos")
+
+	def __init__(self, table, pos):
+		self.table = table
+		self.pos = pos
+
+	def get(self, key, default=None):
+		table = self.table
+		pos = self.pos
+		if key == "name":
+			value = table.names[pos]
+		elif key == "role":
+			role = table.roles[pos]
+			value = _roles[role] if role >= 0 else None
+		elif key == "states":
+			mask = table.states[pos]
+			if not mask:
+				return default
+			value = _maskStates.get(mask)
+			if value is None:
+				value = _maskStates[mask] = frozenset(state for bit, state in enumerate(_bitStates) if mask & (1<<bit))
+		elif key == "className":
+			value = table.classNames[pos]
+		elif key == "automationId":
+			# always present, maybe None
+			return table.automationIds[pos]
+		elif key == "description":
+			value = table.descriptions[pos]
+		elif key == "keyboardShortcut":
+			# empty when known, None when not asked
+			value = table.keyboardShortcuts[pos]
+		elif key == "positionInfo":
+			index = table.indexesInGroup[pos]
+			if not index:
+				return default
+			value = {"indexInGroup": index}
+			if table.similarItems[pos]:
+				value["similarItemsInGroup"] = table.similarItems[pos]
+		else:
+			return default
+		return default if value is None else value
+
+	def __contains__(self, key):
+		return key == "automationId" or self.get(key) is not None
+
+	def __getitem__(self, key):
+		value = self.get(key)
+		if value is None and key != "automationId":
+			raise KeyError(key)
+		return value
@@ -0,0 +1,178 @@
+# -*- coding: UTF-8 -*-
+# Author: Alberto Buffolino
+# License: GPLv2
+import time
+import core
+from .utils import *
+from .query import StepPending
+from . import trace
+
+"""
+Idle-time prefetch of what user probably needs next.
+While user stays on a tab (or inside its content), we warm the model
+with tabs on either side of it (properties and simple* links),
+and walk the Ribbon once (see SubtreeCache.prefetchLater), so the visible
+content of selected tab is already known when expanded,
+and search does not need to crawl (if started before, it asks the walk,
+see walkRibbon). Office builds content
+of other tabs only when they are selected, so it cannot be prefetched.
+Work is split in steps, about a round trip each, run with core.callLater
+after IDLE_DELAY without keys; every key cancels it (see GlobalPlugin.getScript),
+and an idle period cannot spend more than MAX_STEPS steps or MAX_TIME
+on main thread; the Ribbon walk, a single call that can take long, runs
+on query thread (see query.py) and does not count.
+Steps never wait Office: live reads are posted to query thread
+(see RibbonModel.postSteps), and a step is run again
+when they came, without blocking main thread meanwhile.
+"""
+
+# ms without keys before prefetch starts
+IDLE_DELAY = 300
+# ms between steps, to let NVDA process input in the meantime
+STEP_DELAY = 10
+# budget of an idle period
+MAX_STEPS = 12
+MAX_TIME = 0.05
+# tabs prefetched on either side of current one
+NEIGHBOURS = 2
+# yielded by a step waiting its posted reads
+WAITING = None
+
+class Prefetcher(object):
+
+	def __init__(self, plugin):
+		self.plugin = plugin
+		self.timer = None
+		# generator of pending steps, None when idle
+		self.steps = None
+		self.spent = 0.0
+		self.count = 0
+		# Ribbon walk running on query thread
+		self.walking = False
+		# for stats
+		self.done = 0
+		self.cancelled = 0
+
+	def schedule(self):
+		# (re)start waiting for user to be idle
+		self.cancel()
+		self.timer = core.callLater(IDLE_DELAY, self.start)
+
+	def cancel(self):
+		if self.timer is not None:
+			self.timer.Stop()
+			self.timer = None
+		if self.steps is not None:
+			self.steps.close()
+			self.steps = None
+			self.cancelled += 1
+
+	def start(self):
+		self.timer = None
+		self.steps = self.plan()
+		self.spent = 0.0
+		self.count = 0
+		self.runStep()
+
+	def runStep(self):
+		self.timer = None
+		plugin = self.plugin
+		if self.steps is None:
+			return
+		elif not plugin.exploring or plugin.searching or plugin.isExpandingMenu or plugin.isExpandingSubmenu or plugin.isCollapsingSubmenu:
+			# Ribbon is changing, or user is busy
+			self.steps = None
+			return
+		start = time.perf_counter()
+		plugin.model.postSteps = True
+		try:
+			name = next(self.steps)
+		except StopIteration:
+			self.steps = None
+			return
+		except:
+			debugLog("Prefetch failed")
+			self.steps = None
+			return
+		finally:
+			plugin.model.postSteps = False
+		ms = (time.perf_counter()-start)*1000
+		trace.addSpan("prefetch", "idle", ms, step=name)
+		self.spent += ms/1000
+		if name is not WAITING:
+			self.count += 1
+			self.done += 1
+		if self.count >= MAX_STEPS or self.spent >= MAX_TIME:
+			debugLog("Prefetch budget spent")
+			self.steps.close()
+			self.steps = None
+			return
+		if name is WAITING:
+			# nothing, posted after reads of step: done when they are applied
+			steps = self.steps
+			plugin.queryWorker.post(lambda: None, onDone=lambda res: self.readsDone(steps))
+			return
+		self.timer = core.callLater(STEP_DELAY, self.runStep)
+
+	def readsDone(self, steps):
+		# on main thread, posted reads are in the model: go on, if not cancelled
+		if self.steps is steps and self.timer is None:
+			self.timer = core.callLater(STEP_DELAY, self.runStep)
+
+	def plan(self):
+		# steps, as generator: every yield gives control back
+		plugin = self.plugin
+		model = plugin.model
+		while True:
+			try:
+				tab = self.currentTab()
+				break
+			except StepPending:
+				yield WAITING
+		if tab is not None:
+			model.postedSteps.clear()
+			# last tab reached on either side, and how to go further
+			sides = [[tab, plugin.getNextMenu, "nextTab"], [tab, plugin.getPrevMenu, "prevTab"]]
+			for i in range(NEIGHBOURS):
+				for side in sides:
+					while side[0] is not None:
+						try:
+							side[0] = side[1](side[0])
+						except StepPending:
+							# asked again when posted reads came (see readsDone)
+							yield WAITING
+							continue
+						# links are in the model now
+						model.postedSteps.clear()
+						yield side[2]
+						break
+		if self.walkRibbon():
+			yield "ribbon"
+
+	def currentTab(self):
+		plugin = self.plugin
+		model = plugin.model
+		if plugin.menubar:
+			return plugin.menubar[-1]
+		elif model.isRibbonRoot(model.parent(plugin.userObj)):
+			return plugin.userObj
+
+	def walkRibbon(self):
+		# a big Ribbon cannot be walked within MAX_TIME:
+		# walk runs on query thread, its nodes come later (see ribbonWalked);
+		# True if started now
+		plugin = self.plugin
+		uiaCache = plugin.uiaCache
+		if uiaCache.hasPrefetched() or self.walking:
+			return False
+		self.walking = uiaCache.prefetchLater(plugin.ribbonScope.root, plugin.queryWorker, self.ribbonWalked)
+		return self.walking
+
+	def ribbonWalked(self, nodes):
+		self.walking = False
+		plugin = self.plugin
+		if nodes and plugin.exploring and plugin.prefetcher is self and not plugin.commandIndex.crawled:
+			plugin.crawlRibbon(nodes)
+			if plugin.searching:
+				# search started before: results from the whole Ribbon now
+				plugin.refreshSearch()
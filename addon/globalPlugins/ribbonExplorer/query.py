@@ -0,0 +1,160 @@
+# -*- coding: UTF-8 -*-
+# Author: Alberto Buffolino
+# License: GPLv2
+import functools
+import threading
+import time
+from collections import deque
+import queueHandler
+from . import trace
+try:
+	import comtypes
+except ImportError:
+	comtypes = None
+
+"""
+Ribbon queries on a worker thread, so a busy Office cannot freeze NVDA.
+When Word repaginates or Excel recalculates, a single simpleNext can take seconds,
+and on main thread that means no speech at all.
+So live reads of the model (see RibbonModel.liveRelative) run here:
+main thread waits at most TIMEOUT, then gives up (QueryTimeout),
+and navigation reports where user still is, from cached data,
+saying it is not updated (see GlobalPlugin.reportStale).
+A call in Office cannot be interrupted: when it ends anyway, its result
+is handed back to main thread by queueHandler, to fill the model for next key.
+Queries not started yet are cancelled by a newer key (see GlobalPlugin.getScript).
+Scripts catch QueryTimeout (see staleOnTimeout); event handlers, following
+a search path, try the step again later.
+Work nobody waits for (the idle walk of the whole Ribbon, and live steps
+of idle prefetch, see prefetch.py) is posted here too, its result handed back the same way.
+"""
+
+# seconds main thread waits a query
+TIMEOUT = 0.25
+# ms before a step of an event handler, stopped by QueryTimeout, is tried again
+# (see GlobalPlugin.retryPathStep), and times it is tried
+RETRY_DELAY = 300
+MAX_RETRIES = 3
+
+class QueryTimeout(Exception):
+	pass
+
+class StepPending(Exception):
+	# a live step posted, not waited, by who must not block (see RibbonModel.liveStep)
+	pass
+
+class Query(object):
+
+	__slots__ = ("func", "args", "generation", "done", "result", "error", "onLate")
+
+	def __init__(self, func, args, generation):
+		self.func = func
+		self.args = args
+		self.generation = generation
+		self.done = threading.Event()
+		self.result = None
+		self.error = None
+		# called on main thread with result, if caller stopped waiting
+		self.onLate = None
+
+class QueryWorker(object):
+
+	def __init__(self):
+		self.pending = deque()
+		self.wakeUp = threading.Condition()
+		self.lock = threading.Lock()
+		# increased by every key, to cancel queries not started yet
+		self.generation = 0
+		self.running = True
+		self.thread = threading.Thread(target=self.run, name="ribbonExplorer queries")
+		self.thread.daemon = True
+		self.thread.start()
+		# for stats
+		self.queries = 0
+		self.timeouts = 0
+		self.cancelled = 0
+		self.late = 0
+
+	def call(self, func, args=(), onLate=None):
+		# func(*args) on worker thread, QueryTimeout if it takes more than TIMEOUT
+		query = Query(func, args, self.generation)
+		self.queries += 1
+		with self.wakeUp:
+			self.pending.append(query)
+			self.wakeUp.notify()
+		if not query.done.wait(TIMEOUT):
+			with self.lock:
+				if not query.done.is_set():
+					self.timeouts += 1
+					query.onLate = onLate
+					raise QueryTimeout()
+		if query.error is not None:
+			raise query.error
+		return query.result
+
+	def post(self, func, args=(), onDone=None):
+		# func(*args) on worker thread, without waiting for it:
+		# onDone is called on main thread with result (None if failed);
+		# not cancelled by keys, as nobody waits it
+		query = Query(func, args, None)
+		query.onLate = onDone
+		self.queries += 1
+		with self.wakeUp:
+			self.pending.append(query)
+			self.wakeUp.notify()
+
+	def cancel(self):
+		# a new key: queries still waiting are useless
+		self.generation += 1
+
+	def stop(self):
+		with self.wakeUp:
+			self.running = False
+			self.pending.clear()
+			self.wakeUp.notify()
+
+	def run(self):
+		if comtypes is not None:
+			comtypes.CoInitializeEx(comtypes.COINIT_MULTITHREADED)
+		try:
+			while True:
+				# last query (and objs in its args and result) not kept while waiting
+				query = None
+				with self.wakeUp:
+					while self.running and not self.pending:
+						self.wakeUp.wait()
+					if not self.running:
+						return
+					query = self.pending.popleft()
+				if query.generation is not None and query.generation != self.generation:
+					self.cancelled += 1
+					continue
+				start = time.perf_counter()
+				try:
+					query.result = query.func(*query.args)
+				except Exception as e:
+					query.error = e
+				with self.lock:
+					query.done.set()
+					onLate = query.onLate
+				if onLate is not None and query.generation is None:
+					# posted
+					queueHandler.queueFunction(queueHandler.eventQueue, onLate, query.result if query.error is None else None)
+				elif onLate is not None:
+					self.late += 1
+					trace.addSpan("query", "late", (time.perf_counter()-start)*1000)
+					if query.error is None:
+						queueHandler.queueFunction(queueHandler.eventQueue, onLate, query.result)
+		finally:
+			if comtypes is not None:
+				comtypes.CoUninitialize()
+
+def staleOnTimeout(func):
+	# for scripts: when Office is busy, report cached data instead of nothing
+	@functools.wraps(func)
+	def wrapper(self, *args, **kwargs):
+		try:
+			return func(self, *args, **kwargs)
+		except QueryTimeout:
+			self.reportStale()
+	return wrapper
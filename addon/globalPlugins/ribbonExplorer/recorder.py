@@ -0,0 +1,200 @@
+# -*- coding: UTF-8 -*-
+# Author: Alberto Buffolino
+# License: GPLv2
+import functools
+import json
+import os
+import time
+import globalVars
+from .utils import *
+
+"""
+Recorder of real sessions, for deterministic replay (see benchmarks/replayTrace.py).
+When RECORD is True, every event and script received by the add-on is saved
+in a trace file (JSON lines, in NVDA config folder), with a snapshot of objects
+involved, values of properties read through uiaCache/model, and Ribbon structure;
+otherwise recorded/recordRead/recordTree do nothing and cost nothing.
+Trace entries (short keys, to keep files compact):
+- {"k": "h", "v": version}: header;
+- {"k": "o", "id", "rid", "p": {snapshot}}: an object seen for the first time;
+- {"k": "e", "n": event name, "o": obj id, "t": ms, "st": states, "a": [ancestor ids]}: an event;
+- {"k": "s", "n": script name, "t": ms, "g": main key of gesture}: a script;
+- {"k": "r", "o": obj id, "p": property, "v": value}: a property read;
+- {"k": "t", "pa": parent, "w": window handle, "wc": window class, "n": [[obj id, parent index, props]]}:
+a subtree with its properties (Ribbon at exploration start, then every prefetch),
+so replay can navigate it as NVDA would.
+Object references are written as {"o": id}, roles and states by name.
+"""
+
+# to enable recording
+RECORD = False
+# trace format version
+VERSION = 1
+# properties in object snapshots
+SNAPSHOT = ("name", "role", "states", "description", "isFocusable", "windowHandle", "windowClassName", "parent")
+
+def getTraceFolder():
+	return os.path.join(globalVars.appArgs.configPath, "ribbonExplorer", "traces")
+
+class Recorder(object):
+
+	def __init__(self):
+		self.file = None
+		self.start = None
+		# runtime id (or id of instance) -> trace obj id
+		self.ids = {}
+
+	def open(self):
+		folder = getTraceFolder()
+		if not os.path.isdir(folder):
+			os.makedirs(folder)
+		path = os.path.join(folder, "%s.jsonl"%time.strftime("%Y%m%d-%H%M%S"))
+		self.file = open(path, "w")
+		self.start = time.perf_counter()
+		self.write({"k": "h", "v": VERSION})
+		return path
+
+	def close(self):
+		# at exploration end, so every trace is a session
+		if self.file:
+			self.file.close()
+			self.file = None
+		self.ids.clear()
+
+	def write(self, entry):
+		if not self.file:
+			self.open()
+		self.file.write(json.dumps(entry, separators=(",", ":"))+"\n")
+
+	def elapsed(self):
+		return round((time.perf_counter()-self.start)*1000, 3)
+
+	def newId(self, key):
+		objId = self.ids[key] = len(self.ids)+1
+		return objId
+
+	def objId(self, obj):
+		runtimeId = getRuntimeId(obj)
+		key = runtimeId if runtimeId is not None else ("instance", id(obj))
+		objId = self.ids.get(key)
+		if objId is not None:
+			return objId
+		objId = self.newId(key)
+		snapshot = {}
+		for attr in SNAPSHOT:
+			try:
+				snapshot[attr] = self.encode(getattr(obj, attr))
+			except:
+				pass
+		try:
+			snapshot["className"] = obj.UIAElement.cachedClassName
+			snapshot["automationId"] = obj.UIAElement.cachedAutomationId or None
+		except:
+			pass
+		try:
+			snapshot["productName"] = obj.appModule.productName
+		except:
+			pass
+		self.write({"k": "o", "id": objId, "rid": list(runtimeId) if runtimeId else None, "p": snapshot})
+		return objId
+
+	def encode(self, value):
+		if value is None or isinstance(value, (bool, int, float, str)):
+			# roles/states are int enums, but we want their name
+			if hasattr(value, "name") and not isinstance(value, bool):
+				return {"e": value.name}
+			return value
+		elif isinstance(value, (set, frozenset)):
+			return {"s": sorted(getattr(item, "name", str(item)) for item in value)}
+		elif isinstance(value, (list, tuple)):
+			return [self.encode(item) for item in value]
+		elif isinstance(value, dict):
+			return {"d": dict((str(key), self.encode(item)) for key, item in value.items())}
+		elif hasattr(value, "presentationType"):
+			return {"o": self.objId(value)}
+		return repr(value)
+
+	def event(self, name, obj):
+		entry = {"k": "e", "n": name, "o": self.objId(obj) if obj else None, "t": self.elapsed()}
+		if obj:
+			# states change, snapshot is taken only once
+			entry["st"] = self.encode(obj.states)
+		if name == "gainFocus":
+			entry["a"] = [self.objId(ancestor) for ancestor in globalVars.focusAncestors]
+		self.write(entry)
+
+	def script(self, name, gesture):
+		self.write({"k": "s", "n": name, "t": self.elapsed(), "g": getattr(gesture, "mainKeyName", None)})
+
+	def read(self, obj, attr, value):
+		self.write({"k": "r", "o": self.objId(obj), "p": attr, "v": self.encode(value)})
+
+	def tree(self, obj, nodes):
+		# nodes as returned by uiaCache.walkSubtree, parents first
+		entry = {"k": "t", "pa": self.encode(obj.parent), "w": obj.windowHandle, "wc": obj.windowClassName}
+		indexes = {}
+		encoded = []
+		for runtimeId, parentId, props in nodes:
+			if not runtimeId:
+				continue
+			objId = self.ids.get(runtimeId) or self.newId(runtimeId)
+			indexes[runtimeId] = len(encoded)
+			encoded.append([objId, indexes.get(parentId, -1), self.encode(props)["d"]])
+		entry["n"] = encoded
+		self.write(entry)
+
+recorder = Recorder()
+
+def _recorded(func):
+	name = func.__name__
+	if name.startswith("event_"):
+		eventName = name[len("event_"):]
+		@functools.wraps(func)
+		def wrapper(self, obj, nextHandler, *args, **kwargs):
+			# only Ribbon sessions, from their start
+			if self.exploring or (self.supportedApp and eventName == "focusEntered"):
+				try:
+					recorder.event(eventName, obj)
+				except:
+					debugLog("Recording %s failed"%name)
+			return func(self, obj, nextHandler, *args, **kwargs)
+	else:
+		scriptName = name[len("script_"):]
+		@functools.wraps(func)
+		def wrapper(self, gesture, *args, **kwargs):
+			try:
+				recorder.script(scriptName, gesture)
+			except:
+				debugLog("Recording %s failed"%name)
+			return func(self, gesture, *args, **kwargs)
+	return wrapper
+
+def _recordRead(obj, attr, value):
+	try:
+		recorder.read(obj, attr, value)
+	except:
+		debugLog("Recording read of %s failed"%attr)
+
+def _recordTree(obj, nodes=None):
+	try:
+		if nodes is None:
+			from .uiaCache import walkSubtree
+			nodes = walkSubtree(obj)
+		if nodes:
+			recorder.tree(obj, nodes)
+	except:
+		debugLog("Recording tree failed")
+
+def _untouched(func):
+	return func
+
+def _noRecord(obj, attr, value):
+	pass
+
+def _noTree(obj, nodes=None):
+	pass
+
+# swapped at load time
+recorded = _recorded if RECORD else _untouched
+recordRead = _recordRead if RECORD else _noRecord
+recordTree = _recordTree if RECORD else _noTree
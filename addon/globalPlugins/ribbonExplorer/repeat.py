@@ -0,0 +1,92 @@
+# -*- coding: UTF-8 -*-
+# Author: Alberto Buffolino
+# License: GPLv2
+import functools
+import core
+
+"""
+Coalescing of held navigation keys.
+Holding tab or an arrow runs a script at every key repeat,
+and every reportUser moves navigator and focus, speaks, updates braille,
+maybe forcing focus with simulated keys: many calls in Office per repeat.
+So, when the same navigation script runs again within WINDOW ms
+from the previous one, it only moves userObj along the model,
+and speaks the name already known (see GlobalPlugin.reportUser);
+the real report, with focus, is done once, for the last object,
+when keys stop for WINDOW ms, before any other script,
+or before a repeat expands, collapses or sends a key to Office.
+First press of a key is always reported as usual.
+"""
+
+# ms between two runs of a script to handle the second as a repeat
+WINDOW = 120
+
+class KeyRepeat(object):
+
+	def __init__(self, commit):
+		# commit reports userObj for real, when repeats end
+		self.commit = commit
+		self.timer = None
+		# name of script repeated
+		self.scriptName = None
+		# while a repeated script runs
+		self.active = False
+		# a report was deferred
+		self.pending = False
+		# for stats
+		self.repeats = 0
+		self.commits = 0
+
+	def begin(self, scriptName):
+		if self.timer is not None:
+			self.timer.Stop()
+			self.timer = None
+			if scriptName == self.scriptName:
+				self.active = True
+		if not self.active:
+			self.flush()
+		self.scriptName = scriptName
+
+	def end(self):
+		self.active = False
+		self.timer = core.callLater(WINDOW, self.flush)
+
+	def defer(self):
+		self.repeats += 1
+		self.pending = True
+
+	def flush(self):
+		# before another script, when repeats end,
+		# or before a repeat acts on real focus (see GlobalPlugin.settleRepeat)
+		if self.timer is not None:
+			self.timer.Stop()
+			self.timer = None
+		self.scriptName = None
+		# rest of running script is reported as usual
+		self.active = False
+		if self.pending:
+			self.pending = False
+			self.commits += 1
+			self.commit()
+
+	def cancel(self):
+		if self.timer is not None:
+			self.timer.Stop()
+			self.timer = None
+		self.scriptName = None
+		self.active = False
+		self.pending = False
+
+def repeatable(func):
+	# for navigation scripts: runs within WINDOW from previous one are repeats
+	@functools.wraps(func)
+	def wrapper(self, *args, **kwargs):
+		keyRepeat = self.keyRepeat
+		if keyRepeat is None:
+			return func(self, *args, **kwargs)
+		keyRepeat.begin(func.__name__)
+		try:
+			return func(self, *args, **kwargs)
+		finally:
+			keyRepeat.end()
+	return wrapper
@@ -0,0 +1,78 @@
+# -*- coding: UTF-8 -*-
+# Author: Alberto Buffolino
+# License: GPLv2
+import braille
+import config
+import speech
+from .utils import *
+from .snapshot import read
+
+"""
+Report of Ribbon objects from cached properties.
+speech.speakObject asks the live obj its name, role, states, description,
+position, shortcut and value, one call to Office each.
+Commands of an expanded tab or submenu are already known, from the cache request
+of their expansion (see uiaCache.py): for roles where those properties
+are all NVDA would speak, speech is built from them by NVDA functions,
+so it is the same; states only are asked again, as they change between keys
+(once per gesture, see snapshot.py).
+Other roles (checkable ones, with their negative states, list and menu items,
+fields with a value) and objects not in cache are reported by NVDA as usual.
+Braille is always left to NVDA (handleGainFocus), as regions are not public API.
+Every report cancels speech of previous one, still going on with fast keys.
+"""
+
+# True to speak Ribbon commands from cache, False to report everything by NVDA
+ENABLED = False
+# roles whose report is all in cache
+CACHED_ROLES = (
+	roles.BUTTON, roles.SPLITBUTTON, roles.DROPDOWNBUTTON, roles.MENUBUTTON,
+	roles.GROUPING, roles.TOOLBAR,
+)
+# not in old NVDA versions
+getPropertiesSpeech = getattr(speech, "getPropertiesSpeech", None)
+
+class Reporter(object):
+
+	def __init__(self, source):
+		# where cached properties are read from (see uiaCache.py)
+		self.source = source
+		# for stats
+		self.cached = 0
+		self.live = 0
+
+	def cachedProperties(self, obj):
+		# what NVDA would speak of obj, None if not all in cache
+		if not ENABLED or getPropertiesSpeech is None or not self.source.props:
+			return None
+		props = self.source.props.get(getRuntimeId(obj))
+		if props is None or props.get("role") not in CACHED_ROLES or "keyboardShortcut" not in props:
+			return None
+		name = props.get("name") or ""
+		res = {"name": name, "role": props["role"], "states": read(obj, "states")}
+		# as NVDA filters them, following user settings
+		presentation = config.conf["presentation"]
+		description = props.get("description")
+		if description and description != name and presentation["reportObjectDescriptions"]:
+			res["description"] = description
+		if props["keyboardShortcut"] and presentation["reportKeyboardShortcuts"]:
+			res["keyboardShortcut"] = props["keyboardShortcut"]
+		positionInfo = props.get("positionInfo")
+		if positionInfo and presentation["reportObjectPositionInformation"]:
+			for key, value in positionInfo.items():
+				res["positionInfo_%s"%key] = value
+		return res
+
+	def report(self, obj, withBraille=True, cancel=True):
+		# cancel: speech still going on is about a previous obj
+		if cancel:
+			speech.cancelSpeech()
+		props = self.cachedProperties(obj)
+		if props is None:
+			self.live += 1
+			speech.speakObject(obj, reason=REASON_FOCUS)
+		else:
+			self.cached += 1
+			speech.speak(getPropertiesSpeech(reason=REASON_FOCUS, **props))
+		if withBraille:
+			braille.handler.handleGainFocus(obj)
@@ -0,0 +1,252 @@
+# -*- coding: UTF-8 -*-
+# Author: Alberto Buffolino
+# License: GPLv2
+import time
+from NVDAObjects import NVDAObject
+from .utils import *
+from .trace import addSpan
+
+"""
+presentationType rules, as a table.
+Every rule has some conditions and a result; the first rule
+whose conditions are all true decides obj.presentationType.
+Conditions are static (depending on obj class name, role, automation id,
+kind of name and parent kind only) or dynamic (depending on add-on state
+or on other properties); at compile time rules are grouped by role,
+and result of static conditions is memoized per
+(class name, role, automation id, name kind, parent signature),
+so only dynamic rules preceding the memoized one are checked again.
+"""
+
+# speed-up
+content = NVDAObject.presType_content
+layout = NVDAObject.presType_layout
+unavailable = NVDAObject.presType_unavailable
+
+# kinds of obj.name
+NAME_EMPTY = 0
+NAME_BLANK = 1
+NAME_RIBBON = 2
+NAME_OTHER = 3
+# max memoized decisions, before restarting
+MEMO_SIZE = 4096
+
+def getNameKind(name):
+	if not name:
+		return NAME_EMPTY
+	elif name.isspace():
+		return NAME_BLANK
+	elif name == "Ribbon":
+		return NAME_RIBBON
+	return NAME_OTHER
+
+class ObjInfo(object):
+	# static properties of obj, read once per classification
+
+	__slots__ = ("role", "name", "nameKind", "className", "automationId")
+
+	def __init__(self, obj, getProp):
+		self.role = getProp(obj, "role")
+		self.name = getProp(obj, "name")
+		self.nameKind = getNameKind(self.name)
+		self.className = getProp(obj, "className")
+		self.automationId = getProp(obj, "automationId")
+
+# parent kinds: return a hashable value, part of memo key
+
+def simpleParentIsRoot(obj, info, plugin):
+	if info.role != roles.EDITABLETEXT:
+		return None
+	return isRibbonRoot(obj.simpleParent)
+
+def parentIsNamedElementGroup(obj, info, plugin):
+	# see utils.isSubtab, in v3
+	if info.role != roles.PANE or info.className != "NetUIPanViewer" or info.nameKind != NAME_EMPTY:
+		return None
+	parent = obj.parent
+	getProp = plugin.uiaCache.getProp
+	return bool(parent and getProp(parent, "name") and getProp(parent, "role") == roles.GROUPING and getProp(parent, "className") == "NetUIElement")
+
+class Rule(object):
+
+	def __init__(self, name, result, roles=None, classNames=None, nameKinds=None, parentKind=None, parentValue=True, dynamic=None):
+		self.name = name
+		# a presentationType, or an overlay marker (see OVERLAY)
+		self.result = result
+		self.roles = frozenset(roles) if roles else None
+		self.classNames = frozenset(classNames) if classNames else None
+		self.nameKinds = frozenset(nameKinds) if nameKinds else None
+		# function returning parent signature, and value required
+		self.parentKind = parentKind
+		self.parentValue = parentValue
+		# function(obj, info, plugin) for conditions not memoizable
+		self.dynamic = dynamic
+		# position in table, set by RuleEngine
+		self.index = None
+
+	def staticMatch(self, info, parentSignature):
+		if self.roles is not None and info.role not in self.roles:
+			return False
+		if self.classNames is not None and info.className not in self.classNames:
+			return False
+		if self.nameKinds is not None and info.nameKind not in self.nameKinds:
+			return False
+		if self.parentKind is not None and parentSignature.get(self.parentKind) != self.parentValue:
+			return False
+		return True
+
+	def match(self, obj, info, plugin, parentSignature):
+		return self.staticMatch(info, parentSignature) and (self.dynamic is None or self.dynamic(obj, info, plugin))
+
+# to add an overlay class instead of setting presentationType
+OVERLAY = "overlay"
+
+def isLayoutable(obj, info, plugin):
+	return obj in plugin.layoutableObj
+
+def isExpandedMenu(obj, info, plugin):
+	return obj in plugin.expandedMenu
+
+def hasNoStates(obj, info, plugin):
+	return not plugin.uiaCache.getProp(obj, "states")
+
+def wasUnavailable(obj, info, plugin):
+	return obj.presentationType == unavailable
+
+def hasDescription(obj, info, plugin):
+	return bool(plugin.uiaCache.getProp(obj, "description"))
+
+def containsGroupingsOnly(obj, info, plugin):
+	# galleries can have hundreds of items: a sample is enough
+	getProp = plugin.uiaCache.getProp
+	return not hasDescription(obj, info, plugin) and allObjPassCheck(lambda i: getProp(i, "role") == roles.GROUPING and i.presentationType == i.presType_content, sampleChildren(obj))
+
+# order matters, as in an if/elif chain
+RULES = (
+	Rule("editInRibbon", OVERLAY, roles=(roles.EDITABLETEXT,), parentKind=simpleParentIsRoot),
+	# to simplify check of menubar items
+	Rule("ribbonRoot", content, roles=(roles.PANE,), nameKinds=(NAME_RIBBON,)),
+	# redundant obj whose we want children of
+	Rule("layoutable", layout, dynamic=isLayoutable),
+	Rule("anonymousMenuItem", layout, roles=(roles.MENUITEM,), nameKinds=(NAME_EMPTY,)),
+	# to simplify menubar exploration (enforcing)
+	Rule("tabControl", layout, roles=(roles.TABCONTROL,)),
+	# subtab in v1 and v2, with name
+	Rule("namedSubtab", content, roles=(roles.PANE,), classNames=("NetUIPanViewer",), nameKinds=(NAME_BLANK, NAME_RIBBON, NAME_OTHER)),
+	# subtab in v3, parent check avoid problems in submenu
+	Rule("anonymousSubtab", content, roles=(roles.PANE,), classNames=("NetUIPanViewer",), parentKind=parentIsNamedElementGroup),
+	# for expanded menu
+	Rule("expandedMenu", layout, dynamic=isExpandedMenu),
+	# to select this as simpleParent when closing submenu
+	Rule("popupMenuWithoutStates", content, roles=(roles.POPUPMENU,), dynamic=hasNoStates),
+	# to hide scrolling and window-action buttons
+	Rule("hiddenClass", unavailable, classNames=("NetUIRepeatButton", "NetUIScrollBar", "NetUIAppFrameHelper")),
+	# generic
+	Rule("anonymous", layout, nameKinds=(NAME_EMPTY, NAME_BLANK)),
+	# for menu items not currently available,
+	# but which we want to show to users
+	Rule("wasUnavailable", content, dynamic=wasUnavailable),
+	# to hide in grouping (it should be a grid associated to a visible button)
+	Rule("describedDatagrid", unavailable, roles=(roles.DATAGRID,), dynamic=hasDescription),
+	# to show in submenu
+	Rule("groupingsDatagrid", layout, roles=(roles.DATAGRID,), dynamic=containsGroupingsOnly),
+	# ...manage other cases
+	Rule("datagrid", content, roles=(roles.DATAGRID,)),
+	# to explore children only
+	Rule("list", layout, roles=(roles.LIST,)),
+	Rule("grouping", content, roles=(roles.GROUPING,)),
+	# rare and useless, hide
+	Rule("hiddenRole", unavailable, roles=(roles.GRAPHIC, roles.STATICTEXT)),
+)
+
+class CompiledRoleRules(object):
+	# rules applicable to a role
+
+	def __init__(self, rules):
+		self.staticRules = tuple(rule for rule in rules if rule.dynamic is None)
+		self.dynamicRules = tuple(rule for rule in rules if rule.dynamic is not None)
+		parentKinds = []
+		for rule in rules:
+			if rule.parentKind is not None and rule.parentKind not in parentKinds:
+				parentKinds.append(rule.parentKind)
+		self.parentKinds = tuple(parentKinds)
+
+class RuleEngine(object):
+
+	def __init__(self, rules):
+		self.rules = rules
+		for index, rule in enumerate(rules):
+			rule.index = index
+		# role -> CompiledRoleRules, None key for roles without specific rules
+		self.dispatch = {}
+		allRoles = set()
+		for rule in rules:
+			if rule.roles:
+				allRoles.update(rule.roles)
+		for role in allRoles:
+			self.dispatch[role] = CompiledRoleRules([rule for rule in rules if rule.roles is None or role in rule.roles])
+		self.dispatch[None] = CompiledRoleRules([rule for rule in rules if rule.roles is None])
+		# memo key -> first matching static rule (or None)
+		self.memo = {}
+		# changes of memo, to save it only after them (see GlobalPlugin.saveLayout)
+		self.revision = 0
+		# stats
+		self.lastRule = None
+		self.lastTime = 0.0
+		self.totalTime = 0.0
+		self.classified = 0
+		self.memoHits = 0
+		self.ruleHits = dict((rule.name, 0) for rule in rules)
+
+	def classify(self, obj, plugin):
+		start = time.perf_counter()
+		info = ObjInfo(obj, plugin.uiaCache.getProp)
+		compiled = self.dispatch.get(info.role) or self.dispatch[None]
+		parentSignature = {}
+		for parentKind in compiled.parentKinds:
+			parentSignature[parentKind] = parentKind(obj, info, plugin)
+		key = (info.className, info.role, info.automationId, info.nameKind, tuple(parentSignature.get(kind) for kind in compiled.parentKinds))
+		try:
+			staticRule = self.memo[key]
+			self.memoHits += 1
+		except KeyError:
+			staticRule = None
+			for rule in compiled.staticRules:
+				if rule.staticMatch(info, parentSignature):
+					staticRule = rule
+					break
+			if len(self.memo) >= MEMO_SIZE:
+				self.memo.clear()
+			self.memo[key] = staticRule
+			self.revision += 1
+		limit = staticRule.index if staticRule else len(self.rules)
+		fired = staticRule
+		for rule in compiled.dynamicRules:
+			if rule.index > limit:
+				break
+			if rule.match(obj, info, plugin, parentSignature):
+				fired = rule
+				break
+		self.lastRule = fired
+		self.lastTime = time.perf_counter() - start
+		self.totalTime += self.lastTime
+		self.classified += 1
+		if fired:
+			self.ruleHits[fired.name] += 1
+		addSpan("classify", "rule", self.lastTime*1000, rule=fired.name if fired else None)
+		return fired
+
+	def exportMemo(self):
+		# memoized decisions, with plain values and rule names (see layoutStore.py)
+		return tuple(((className, int(role) if role is not None else None, automationId, nameKind, parentSignature), rule.name if rule else None) for (className, role, automationId, nameKind, parentSignature), rule in self.memo.items())
+
+	def importMemo(self, decisions):
+		rulesByName = dict((rule.name, rule) for rule in self.rules)
+		for key, name in decisions:
+			if key not in self.memo and len(self.memo) < MEMO_SIZE:
+				self.memo[key] = rulesByName.get(name)
+				self.revision += 1
+
+	def clear(self):
+		self.memo.clear()
+		self.revision += 1
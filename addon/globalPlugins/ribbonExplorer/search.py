@@ -0,0 +1,287 @@
+# -*- coding: UTF-8 -*-
+# Author: Alberto Buffolino
+# License: GPLv2
+import bisect
+from .utils import *
+
+"""
+Index of Ribbon commands by name, for type-ahead search.
+Filled from subtrees got with uiaCache.walkSubtree (one call per tab/submenu),
+so it grows while user visits tabs, and a tab visited again replaces its commands.
+Every command has a path: the tab, then names of groups and of the command,
+with a mark on names opening a submenu, to reach it again
+with expandMenu/expandSubmenu (see GlobalPlugin.goTo).
+Query words are looked up by prefix (bisect in sorted words)
+or, from 3 characters, by trigrams; names starting with query come first
+(a range of sorted names), then others by rank; no walk of all commands.
+Commands of tabs not visited yet can come from last session (see layoutStore.py).
+"""
+
+# roles of objects to index
+COMMAND_ROLES = set([
+	roles.BUTTON, roles.SPLITBUTTON, roles.DROPDOWNBUTTON, roles.MENUBUTTON, roles.TOGGLEBUTTON,
+	roles.CHECKBOX, roles.RADIOBUTTON, roles.COMBOBOX, roles.EDITABLETEXT,
+	roles.MENUITEM, roles.LISTITEM, roles.DATAITEM,
+])
+# roles of containers whose name is part of path
+PATH_ROLES = set([roles.GROUPING])
+# class name of Ribbon tabs, and of their content
+TAB_CLASS = "NetUIRibbonTab"
+TAB_CONTENT_CLASS = "NetUIPanViewer"
+# max results of a query
+MAX_RESULTS = 50
+# keys typed in search mode
+SEARCH_CHARS = "abcdefghijklmnopqrstuvwxyz0123456789"
+# max tabs checked to find one by name
+MAX_MENUS = 64
+# max objects visited following a path
+PATH_VISITS = 500
+
+def normalize(text):
+	return " ".join(text.lower().split())
+
+def getTrigrams(text):
+	return set(text[i:i+3] for i in range(len(text)-2))
+
+class SearchEntry(object):
+
+	__slots__ = ("name", "key", "tab", "path", "runtimeId", "scope")
+
+	def __init__(self, name, tab, path, runtimeId, scope):
+		self.name = name
+		self.key = normalize(name)
+		self.tab = tab
+		# tuple of (name, opensSubmenu), after tab
+		self.path = path
+		self.runtimeId = runtimeId
+		self.scope = scope
+
+	def getLocation(self):
+		# where entry is, for users; None for tabs
+		if not self.path:
+			return None
+		return " > ".join([self.tab]+[name for name, opensSubmenu in self.path[:-1]])
+
+class CommandIndex(object):
+
+	def __init__(self):
+		# id -> SearchEntry
+		self.entries = {}
+		# scope -> ids, to replace a tab or submenu when seen again
+		self.scopes = {}
+		# runtime id -> id
+		self.byRuntimeId = {}
+		# word -> ids
+		self.words = {}
+		# trigram -> ids
+		self.trigrams = {}
+		# sorted words, sorted (key, id), and ids by rank (less nested, then by name),
+		# rebuilt at first query after changes
+		self.sortedWords = []
+		self.sortedKeys = []
+		self.ranked = []
+		self.rank = {}
+		self.changed = False
+		# changes ever made, to save layout only after them (see GlobalPlugin.saveLayout)
+		self.revision = 0
+		self.nextId = 0
+		self.crawled = False
+		# tab names, and tab -> number of commands in its content, seen live
+		self.tabNames = []
+		self.contentCounts = {}
+
+	def __len__(self):
+		return len(self.entries)
+
+	def add(self, entry):
+		entryId = self.nextId
+		self.nextId += 1
+		self.entries[entryId] = entry
+		self.scopes.setdefault(entry.scope, []).append(entryId)
+		if entry.runtimeId:
+			self.byRuntimeId[entry.runtimeId] = entryId
+		for word in set(entry.key.split()):
+			self.words.setdefault(word, set()).add(entryId)
+		for trigram in getTrigrams(entry.key):
+			self.trigrams.setdefault(trigram, set()).add(entryId)
+		self.changed = True
+		self.revision += 1
+
+	def discard(self, table, key, entryId):
+		ids = table.get(key)
+		if ids is not None:
+			ids.discard(entryId)
+			if not ids:
+				del table[key]
+
+	def removeScope(self, scope):
+		for entryId in self.scopes.pop(scope, ()):
+			entry = self.entries.pop(entryId)
+			if self.byRuntimeId.get(entry.runtimeId) == entryId:
+				del self.byRuntimeId[entry.runtimeId]
+			for word in set(entry.key.split()):
+				self.discard(self.words, word, entryId)
+			for trigram in getTrigrams(entry.key):
+				self.discard(self.trigrams, trigram, entryId)
+			self.changed = True
+			self.revision += 1
+
+	def addTabs(self, names):
+		self.tabNames = list(names)
+		self.removeScope("tabs")
+		for name in names:
+			self.add(SearchEntry(name, name, (), None, "tabs"))
+
+	def addSubtree(self, scope, tab, prefix, nodes):
+		# nodes as (runtime id, parent runtime id, props), parents first;
+		# prefix: path of submenu opener, if any
+		self.removeScope(scope)
+		paths = {}
+		for runtimeId, parentId, props in nodes:
+			parentPath = paths.get(parentId, prefix)
+			name = props.get("name")
+			role = props.get("role")
+			paths[runtimeId] = parentPath
+			if not name or name.isspace():
+				continue
+			if role in PATH_ROLES:
+				paths[runtimeId] = parentPath+((name, False),)
+			elif role in COMMAND_ROLES:
+				# edit of a combobox, with same name
+				if parentPath and parentPath[-1][0] == name and role == roles.EDITABLETEXT:
+					continue
+				path = parentPath+((name, False),)
+				paths[runtimeId] = path
+				self.add(SearchEntry(name, tab, path, runtimeId, scope))
+
+	def addTabContent(self, tab, nodes):
+		self.addSubtree(("tab", tab), tab, (), nodes)
+		self.contentCounts[tab] = len(self.scopes.get(("tab", tab), ()))
+
+	def addStored(self, tabs):
+		# tab -> paths of commands, from last session; tabs seen live are kept
+		for tab, paths in tabs.items():
+			scope = ("tab", tab)
+			if scope in self.scopes:
+				continue
+			for path in paths:
+				self.add(SearchEntry(path[-1][0], tab, path, None, scope))
+
+	def getLayout(self):
+		# tab -> paths of commands, to be stored
+		layout = {}
+		for entry in self.entries.values():
+			if entry.path:
+				layout.setdefault(entry.tab, []).append(entry.path)
+		return layout
+
+	def addSubmenu(self, opener, nodes):
+		# opener must be already indexed
+		openerId = self.byRuntimeId.get(getRuntimeId(opener))
+		if openerId is None:
+			return False
+		openerEntry = self.entries[openerId]
+		prefix = openerEntry.path[:-1]+((openerEntry.name, True),)
+		self.addSubtree(("submenu", openerEntry.runtimeId), openerEntry.tab, prefix, nodes[1:])
+		return True
+
+	def crawl(self, nodes):
+		# nodes of whole Ribbon: tabs, and content of selected one
+		tabs = []
+		selected = None
+		content = set()
+		contentNodes = []
+		for runtimeId, parentId, props in nodes:
+			if props.get("className") == TAB_CLASS and props.get("name"):
+				tabs.append(props["name"])
+				if states.SELECTED in props.get("states", ()):
+					selected = props["name"]
+			elif parentId in content or (props.get("className") == TAB_CONTENT_CLASS and not content):
+				content.add(runtimeId)
+				contentNodes.append((runtimeId, parentId, props))
+		self.addTabs(tabs)
+		if selected and contentNodes:
+			self.addTabContent(selected, contentNodes)
+		self.crawled = True
+
+	def update(self):
+		entries = self.entries
+		self.sortedWords = sorted(self.words)
+		self.sortedKeys = sorted((entry.key, entryId) for entryId, entry in entries.items())
+		self.ranked = sorted(entries, key=lambda entryId: (len(entries[entryId].path), entries[entryId].key))
+		self.rank = dict((entryId, pos) for pos, entryId in enumerate(self.ranked))
+		self.changed = False
+
+	def search(self, text):
+		# returns best entries, at most MAX_RESULTS
+		query = normalize(text)
+		if not query or not self.entries:
+			return []
+		if self.changed:
+			self.update()
+		# short words first, so longer ones check substrings only in candidates
+		candidates = None
+		for queryWord in sorted(query.split(), key=len):
+			ids = self.lookup(queryWord, candidates)
+			candidates = ids if candidates is None else candidates & ids
+			if not candidates:
+				return []
+		# names starting with query first (contiguous in sorted keys), then by rank
+		res = []
+		pos = bisect.bisect_left(self.sortedKeys, (query,))
+		while pos < len(self.sortedKeys) and len(res) < MAX_RESULTS and self.sortedKeys[pos][0].startswith(query):
+			res.append(self.sortedKeys[pos][1])
+			pos += 1
+		if len(res) < MAX_RESULTS:
+			res.extend(self.best(candidates.difference(res), MAX_RESULTS-len(res)))
+		return [self.entries[entryId] for entryId in res]
+
+	def best(self, ids, limit):
+		# first ids by rank: a walk of ranked ids, stopped at limit, if they are many
+		if len(ids)*8 < len(self.ranked):
+			return sorted(ids, key=self.rank.get)[:limit]
+		res = []
+		for entryId in self.ranked:
+			if entryId in ids:
+				res.append(entryId)
+				if len(res) == limit:
+					break
+		return res
+
+	def lookup(self, word, within=None):
+		# ids of entries with a word starting with word, or containing it;
+		# substrings only among within, if given
+		ids = set()
+		pos = bisect.bisect_left(self.sortedWords, word)
+		while pos < len(self.sortedWords) and self.sortedWords[pos].startswith(word):
+			wordIds = self.words[self.sortedWords[pos]]
+			ids.update(wordIds if within is None else within.intersection(wordIds))
+			pos += 1
+		if len(word) >= 3:
+			trigramSets = [self.trigrams.get(trigram, ()) for trigram in getTrigrams(word)]
+			trigramSets.sort(key=len)
+			substring = set(trigramSets[0]) if within is None else within.intersection(trigramSets[0])
+			substring -= ids
+			for trigramIds in trigramSets[1:]:
+				if not substring:
+					break
+				substring &= trigramIds
+			if substring:
+				ids.update(entryId for entryId in substring if word in self.entries[entryId].key)
+		return ids
+
+	def clear(self):
+		self.entries.clear()
+		self.scopes.clear()
+		self.byRuntimeId.clear()
+		self.words.clear()
+		self.trigrams.clear()
+		del self.sortedWords[:]
+		del self.sortedKeys[:]
+		del self.ranked[:]
+		self.rank.clear()
+		self.changed = False
+		self.revision += 1
+		self.crawled = False
+		self.tabNames = []
+		self.contentCounts.clear()
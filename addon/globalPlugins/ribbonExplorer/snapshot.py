@@ -0,0 +1,61 @@
+# -*- coding: UTF-8 -*-
+# Author: Alberto Buffolino
+# License: GPLv2
+import functools
+from . import trace
+from .trace import countRemoteRead
+
+"""
+Properties read once per gesture.
+A script can ask the same property of the same object more times
+(script_enter reads states of userObj up to four times),
+and every time is a call to Office.
+While a script or an event handler decorated by snapshotted runs,
+read serves every (obj, property) after the first one from a snapshot,
+dropped when the outermost one returns: next gesture asks Office again,
+as states change between keys. hasFocus is not read here:
+it changes inside a script, when focus is moved.
+With trace enabled (see trace.py), every span has remote reads of its call,
+and snapshot hits of a gesture are added as a span.
+"""
+
+# (id(obj), property) -> (obj, value); obj is kept, so its id is not reused
+_values = {}
+# [open scopes, hits, misses]
+counters = [0, 0, 0]
+
+def read(obj, attr):
+	if not counters[0]:
+		countRemoteRead()
+		return getattr(obj, attr)
+	key = (id(obj), attr)
+	entry = _values.get(key)
+	if entry is not None:
+		counters[1] += 1
+		return entry[1]
+	counters[2] += 1
+	countRemoteRead()
+	value = getattr(obj, attr)
+	_values[key] = (obj, value)
+	return value
+
+def forget(obj):
+	# obj changed during the gesture (an action performed on it)
+	for key in [key for key in _values if key[0] == id(obj)]:
+		del _values[key]
+
+def snapshotted(func):
+	name = func.__name__
+	@functools.wraps(func)
+	def wrapper(*args, **kwargs):
+		hits = counters[1]
+		counters[0] += 1
+		try:
+			return func(*args, **kwargs)
+		finally:
+			counters[0] -= 1
+			if not counters[0]:
+				_values.clear()
+				if counters[1] > hits:
+					trace.addSpan(name, "snapshot", 0, hits=counters[1]-hits)
+	return wrapper
@@ -0,0 +1,80 @@
+# -*- coding: UTF-8 -*-
+# Author: Alberto Buffolino
+# License: GPLv2
+import functools
+import json
+import time
+from collections import deque
+from logHandler import log
+
+"""
+Instrumentation of scripts, events and main methods.
+When TRACE and LOG_CALLS are False, traced returns the function untouched,
+so there is no cost at all; otherwise every call produces a span
+(name, wall time, remote property reads, nesting depth)
+saved in a ring buffer, that can be dumped in NVDA log as JSON.
+"""
+
+# to enable tracing
+TRACE = False
+# to log every traced call, as old "Running ..." messages
+LOG_CALLS = False
+# spans kept in memory
+BUFFER_SIZE = 1024
+
+spans = deque(maxlen=BUFFER_SIZE)
+# [remote reads, open spans]
+counters = [0, 0]
+
+def _countRemoteRead(count=1):
+	counters[0] += count
+
+def _noCount(count=1):
+	pass
+
+def _traced(func):
+	name = func.__name__
+	kind = "script" if name.startswith("script_") else "event" if name.startswith("event_") else "method"
+	@functools.wraps(func)
+	def wrapper(*args, **kwargs):
+		if LOG_CALLS:
+			log.info("Running %s"%name)
+		reads = counters[0]
+		depth = counters[1]
+		counters[1] += 1
+		start = time.perf_counter()
+		try:
+			return func(*args, **kwargs)
+		finally:
+			counters[1] = depth
+			spans.append({
+				"name": name,
+				"kind": kind,
+				"start": start,
+				"ms": round((time.perf_counter()-start)*1000, 3),
+				"reads": counters[0]-reads,
+				"depth": depth,
+			})
+	return wrapper
+
+def _untraced(func):
+	return func
+
+ENABLED = TRACE or LOG_CALLS
+# decorators/counters swapped at load time
+traced = _traced if ENABLED else _untraced
+countRemoteRead = _countRemoteRead if ENABLED else _noCount
+
+def addSpan(name, kind, ms, **extra):
+	# for measures not tied to a single call (see rules.py, etc)
+	if not ENABLED:
+		return
+	span = {"name": name, "kind": kind, "start": time.perf_counter(), "ms": round(ms, 3), "reads": 0, "depth": counters[1]}
+	span.update(extra)
+	spans.append(span)
+
+def dumpSpans():
+	log.info("RibbonExplorer trace (%d spans):\n%s"%(len(spans), json.dumps(list(spans), indent=None)))
+	count = len(spans)
+	spans.clear()
+	return count
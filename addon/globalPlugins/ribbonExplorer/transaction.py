@@ -0,0 +1,63 @@
+# -*- coding: UTF-8 -*-
+# Author: Alberto Buffolino
+# License: GPLv2
+import time
+import core
+from . import trace
+
+"""
+Expansions, collapses and planned focus moves as transactions.
+Each of them waits for a focus event from Office, while isExpanding*/isCollapsing*
+flags make other focus events ignored; if Office never sends it, user hears nothing.
+So a transaction has a deadline: when expired, its fallback runs
+(cached group/submenu found by focusEntered, the starting object reported again,
+or exploration end), and silence after a key is bounded by DEADLINE.
+A fallback can also wait a little more (see extend), for slow Office,
+but only until next key: then user moved on, and waiting ends (see flush).
+Latency of every transaction is traced, with its outcome.
+"""
+
+# ms before fallback
+DEADLINE = 300
+# ms to wait late events, after starting object was reported again
+LATE_DEADLINE = 2000
+
+class Transaction(object):
+
+	def __init__(self, name, fallback, delay=DEADLINE):
+		self.name = name
+		self.start = time.perf_counter()
+		self.expired = False
+		# waiting late events, after first deadline
+		self.late = False
+		self.timer = None
+		self.arm(delay, fallback)
+
+	def arm(self, delay, fallback):
+		self.fallback = fallback
+		self.timer = core.callLater(delay, self.expire)
+
+	def extend(self, delay, fallback):
+		# after first deadline
+		self.late = True
+		self.arm(delay, fallback)
+
+	def flush(self):
+		# run fallback now
+		self.cancel()
+		self.expire()
+
+	def expire(self):
+		self.timer = None
+		self.expired = True
+		self.fallback()
+
+	def done(self, **extra):
+		# expected event arrived, or fallback completed
+		self.cancel()
+		trace.addSpan(self.name, "transaction", (time.perf_counter()-self.start)*1000, expired=self.expired, **extra)
+
+	def cancel(self):
+		if self.timer is not None:
+			self.timer.Stop()
+			self.timer = None
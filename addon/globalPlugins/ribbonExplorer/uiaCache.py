@@ -0,0 +1,311 @@
+# -*- coding: UTF-8 -*-
+# Author: Alberto Buffolino
+# License: GPLv2
+import time
+from .utils import *
+from .trace import countRemoteRead
+from .recorder import recordRead, recordTree
+from .nodeTable import NodeTable
+from .snapshot import read
+from .gallery import PAGE_SIZE, ITEM_ROLES
+try:
+	import UIAHandler
+	from NVDAObjects.UIA import UIA
+except ImportError:
+	UIAHandler = None
+
+"""
+Bulk prefetch of an expanded tab/submenu.
+Instead of asking properties one by one to every child (each a call to Office),
+we ask the whole subtree with all properties we need in a single UIA cache request,
+then serve them from here until expansion changes. Galleries are walked
+for their first items only (see MAX_WALKED_ITEMS).
+The whole Ribbon can also be walked in advance, when user is idle (see prefetch.py):
+then expanding the tab whose content is already visible needs no call at all.
+"""
+
+# seconds a Ribbon walked in advance is considered valid
+PREFETCH_MAX_AGE = 10
+# gallery items walked per container, others are read live
+# when reached (see gallery.py), so a walk does not grow with gallery size
+MAX_WALKED_ITEMS = PAGE_SIZE
+
+# (obj attribute, UIA property name), names resolved at runtime
+# to not fail where UIAHandler is not fully available
+PROPERTIES = (
+	("runtimeId", "UIA_RuntimeIdPropertyId"),
+	("name", "UIA_NamePropertyId"),
+	("controlType", "UIA_ControlTypePropertyId"),
+	("className", "UIA_ClassNamePropertyId"),
+	("automationId", "UIA_AutomationIdPropertyId"),
+	("fullDescription", "UIA_FullDescriptionPropertyId"),
+	("helpText", "UIA_HelpTextPropertyId"),
+	("isEnabled", "UIA_IsEnabledPropertyId"),
+	("isOffscreen", "UIA_IsOffscreenPropertyId"),
+	("isKeyboardFocusable", "UIA_IsKeyboardFocusablePropertyId"),
+	("hasKeyboardFocus", "UIA_HasKeyboardFocusPropertyId"),
+	("expandCollapseState", "UIA_ExpandCollapseExpandCollapseStatePropertyId"),
+	("isSelected", "UIA_SelectionItemIsSelectedPropertyId"),
+	("isTogglePatternAvailable", "UIA_IsTogglePatternAvailablePropertyId"),
+	("toggleState", "UIA_ToggleToggleStatePropertyId"),
+	("positionInSet", "UIA_PositionInSetPropertyId"),
+	("sizeOfSet", "UIA_SizeOfSetPropertyId"),
+	("accessKey", "UIA_AccessKeyPropertyId"),
+	("acceleratorKey", "UIA_AcceleratorKeyPropertyId"),
+)
+
+def liveProp(obj, attr):
+	# property read directly from obj, once per gesture (see snapshot.py)
+	if attr == "className":
+		countRemoteRead()
+		value = obj.UIAElement.cachedClassName if hasattr(obj, "UIAElement") else None
+	elif attr == "automationId":
+		countRemoteRead()
+		try:
+			value = obj.UIAElement.cachedAutomationId
+		except:
+			value = None
+	else:
+		value = read(obj, attr)
+	recordRead(obj, attr, value)
+	return value
+
+def propsFromElement(element, propIds):
+	raw = {}
+	for attr, propId in propIds:
+		try:
+			raw[attr] = element.GetCachedPropertyValue(propId)
+		except:
+			pass
+	props = {}
+	if raw.get("name") is not None:
+		props["name"] = raw["name"]
+	if raw.get("className") is not None:
+		props["className"] = raw["className"]
+	props["automationId"] = raw.get("automationId") or None
+	role = UIAHandler.UIAControlTypesToNVDARoles.get(raw.get("controlType"))
+	# as NVDA does for UIA buttons
+	if role == roles.BUTTON and raw.get("isTogglePatternAvailable"):
+		role = roles.TOGGLEBUTTON
+	if role is not None:
+		props["role"] = role
+	if "accessKey" in raw or "acceleratorKey" in raw:
+		# as NVDA keyboardShortcut of UIA objects
+		props["keyboardShortcut"] = ", ".join(key for key in (raw.get("accessKey"), raw.get("acceleratorKey")) if key)
+	if raw.get("positionInSet"):
+		# as NVDA positionInfo of UIA objects
+		props["positionInfo"] = {"indexInGroup": raw["positionInSet"]}
+		if raw.get("sizeOfSet"):
+			props["positionInfo"]["similarItemsInGroup"] = raw["sizeOfSet"]
+	if "fullDescription" in raw or "helpText" in raw:
+		props["description"] = raw.get("fullDescription") or raw.get("helpText") or ""
+	if "isEnabled" in raw:
+		objStates = set()
+		if not raw["isEnabled"]:
+			objStates.add(states.UNAVAILABLE)
+		if raw.get("isOffscreen"):
+			objStates.add(states.OFFSCREEN)
+		if raw.get("isKeyboardFocusable"):
+			objStates.add(states.FOCUSABLE)
+		if raw.get("hasKeyboardFocus"):
+			objStates.add(states.FOCUSED)
+		if raw.get("isSelected"):
+			objStates.add(states.SELECTED)
+		expandCollapse = raw.get("expandCollapseState")
+		if expandCollapse == UIAHandler.ExpandCollapseState_Collapsed:
+			objStates.add(states.COLLAPSED)
+		elif expandCollapse in (UIAHandler.ExpandCollapseState_Expanded, UIAHandler.ExpandCollapseState_PartiallyExpanded):
+			objStates.add(states.EXPANDED)
+		if raw.get("isTogglePatternAvailable"):
+			toggleState = raw.get("toggleState")
+			if role == roles.TOGGLEBUTTON:
+				if toggleState == UIAHandler.ToggleState_On:
+					objStates.add(states.PRESSED)
+			else:
+				objStates.add(states.CHECKABLE)
+				if toggleState == UIAHandler.ToggleState_On:
+					objStates.add(states.CHECKED)
+				elif toggleState == UIAHandler.ToggleState_Indeterminate:
+					objStates.add(states.HALFCHECKED)
+		props["states"] = objStates
+	return tuple(raw.get("runtimeId") or ()), props
+
+def walkSubtree(obj, elements=None):
+	# one cross-process call for the whole subtree of obj,
+	# returns a list of (runtime id, parent runtime id, props), parents first
+	if UIAHandler is None or not hasattr(obj, "UIAElement"):
+		return None
+	return walkElement(obj.UIAElement, elements)
+
+def walkElement(element, elements=None):
+	# walkSubtree of a UIA element: no NVDAObject involved,
+	# so it can run on a worker thread (see SubtreeCache.prefetchLater);
+	# elements, if given, gets runtime id -> element of every node,
+	# to create NVDAObjects of them later (see objFromElement)
+	try:
+		propIds = [(attr, getattr(UIAHandler, name)) for attr, name in PROPERTIES if hasattr(UIAHandler, name)]
+		if elements is not None:
+			# with properties NVDA caches for its objects, as rawRelative
+			cacheRequest = UIAHandler.handler.baseCacheRequest.Clone()
+		else:
+			cacheRequest = UIAHandler.handler.clientObject.CreateCacheRequest()
+		for attr, propId in propIds:
+			cacheRequest.AddProperty(propId)
+		cacheRequest.TreeScope = UIAHandler.TreeScope_Subtree
+		countRemoteRead()
+		cachedRoot = element.BuildUpdatedCache(cacheRequest)
+	except:
+		debugLog("Subtree prefetch failed")
+		return None
+	# local walk of cached tree, no more calls to Office
+	nodes = []
+	pending = [(cachedRoot, None)]
+	while pending:
+		element, parentId = pending.pop()
+		runtimeId, props = propsFromElement(element, propIds)
+		nodes.append((runtimeId, parentId, props))
+		if elements is not None and runtimeId:
+			elements[runtimeId] = element
+		# reversed, to pop them in order
+		pending.extend((child, runtimeId) for child in reversed(cachedChildren(element)))
+	return nodes
+
+def cachedChildren(element):
+	# cached children of element, without gallery items after MAX_WALKED_ITEMS
+	try:
+		children = element.GetCachedChildren()
+	except:
+		return ()
+	if not children:
+		return ()
+	res = [children.GetElement(i) for i in range(children.Length)]
+	if len(res) <= MAX_WALKED_ITEMS:
+		return res
+	# only role is read, not all properties
+	kept = []
+	items = 0
+	for child in res:
+		try:
+			role = UIAHandler.UIAControlTypesToNVDARoles.get(child.GetCachedPropertyValue(UIAHandler.UIA_ControlTypePropertyId))
+		except:
+			role = None
+		if role in ITEM_ROLES:
+			items += 1
+			if items > MAX_WALKED_ITEMS:
+				continue
+		kept.append(child)
+	return kept
+
+# tree walker methods of raw relations, as NVDA UIA objects read them
+TREE_WALKER_METHODS = {
+	"parent": "GetParentElementBuildCache",
+	"next": "GetNextSiblingElementBuildCache",
+	"previous": "GetPreviousSiblingElementBuildCache",
+	"firstChild": "GetFirstChildElementBuildCache",
+	"lastChild": "GetLastChildElementBuildCache",
+}
+
+def hasRawRelations(obj):
+	return UIAHandler is not None and hasattr(obj, "UIAElement")
+
+def rawRelative(element, relation):
+	# a relation of a UIA element, without creating NVDAObjects,
+	# so it can be read on a worker thread (see RibbonModel.liveStep)
+	handler = UIAHandler.handler
+	try:
+		res = getattr(handler.baseTreeWalker, TREE_WALKER_METHODS[relation])(element, handler.baseCacheRequest)
+	except:
+		return None
+	return res or None
+
+def objFromElement(element):
+	# NVDAObject of an element got by rawRelative or walkElement, created on main thread
+	# as every NVDAObject (overlay classes, with add-on rules, are chosen here)
+	return UIA(UIAElement=element) if element else None
+
+class SubtreeCache(object):
+
+	def __init__(self):
+		# runtime id -> prefetched properties (dict, or NodeView of Ribbon walk)
+		self.props = {}
+		# Ribbon walked in advance (see nodeTable.py), None if not walked
+		self.prefetched = None
+		self.prefetchTime = 0
+		# increased when walk is dropped, to discard walks still running
+		self.drops = 0
+
+	def fetch(self, obj):
+		# returns nodes got by walkSubtree, None if failed
+		nodes = self.prefetchedSubtree(getRuntimeId(obj))
+		if nodes is None:
+			# content changed since Ribbon walk
+			self.dropPrefetched()
+			nodes = walkSubtree(obj)
+			if nodes is None:
+				return None
+			recordTree(obj, nodes)
+		self.addProps(nodes)
+		debugLog("Prefetched %d objects"%len(self.props))
+		return nodes
+
+	def addProps(self, nodes):
+		# properties of walked nodes, served until clear
+		for runtimeId, parentId, props in nodes:
+			if runtimeId:
+				self.props[runtimeId] = props
+
+	def prefetch(self, root):
+		# walks the whole Ribbon, to serve later fetches
+		self.dropPrefetched()
+		nodes = walkSubtree(root)
+		self.setPrefetched(root, nodes)
+		return nodes
+
+	def prefetchLater(self, root, worker, onDone):
+		# as prefetch, walking on worker thread: the walk of a big Ribbon
+		# can take long, main thread does not wait it;
+		# onDone gets nodes on main thread (None if failed or outdated).
+		# False if root cannot be walked there
+		if not hasRawRelations(root):
+			return False
+		self.dropPrefetched()
+		drops = self.drops
+		def done(nodes):
+			if self.drops != drops:
+				# Ribbon changed while walking
+				nodes = None
+			self.setPrefetched(root, nodes)
+			onDone(nodes)
+		worker.post(walkElement, (root.UIAElement,), done)
+		return True
+
+	def setPrefetched(self, root, nodes):
+		if nodes is None:
+			return
+		self.prefetched = NodeTable(nodes)
+		self.prefetchTime = time.time()
+		recordTree(root, nodes)
+
+	def hasPrefetched(self):
+		return self.prefetched is not None and time.time()-self.prefetchTime < PREFETCH_MAX_AGE
+
+	def prefetchedSubtree(self, runtimeId):
+		# nodes under runtimeId from Ribbon walk, as walkSubtree returns them
+		if not self.hasPrefetched():
+			return None
+		return self.prefetched.subtree(runtimeId)
+
+	def dropPrefetched(self):
+		# Ribbon may be changed (a command performed, another tab selected)
+		self.prefetched = None
+		self.drops += 1
+
+	def getProp(self, obj, attr):
+		props = self.props.get(getRuntimeId(obj)) if self.props else None
+		if props is not None and attr in props:
+			return props[attr]
+		return liveProp(obj, attr)
+
+	def clear(self):
+		# Ribbon walk is kept, to serve next expansion
+		self.props.clear()
@@ -3,8 +3,9 @@
 # License: GPLv2
 import controlTypes as ct
 import globalVars
-import inspect
+import weakref
 from logHandler import log
+from .trace import countRemoteRead
 # for compatibility
 REASON_FOCUS = ct.OutputReason.FOCUS if hasattr(ct, "OutputReason") else ct.REASON_FOCUS
 if hasattr(ct, 'Role'):
@@ -17,10 +18,20 @@ else:
 	states = type('Enum', (), dict([(x.split("STATE_")[1], getattr(ct, x)) for x in dir(ct) if x.startswith("STATE_")]))
 # to enable logging
 DEBUG = False
+# budgets of findFirstFocusable
+FOCUSABLE_MAX_DEPTH = 3
+FOCUSABLE_MAX_VISITS = 48
+# children checked to classify a grid (see rules.containsGroupingsOnly)
+GRID_SAMPLE = 8
 
-def debugLog(message):
-	if DEBUG:
-		log.info(message)
+# message can be a function, to build it (reading obj properties)
+# only when needed
+if DEBUG:
+	def debugLog(message):
+		log.info(message() if callable(message) else message)
+else:
+	def debugLog(message):
+		pass
 
 def isOfficeApp(obj):
 	try:
@@ -31,8 +42,170 @@ def isOfficeApp(obj):
 		pass
 	return False
 
+def getRuntimeId(obj):
+	# UIA runtime id as hashable tuple, None if not available;
+	# saved on obj, to ask it once per instance
+	try:
+		return obj._ribbonRuntimeId
+	except AttributeError:
+		pass
+	countRemoteRead()
+	try:
+		runtimeId = tuple(obj.UIAElement.getRuntimeId())
+	except:
+		runtimeId = None
+	try:
+		obj._ribbonRuntimeId = runtimeId
+	except:
+		pass
+	return runtimeId
+
+class ObjRef(object):
+	# handle of a live obj: its UIA runtime id and a weak reference,
+	# so a handle does not keep Office objects alive by itself
+
+	__slots__ = ("runtimeId", "ref")
+
+	def __init__(self, obj):
+		self.runtimeId = getRuntimeId(obj)
+		if self.runtimeId is None:
+			# nothing to find it again, kept as is
+			self.ref = lambda: obj
+			return
+		try:
+			self.ref = weakref.ref(obj)
+		except TypeError:
+			self.ref = lambda: obj
+
+	def resolve(self, model=None):
+		# live obj, from model (see model.py) when nobody else keeps it
+		obj = self.ref()
+		if obj is None and model is not None and self.runtimeId is not None:
+			obj = model.liveObj(self.runtimeId)
+		return obj
+
+class ObjStack(object):
+	# list-like stack of objects, with membership checked
+	# by UIA runtime id instead of comparing objects one by one;
+	# bounded: when full, the oldest obj is discarded.
+	# Objects are kept as handles (ObjRef): when a model is bound,
+	# it keeps them until their scope is closed, otherwise they live
+	# while someone else (NVDA, a model node) keeps them
+
+	def __init__(self, maxLen, model=None):
+		self.maxLen = maxLen
+		self.model = model
+		self.items = []
+		# runtime id -> occurrences
+		self.index = {}
+
+	def _index(self, ref, delta):
+		key = ref.runtimeId
+		if key is None:
+			return
+		count = self.index.get(key, 0)+delta
+		if count > 0:
+			self.index[key] = count
+			return
+		self.index.pop(key, None)
+		if self.model is not None:
+			self.model.release(key)
+
+	def append(self, obj):
+		if len(self.items) >= self.maxLen:
+			self._index(self.items.pop(0), -1)
+		ref = ObjRef(obj)
+		if self.model is not None:
+			self.model.pin(obj)
+		self.items.append(ref)
+		self._index(ref, 1)
+
+	def pop(self, pos=-1):
+		ref = self.items.pop(pos)
+		# resolved before its pin is released
+		obj = ref.resolve(self.model)
+		self._index(ref, -1)
+		return obj
+
+	def clear(self):
+		if self.model is not None:
+			for key in self.index:
+				self.model.release(key)
+		del self.items[:]
+		self.index.clear()
+
+	def __contains__(self, obj):
+		# empty stack: no runtime id to ask (maybe a read in Office)
+		if not self.items or not obj:
+			return False
+		key = getRuntimeId(obj)
+		if key is not None:
+			return key in self.index
+		# no runtime id, compare as usual
+		return any(item == obj for item in self)
+
+	def __getitem__(self, pos):
+		return self.items[pos].resolve(self.model)
+
+	def __len__(self):
+		return len(self.items)
+
+	def __iter__(self):
+		return (ref.resolve(self.model) for ref in self.items)
+
+# windows of Office popups, where submenus are shown
+POPUP_WINDOW_CLASSES = ("Net UI Tool Window", "Net UI Tool Window Layered")
+
+class RibbonScope(object):
+	# windows where Ribbon objects live, to discard others (document, panes, etc)
+	# as soon as possible
+
+	def __init__(self, root):
+		self.root = root
+		self.windowHandles = set([root.windowHandle])
+		self.rejectedHandles = set()
+		self.rootId = getRuntimeId(root)
+		# root in focus ancestors: its position and instance (see inFocusAncestors)
+		self.rootDepth = None
+		self.rootAncestor = None
+		# for stats
+		self.ancestorHits = 0
+		self.ancestorWalks = 0
+
+	def contains(self, obj):
+		windowHandle = obj.windowHandle
+		if windowHandle in self.windowHandles:
+			return True
+		elif windowHandle in self.rejectedHandles:
+			return False
+		# first time we see this window
+		if obj.windowClassName in POPUP_WINDOW_CLASSES:
+			self.windowHandles.add(windowHandle)
+			return True
+		self.rejectedHandles.add(windowHandle)
+		return False
+
+	def inFocusAncestors(self):
+		# NVDA keeps instances of ancestors shared by old and new focus,
+		# so while focus moves inside Ribbon, root is still at same position:
+		# one identity check, without reading properties
+		ancestors = globalVars.focusAncestors
+		depth = self.rootDepth
+		if depth is not None and depth < len(ancestors) and ancestors[depth] is self.rootAncestor:
+			self.ancestorHits += 1
+			return True
+		# new ancestors: look for root by identity, then by runtime id
+		# (saved on instances, so asked once per ancestor), by name without it
+		self.ancestorWalks += 1
+		self.rootDepth = self.rootAncestor = None
+		for depth, obj in enumerate(ancestors):
+			if obj is self.root or (getRuntimeId(obj) == self.rootId if self.rootId else isRibbonRoot(obj)):
+				self.rootDepth = depth
+				self.rootAncestor = obj
+				return True
+		return False
+
 def isRibbonRoot(obj):
-	debugLog("Running %s"%inspect.currentframe().f_code.co_name)
 	if not obj:
 		return False
 	if obj.name == "Ribbon" and obj.role == roles.PANE:
@@ -40,7 +213,6 @@ def isRibbonRoot(obj):
 	return False
 
 def isSubtab(obj):
-	debugLog("Running %s"%inspect.currentframe().f_code.co_name)
 	if not obj:
 		return False
 	if obj.role == roles.PANE and hasattr(obj, "UIAElement") and obj.UIAElement.cachedClassName == "NetUIPanViewer" and (
@@ -54,23 +226,44 @@ def isSubtab(obj):
 		return True
 	return False
 
-def isRibbonInAncestors():
-	debugLog("Running %s"%inspect.currentframe().f_code.co_name)
-	for obj in reversed(globalVars.focusAncestors):
-		if isRibbonRoot(obj):
-			return True
-	return False
-
 def allObjPassCheck(check, objects):
 	for obj in objects:
 		if not check(obj):
 			return False
 	return True
 
-def findFirstFocusable(obj):
-	for descendant in obj.recursiveDescendants:
-		if descendant.isFocusable:
-			return descendant
+def sampleChildren(obj, count=GRID_SAMPLE):
+	# first count children, without fetching (and classifying) all of them
+	child = obj.firstChild
+	while child:
+		yield child
+		count -= 1
+		if count <= 0:
+			return
+		child = child.next
+
+def findFirstFocusable(obj, isFocusable=None):
+	# breadth-first, within budgets: focusable children (like the edit of a combobox)
+	# come before long lists of entries; isFocusable can check cached states;
+	# returns (obj or None, objects visited)
+	if isFocusable is None:
+		isFocusable = lambda descendant: descendant.isFocusable
+	level = [obj]
+	visits = 0
+	for depth in range(FOCUSABLE_MAX_DEPTH):
+		nextLevel = []
+		for parent in level:
+			child = parent.firstChild
+			while child:
+				visits += 1
+				if isFocusable(child):
+					return child, visits
+				elif visits >= FOCUSABLE_MAX_VISITS:
+					return None, visits
+				nextLevel.append(child)
+				child = child.next
+		level = nextLevel
+	return None, visits
 
 def findFocusablePrevious(obj):
 	res = obj.simplePrevious
@@ -97,10 +290,10 @@ def findFocusableNext(obj):
 def moveFocusTo(obj):
 	if not obj:
 		return False
-	debugLog("Try focus on obj %s"%obj.name)
+	debugLog(lambda: "Try focus on obj %s"%obj.name)
 	try:
 		obj.setFocus()
 		return True
 	except:
-		debugLog("Failed setFocus() on %s"%obj.name)
+		debugLog(lambda: "Failed setFocus() on %s"%obj.name)
 	return False
@@ -0,0 +1,720 @@
+# -*- coding: UTF-8 -*-
+# Author: Alberto Buffolino
+# License: GPLv2
+"""
+A simulated Office application with a Ribbon, for benchmarks.
+Element is the Office side (the real UI), FakeObj the NVDA side:
+as in NVDA, a new FakeObj is created at every relation access,
+running add-on overlay classification, and every property read
+is counted and delayed by a configurable latency (the COM call).
+Office reactions (focus changes after keys, setFocus, doAction)
+are queued as events, and delivered to the add-on by pumpEvents,
+like NVDA does processing its event queue.
+"""
+import itertools
+import sys
+import threading
+import time
+import weakref
+import nvdaStubs
+from nvdaStubs import Role, State
+
+RIBBON_WINDOW = 0x1001
+POPUP_WINDOW = 0x1002
+DOCUMENT_WINDOW = 0x1003
+WINDOW_CLASSES = {
+	RIBBON_WINDOW: "NetUIHWND",
+	POPUP_WINDOW: "Net UI Tool Window",
+	DOCUMENT_WINDOW: "_WwG",
+}
+PRES_LAYOUT_ROLES = (Role.UNKNOWN, Role.PANE, Role.TITLEBAR, Role.SECTION)
+PRES_ANONYMOUS_LAYOUT_ROLES = (Role.WINDOW, Role.PANEL, Role.GROUPING)
+
+class Stats(object):
+	# remote reads, and simulated latency of each one (seconds)
+	reads = 0
+	latency = 0.0
+
+	@classmethod
+	def remote(cls):
+		cls.reads += 1
+		if cls.latency:
+			end = time.perf_counter()+cls.latency
+			while time.perf_counter() < end:
+				pass
+
+_runtimeIds = itertools.count(1)
+
+class Element(object):
+
+	def __init__(self, name, role, className="NetUIElement", states=(), description="", automationId="", window=RIBBON_WINDOW, children=(), keyboardShortcut=""):
+		self.name = name
+		self.role = role
+		self.className = className
+		self.states = set(states)
+		self.description = description
+		self.automationId = automationId
+		# UIA access key, as Office gives
+		self.keyboardShortcut = keyboardShortcut
+		self.window = window
+		self.runtimeId = (42, window, next(_runtimeIds))
+		self.parent = None
+		self.children = []
+		for child in children:
+			self.append(child)
+
+	def append(self, child):
+		child.parent = self
+		self.children.append(child)
+		return child
+
+	def index(self):
+		return self.parent.children.index(self) if self.parent else 0
+
+	def positionInfo(self):
+		# Office gives it to items only
+		if self.role in (Role.LISTITEM, Role.DATAITEM, Role.MENUITEM) and self.parent:
+			return {"indexInGroup": self.index()+1, "similarItemsInGroup": len(self.parent.children)}
+		return {}
+
+	def sibling(self, offset):
+		if not self.parent:
+			return None
+		index = self.index()+offset
+		if 0 <= index < len(self.parent.children):
+			return self.parent.children[index]
+
+	def walk(self):
+		yield self
+		for child in self.children:
+			for descendant in child.walk():
+				yield descendant
+
+	def ancestors(self):
+		res = []
+		element = self.parent
+		while element:
+			res.insert(0, element)
+			element = element.parent
+		return res
+
+	@property
+	def focusable(self):
+		return State.FOCUSABLE in self.states and State.UNAVAILABLE not in self.states
+
+class CachedElement(object):
+	# result of BuildUpdatedCache, read locally
+
+	def __init__(self, app, element, request):
+		self.app = app
+		self.element = element
+		self.request = request
+		# built when asked, as the fake prices a call by its reads only
+		self.children = None
+
+	def GetCachedPropertyValue(self, propertyId):
+		if propertyId not in self.request.properties:
+			raise LookupError(propertyId)
+		return cachedValue(self.element, propertyId)
+
+	def GetCachedChildren(self):
+		if self.children is None:
+			self.children = [CachedElement(self.app, child, self.request) for child in self.element.children] if self.request.TreeScope == 7 else []
+		return CachedArray(self.children) if self.children else None
+
+	def createObj(self):
+		# an element of a walk can give its NVDAObject, as any element
+		return FakeObj(self.app, self.element)
+
+class CachedArray(object):
+
+	def __init__(self, items):
+		self.items = items
+		self.Length = len(items)
+
+	def GetElement(self, index):
+		return self.items[index]
+
+def cachedValue(element, propertyId):
+	ids = nvdaStubs.UIA_PROPERTY_IDS
+	if propertyId == ids["UIA_RuntimeIdPropertyId"]:
+		# a new array at every read, as UIA gives
+		return list(element.runtimeId)
+	elif propertyId == ids["UIA_NamePropertyId"]:
+		return element.name
+	elif propertyId == ids["UIA_ControlTypePropertyId"]:
+		return element.role
+	elif propertyId == ids["UIA_ClassNamePropertyId"]:
+		return element.className
+	elif propertyId == ids["UIA_AutomationIdPropertyId"]:
+		return element.automationId
+	elif propertyId == ids["UIA_FullDescriptionPropertyId"]:
+		return element.description
+	elif propertyId == ids["UIA_HelpTextPropertyId"]:
+		return ""
+	elif propertyId == ids["UIA_IsEnabledPropertyId"]:
+		return State.UNAVAILABLE not in element.states
+	elif propertyId == ids["UIA_IsOffscreenPropertyId"]:
+		return State.OFFSCREEN in element.states
+	elif propertyId == ids["UIA_IsKeyboardFocusablePropertyId"]:
+		return State.FOCUSABLE in element.states
+	elif propertyId == ids["UIA_HasKeyboardFocusPropertyId"]:
+		return State.FOCUSED in element.states
+	elif propertyId == ids["UIA_ExpandCollapseExpandCollapseStatePropertyId"]:
+		return 0 if State.COLLAPSED in element.states else 1 if State.EXPANDED in element.states else 3
+	elif propertyId == ids["UIA_SelectionItemIsSelectedPropertyId"]:
+		return State.SELECTED in element.states
+	elif propertyId == ids["UIA_PositionInSetPropertyId"]:
+		return element.positionInfo().get("indexInGroup", 0)
+	elif propertyId == ids["UIA_SizeOfSetPropertyId"]:
+		return element.positionInfo().get("similarItemsInGroup", 0)
+	elif propertyId == ids["UIA_IsTogglePatternAvailablePropertyId"]:
+		return element.role in (Role.TOGGLEBUTTON, Role.CHECKBOX)
+	elif propertyId == ids["UIA_ToggleToggleStatePropertyId"]:
+		return 1 if element.states & {State.PRESSED, State.CHECKED} else 0
+	elif propertyId == ids["UIA_AccessKeyPropertyId"]:
+		return element.keyboardShortcut
+	elif propertyId == ids["UIA_AcceleratorKeyPropertyId"]:
+		return ""
+	raise LookupError(propertyId)
+
+class FakeUIAElement(object):
+
+	def __init__(self, app, element):
+		self.app = app
+		self.element = element
+		# in base cache request of NVDA, so local
+		self.cachedClassName = element.className
+		self.cachedAutomationId = element.automationId
+
+	def getRuntimeId(self):
+		Stats.remote()
+		return list(self.element.runtimeId)
+
+	def BuildUpdatedCache(self, request):
+		Stats.remote()
+		return CachedElement(self.app, self.element, request)
+
+	def relative(self, relation):
+		# raw relations, as the tree walker reads them (see nvdaStubs.TreeWalker)
+		Stats.remote()
+		element = self.element
+		if relation == "parent":
+			res = element.parent
+		elif relation in ("next", "previous"):
+			self.app.stall()
+			res = element.sibling(1 if relation == "next" else -1)
+		elif element.children:
+			res = element.children[0 if relation == "firstChild" else -1]
+		else:
+			res = None
+		return FakeUIAElement(self.app, res) if res else None
+
+	def createObj(self):
+		return FakeObj(self.app, self.element)
+
+class FakeAppModule(object):
+	productName = "Microsoft Office 2021"
+	productVersion = "16.0.14326.20404"
+	appName = "winword"
+
+class NVDAObjectBehavior(object):
+	# what NVDAObject computes from other properties,
+	# shared with replay objects (see replayTrace.py)
+	presType_unavailable = "unavailable"
+	presType_layout = "layout"
+	presType_content = "content"
+	_presentationType = None
+
+	@property
+	def recursiveDescendants(self):
+		for child in self.children:
+			yield child
+			for descendant in child.recursiveDescendants:
+				yield descendant
+
+	@property
+	def presentationType(self):
+		if self._presentationType is None:
+			# as NVDAObject._get_presentationType
+			states = self.states
+			if State.INVISIBLE in states or State.UNAVAILABLE in states:
+				return self.presType_unavailable
+			role = self.role
+			if role in PRES_LAYOUT_ROLES:
+				return self.presType_layout
+			if not self.name and not self.description and role in PRES_ANONYMOUS_LAYOUT_ROLES:
+				return self.presType_layout
+			return self.presType_content
+		return self._presentationType
+
+	@presentationType.setter
+	def presentationType(self, value):
+		self._presentationType = value
+
+	# as NVDAObject simple navigation
+
+	@property
+	def simpleParent(self):
+		obj = self.parent
+		while obj and obj.presentationType != self.presType_content:
+			obj = obj.parent
+		return obj
+
+	def _findSimpleNext(self, useChild=False, useParent=True, goPrevious=False):
+		nextPrevAttrib = "next" if not goPrevious else "previous"
+		firstLastChildAttrib = "firstChild" if not goPrevious else "lastChild"
+		found = None
+		if useChild:
+			child = getattr(self, firstLastChildAttrib)
+			childPresType = child.presentationType if child else None
+			if childPresType == self.presType_content:
+				found = child
+			elif childPresType == self.presType_layout:
+				found = child._findSimpleNext(useChild=True, useParent=False, goPrevious=goPrevious)
+			elif child:
+				found = child._findSimpleNext(useChild=False, useParent=False, goPrevious=goPrevious)
+			if found:
+				return found
+		next = getattr(self, nextPrevAttrib)
+		nextPresType = next.presentationType if next else None
+		if nextPresType == self.presType_content:
+			found = next
+		elif nextPresType == self.presType_layout:
+			found = next._findSimpleNext(useChild=True, useParent=False, goPrevious=goPrevious)
+		elif next:
+			found = next._findSimpleNext(useChild=False, useParent=False, goPrevious=goPrevious)
+		if found:
+			return found
+		parent = self.parent if useParent else None
+		while parent and parent.presentationType != self.presType_content:
+			next = parent._findSimpleNext(useChild=False, useParent=False, goPrevious=goPrevious)
+			if next:
+				return next
+			parent = parent.parent
+
+	@property
+	def simpleNext(self):
+		return self._findSimpleNext()
+
+	@property
+	def simplePrevious(self):
+		return self._findSimpleNext(goPrevious=True)
+
+	def _simpleChild(self, attrib, goPrevious):
+		child = getattr(self, attrib)
+		if not child:
+			return None
+		presType = child.presentationType
+		if presType != self.presType_content:
+			return child._findSimpleNext(useChild=(presType != self.presType_unavailable), useParent=False, goPrevious=goPrevious)
+		return child
+
+	@property
+	def simpleFirstChild(self):
+		return self._simpleChild("firstChild", False)
+
+	@property
+	def simpleLastChild(self):
+		return self._simpleChild("lastChild", True)
+
+class FakeObj(NVDAObjectBehavior):
+
+	def __init__(self, app, element):
+		self.app = app
+		self.element = element
+		self.UIAElement = FakeUIAElement(app, element)
+		self.windowHandle = element.window
+		self.windowClassName = WINDOW_CLASSES[element.window]
+		self.appModule = app.appModule
+		self.processID = app.processID
+		self._presentationType = None
+		clsList = []
+		app.plugin.chooseNVDAObjectOverlayClasses(self, clsList)
+		app.created += 1
+		if threading.current_thread() is not threading.main_thread():
+			# NVDA objects must be created on main thread
+			app.offThreadObjs += 1
+		if app.objRefs is not None:
+			app.objRefs.append(weakref.ref(self))
+
+	def __eq__(self, other):
+		Stats.remote()
+		return isinstance(other, FakeObj) and other.element is self.element
+
+	def __ne__(self, other):
+		return not self.__eq__(other)
+
+	def __hash__(self):
+		return id(self.element)
+
+	def __repr__(self):
+		return "<FakeObj %s %s>"%(self.element.name, self.element.role.name)
+
+	def _obj(self, element):
+		return FakeObj(self.app, element) if element else None
+
+	@property
+	def name(self):
+		Stats.remote()
+		return self.element.name
+
+	@property
+	def role(self):
+		Stats.remote()
+		return self.element.role
+
+	@property
+	def states(self):
+		Stats.remote()
+		return set(self.element.states)
+
+	@property
+	def description(self):
+		Stats.remote()
+		return self.element.description
+
+	@property
+	def keyboardShortcut(self):
+		Stats.remote()
+		return self.element.keyboardShortcut
+
+	@property
+	def value(self):
+		Stats.remote()
+		return None
+
+	@property
+	def roleText(self):
+		Stats.remote()
+		return None
+
+	@property
+	def current(self):
+		Stats.remote()
+		return None
+
+	@property
+	def placeholder(self):
+		Stats.remote()
+		return None
+
+	@property
+	def positionInfo(self):
+		Stats.remote()
+		return self.element.positionInfo()
+
+	@property
+	def isFocusable(self):
+		Stats.remote()
+		return State.FOCUSABLE in self.element.states
+
+	@property
+	def hasFocus(self):
+		Stats.remote()
+		return self.app.focus is self.element
+
+	@property
+	def parent(self):
+		Stats.remote()
+		return self._obj(self.element.parent)
+
+	@property
+	def next(self):
+		Stats.remote()
+		self.app.stall()
+		return self._obj(self.element.sibling(1))
+
+	@property
+	def previous(self):
+		Stats.remote()
+		self.app.stall()
+		return self._obj(self.element.sibling(-1))
+
+	@property
+	def firstChild(self):
+		Stats.remote()
+		return self._obj(self.element.children[0]) if self.element.children else None
+
+	@property
+	def lastChild(self):
+		Stats.remote()
+		return self._obj(self.element.children[-1]) if self.element.children else None
+
+	@property
+	def childCount(self):
+		Stats.remote()
+		return len(self.element.children)
+
+	@property
+	def children(self):
+		Stats.remote()
+		return [self._obj(child) for child in self.element.children]
+
+	def setFocus(self):
+		Stats.remote()
+		if not self.element.focusable:
+			raise RuntimeError("not focusable")
+		self.app.queueFocus(self.element)
+
+	def doAction(self):
+		Stats.remote()
+		self.app.doAction(self.element)
+
+def buildGroups(tabName, groups, buttons, window=RIBBON_WINDOW, comboEntries=0):
+	res = []
+	for groupIndex in range(groups):
+		group = Element("%s group %d"%(tabName, groupIndex+1), Role.GROUPING, className="NetUIChunk", window=window)
+		for buttonIndex in range(buttons):
+			name = "%s command %d.%d"%(tabName, groupIndex+1, buttonIndex+1)
+			if buttonIndex == 1:
+				# a combobox with a big dropdown list
+				combo = group.append(Element(name, Role.COMBOBOX, className="NetUIDropdownAnchor", states=(State.FOCUSABLE, State.COLLAPSED), window=window))
+				if comboEntries and groupIndex == 0:
+					# entries (as fonts or styles) before the edit: worst case for a depth-first walk
+					entries = combo.append(Element("%s entries"%name, Role.LIST, className="NetUIGalleryContainer", window=window))
+					for entryIndex in range(comboEntries):
+						entries.append(Element("%s entry %d"%(name, entryIndex+1), Role.LISTITEM, className="NetUIGalleryButton", states=(State.OFFSCREEN,), window=window))
+				edit = combo.append(Element(name, Role.EDITABLETEXT, className="NetUIEdit", states=(State.FOCUSABLE,), window=window))
+			elif buttonIndex == 2:
+				group.append(Element(name, Role.SPLITBUTTON, className="NetUIAnchor", states=(State.FOCUSABLE, State.COLLAPSED), window=window))
+			elif buttonIndex == buttons-1 and groupIndex == 0:
+				# not available command
+				group.append(Element(name, Role.BUTTON, className="NetUIRibbonButton", states=(State.FOCUSABLE, State.UNAVAILABLE), window=window))
+			elif buttonIndex == 3 and groupIndex == 0:
+				# a pressed toggle (as Bold)
+				group.append(Element(name, Role.TOGGLEBUTTON, className="NetUIRibbonButton", states=(State.FOCUSABLE, State.PRESSED), window=window, keyboardShortcut="Alt, Y, 1"))
+			else:
+				group.append(Element(name, Role.BUTTON, className="NetUIRibbonButton", states=(State.FOCUSABLE,), window=window, keyboardShortcut="Alt, Y, %d%d"%(groupIndex+1, buttonIndex+1)))
+		res.append(group)
+	return res
+
+class FakeOffice(object):
+	# the simulated application, view one of "v1", "v2", "v3"
+
+	processID = 4242
+
+	def __init__(self, plugin, view="v2", tabs=10, groups=6, buttons=6, submenuItems=8, comboEntries=0, galleryItems=0):
+		self.plugin = plugin
+		self.view = view
+		self.groups = groups
+		self.buttons = buttons
+		# entries in first combobox of every tab
+		self.comboEntries = comboEntries
+		self.submenuItems = submenuItems
+		# items of a gallery in submenus, before menu items
+		self.galleryItems = galleryItems
+		self.appModule = FakeAppModule()
+		# a new process for NVDA (see appInfo.py)
+		sys.modules["appModuleHandler"].runningTable[self.processID] = self.appModule
+		self.events = []
+		self.created = 0
+		self.offThreadObjs = 0
+		# weak references to objects created, when tracked (see benchLeaks)
+		self.objRefs = None
+		self.focus = None
+		# focus events Office will not send (focus moves anyway)
+		self.dropFocus = 0
+		# seconds next sibling read will take (Office repaginating, recalculating)
+		self.busy = 0.0
+		# busy, from next focus event on (Office busy while add-on handles it)
+		self.busyAfterFocus = 0.0
+		self.popup = None
+		self.popupOpener = None
+		# opener -> gallery, kept between openings (see gallery)
+		self.galleries = {}
+		self.window = Element("Document - Word", Role.WINDOW, className="OpusApp", window=DOCUMENT_WINDOW)
+		self.document = self.window.append(Element("Page 1 content", Role.EDITABLETEXT, className="_WwG", states=(State.FOCUSABLE,), window=DOCUMENT_WINDOW))
+		self.root = Element("Ribbon", Role.PANE, className="NetUIRibbon")
+		self.window.children.insert(0, self.root)
+		self.root.parent = self.window
+		tabNames = ["File"]+["Tab %d"%index for index in range(1, tabs)]
+		if view == "v1":
+			# full screen: tabs under a menuitem, in an unknown container
+			holder = self.root.append(Element("", Role.MENUITEM, className="NetUIRibbonTabs"))
+			self.tabList = holder.append(Element("", Role.UNKNOWN, className="NetUIElement"))
+			self.contentParent = holder
+		else:
+			self.tabList = self.root.append(Element("Ribbon Tabs", Role.TABCONTROL, className="NetUIRibbonTabs"))
+			self.contentParent = self.root
+		self.tabs = []
+		for name in tabNames:
+			if name == "File":
+				tab = Element("File Tab", Role.BUTTON, className="NetUIRibbonTab", states=(State.FOCUSABLE,))
+			else:
+				tab = Element(name, Role.TAB, className="NetUIRibbonTab", states=(State.FOCUSABLE,))
+			self.tabList.append(tab)
+			self.tabs.append(tab)
+		self.root.append(Element("Scroll right", Role.BUTTON, className="NetUIRepeatButton"))
+		self.content = None
+		self.selectTab(self.tabs[1], show=(view != "v2"))
+
+	# tree building
+
+	def selectTab(self, tab, show=True):
+		for other in self.tabs:
+			other.states.discard(State.SELECTED)
+		tab.states.add(State.SELECTED)
+		self.selectedTab = tab
+		if self.content:
+			self.contentParent.children.remove(self.content)
+			self.content = None
+		if not show:
+			return
+		groupMenu = Element(tab.name, Role.PANE, className="NetUIElement", children=buildGroups(tab.name, self.groups, self.buttons, comboEntries=self.comboEntries))
+		if self.view == "v3":
+			# anonymous subtab, in a named grouping
+			subtab = Element("", Role.PANE, className="NetUIPanViewer", children=[groupMenu])
+			self.content = Element(tab.name, Role.GROUPING, className="NetUIElement", children=[subtab])
+		else:
+			self.content = Element(tab.name, Role.PANE, className="NetUIPanViewer", children=[groupMenu])
+		self.contentParent.append(self.content)
+
+	def focusables(self):
+		if not self.content:
+			return []
+		return [element for element in self.content.walk() if element.focusable and element.role != Role.EDITABLETEXT]
+
+	def openPopup(self, opener):
+		popup = Element("", Role.POPUPMENU, className="NetUIPopup", window=POPUP_WINDOW)
+		if self.galleryItems:
+			popup.append(self.gallery(opener))
+		for index in range(self.submenuItems):
+			popup.append(Element("%s item %d"%(opener.name, index+1), Role.MENUITEM, className="NetUIMenuItem", states=(State.FOCUSABLE,), window=POPUP_WINDOW))
+		opener.append(popup)
+		opener.states.discard(State.COLLAPSED)
+		opener.states.add(State.EXPANDED)
+		self.popup = popup
+		self.popupOpener = opener
+		self.queueFocus(next(element for element in popup.walk() if element.focusable))
+
+	def gallery(self, opener):
+		# Office builds it once, not at every opening
+		try:
+			return self.galleries[opener]
+		except KeyError:
+			pass
+		grid = Element("%s gallery"%opener.name, Role.DATAGRID, className="NetUIGalleryContainer", window=POPUP_WINDOW)
+		for index in range(self.galleryItems):
+			grid.append(Element("%s style %d"%(opener.name, index+1), Role.DATAITEM, className="NetUIGalleryButton", states=(State.FOCUSABLE,), window=POPUP_WINDOW))
+		self.galleries[opener] = grid
+		return grid
+
+	def popupItems(self):
+		return [element for element in self.popup.walk() if element.focusable]
+
+	def closePopup(self):
+		opener = self.popupOpener
+		opener.children.remove(self.popup)
+		opener.states.discard(State.EXPANDED)
+		opener.states.add(State.COLLAPSED)
+		self.popup = self.popupOpener = None
+		self.queueFocus(opener)
+
+	# NVDA side
+
+	def obj(self, element):
+		return FakeObj(self, element) if element else None
+
+	def start(self):
+		# user presses alt: focus on selected tab, exploration starts
+		self.queueFocus(self.selectedTab)
+		self.pumpEvents()
+
+	def queueFocus(self, element):
+		self.events.append(("focus", element))
+
+	def pumpEvents(self):
+		# deliver queued events, as NVDA does in its core cycle
+		while self.events:
+			kind, element = self.events.pop(0)
+			if kind == "focus":
+				self.deliverFocus(element)
+
+	def deliverFocus(self, element):
+		import api, globalVars
+		old = self.focus
+		if old:
+			old.states.discard(State.FOCUSED)
+		self.focus = element
+		element.states.add(State.FOCUSED)
+		if self.busyAfterFocus:
+			self.busy = self.busyAfterFocus
+			self.busyAfterFocus = 0.0
+		if self.dropFocus:
+			self.dropFocus -= 1
+			return
+		if old:
+			self.plugin.event_loseFocus(self.obj(old), lambda: None)
+		# as NVDA: focus and ancestors are updated before focusEntered events
+		oldAncestors = globalVars.focusAncestors
+		ancestors = []
+		entered = []
+		for index, ancestor in enumerate(element.ancestors()):
+			if not entered and index < len(oldAncestors) and oldAncestors[index].element is ancestor:
+				ancestors.append(oldAncestors[index])
+				continue
+			obj = self.obj(ancestor)
+			ancestors.append(obj)
+			entered.append(obj)
+		obj = self.obj(element)
+		api.setFocusObject(obj)
+		globalVars.focusAncestors = ancestors
+		for ancestor in entered:
+			self.plugin.event_focusEntered(ancestor, lambda: None)
+		self.plugin.event_gainFocus(obj, lambda: nvdaStubs._record("speakObject", obj))
+
+	# Office side
+
+	def stall(self):
+		if self.busy:
+			busy = self.busy
+			self.busy = 0.0
+			time.sleep(busy)
+
+	def doAction(self, element):
+		if element in self.tabs:
+			self.selectTab(element)
+			self.enterContent()
+		elif State.COLLAPSED in element.states:
+			self.openPopup(element)
+
+	def enterContent(self):
+		if not self.content:
+			self.selectTab(self.selectedTab)
+		focusables = self.focusables()
+		if focusables:
+			self.queueFocus(focusables[0])
+
+	def onKey(self, name):
+		# keys are processed in order, even before their focus events are delivered
+		queued = [element for kind, element in self.events if kind == "focus"]
+		focus = queued[-1] if queued else self.focus
+		if focus in self.tabs:
+			if name in ("downArrow", "enter"):
+				self.enterContent()
+			elif name in ("rightArrow", "leftArrow"):
+				index = self.tabs.index(focus)+(1 if name == "rightArrow" else -1)
+				self.queueFocus(self.tabs[index%len(self.tabs)])
+			elif name == "escape":
+				self.queueFocus(self.document)
+			return
+		if self.popup and focus in self.popupItems():
+			items = self.popupItems()
+			if name in ("alt+upArrow", "escape", "leftArrow"):
+				self.closePopup()
+			elif name in ("downArrow", "tab", "upArrow", "shift+tab"):
+				offset = 1 if name in ("downArrow", "tab") else -1
+				self.queueFocus(items[(items.index(focus)+offset)%len(items)])
+			return
+		focusables = self.focusables()
+		if focus in focusables:
+			if name == "alt+downArrow" and State.COLLAPSED in focus.states:
+				self.openPopup(focus)
+			elif name in ("tab", "shift+tab", "downArrow", "upArrow", "rightArrow", "leftArrow"):
+				offset = 1 if name in ("tab", "downArrow", "rightArrow") else -1
+				self.queueFocus(focusables[(focusables.index(focus)+offset)%len(focusables)])
+			elif name == "escape":
+				if self.view == "v2":
+					self.selectTab(self.selectedTab, show=False)
+				self.queueFocus(self.selectedTab)
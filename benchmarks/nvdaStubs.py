@@ -0,0 +1,430 @@
+# -*- coding: UTF-8 -*-
+# Author: Alberto Buffolino
+# License: GPLv2
+"""
+Minimal stand-ins for the NVDA modules used by the add-on,
+to import and drive it on any OS (see runBenchmarks.py).
+Only what the add-on uses is provided; output functions
+record what would be spoken/brailled, with a timestamp.
+"""
+import builtins
+import enum
+import os
+import shutil
+import sys
+import tempfile
+import time
+import types
+
+# what the add-on reported, as (time, kind, value)
+output = []
+# Timer objects scheduled with core.callLater
+timers = []
+# simulated clock for timers, in seconds
+clock = [0.0]
+
+def _module(name, **attrs):
+	module = types.ModuleType(name)
+	module.__dict__.update(attrs)
+	sys.modules[name] = module
+	return module
+
+def _record(kind, value):
+	output.append((time.perf_counter(), kind, value))
+
+class Role(enum.IntEnum):
+	UNKNOWN = 0
+	WINDOW = 1
+	TITLEBAR = 2
+	PANE = 3
+	DIALOG = 4
+	CHECKBOX = 5
+	RADIOBUTTON = 6
+	STATICTEXT = 7
+	EDITABLETEXT = 8
+	BUTTON = 9
+	MENUBAR = 10
+	MENUITEM = 11
+	POPUPMENU = 12
+	COMBOBOX = 13
+	LIST = 14
+	LISTITEM = 15
+	GRAPHIC = 16
+	TAB = 17
+	TABCONTROL = 18
+	TOOLBAR = 19
+	GROUPING = 20
+	DATAGRID = 21
+	DATAITEM = 22
+	SPLITBUTTON = 23
+	DROPDOWNBUTTON = 24
+	MENUBUTTON = 25
+	TOGGLEBUTTON = 26
+	PANEL = 27
+	SECTION = 28
+
+	@property
+	def displayString(self):
+		return self.name.lower()
+
+class State(enum.IntEnum):
+	UNAVAILABLE = 0x1
+	FOCUSED = 0x2
+	SELECTED = 0x4
+	BUSY = 0x8
+	PRESSED = 0x10
+	CHECKED = 0x20
+	HALFCHECKED = 0x40
+	READONLY = 0x80
+	EXPANDED = 0x100
+	COLLAPSED = 0x200
+	INVISIBLE = 0x400
+	OFFSCREEN = 0x20000
+	FOCUSABLE = 0x100000
+	CHECKABLE = 0x200000
+
+	@property
+	def displayString(self):
+		return self.name.lower()
+
+class OutputReason(enum.Enum):
+	FOCUS = "focus"
+	QUERY = "query"
+
+def processAndLabelStates(role, states, reason, positiveStates=None, negativeStates=None, positiveStateLabelDict={}, negativeStateLabelDict={}):
+	labels = [state.displayString for state in sorted(positiveStates or states) if state not in (State.FOCUSABLE, State.FOCUSED, State.OFFSCREEN, State.CHECKABLE)]
+	# as NVDA negative states
+	if role == Role.TOGGLEBUTTON and State.PRESSED not in states:
+		labels.append("not pressed")
+	elif State.CHECKABLE in states and not states & {State.CHECKED, State.HALFCHECKED}:
+		labels.append("not checked")
+	return labels
+
+# as NVDA user settings
+conf = {"presentation": {"reportObjectDescriptions": True, "reportKeyboardShortcuts": True, "reportObjectPositionInformation": True}}
+
+def getPropertiesSpeech(reason=None, **props):
+	# as speech.getPropertiesSpeech, on the properties given
+	sequence = []
+	if props.get("name"):
+		sequence.append(props["name"])
+	role = props.get("role")
+	if props.get("roleText"):
+		sequence.append(props["roleText"])
+	elif role is not None:
+		sequence.append(role.displayString)
+	if "states" in props:
+		sequence.extend(processAndLabelStates(role, props["states"], reason))
+	if props.get("value"):
+		sequence.append(props["value"])
+	elif props.get("placeholder"):
+		sequence.append(props["placeholder"])
+	if props.get("description"):
+		sequence.append(props["description"])
+	if props.get("keyboardShortcut"):
+		sequence.append(props["keyboardShortcut"])
+	indexInGroup = props.get("positionInfo_indexInGroup", 0)
+	similarItemsInGroup = props.get("positionInfo_similarItemsInGroup", 0)
+	if 0 < indexInGroup <= similarItemsInGroup:
+		sequence.append("%d of %d"%(indexInGroup, similarItemsInGroup))
+	if props.get("positionInfo_level") is not None:
+		sequence.append("level %d"%props["positionInfo_level"])
+	if props.get("current"):
+		sequence.append("current")
+	return sequence
+
+# what speech.getObjectSpeech asks an object, before user settings
+OBJECT_PROPERTIES = (
+	"name", "role", "roleText", "states", "value", "description", "keyboardShortcut",
+	"positionInfo_level", "positionInfo_indexInGroup", "positionInfo_similarItemsInGroup",
+	"current", "placeholder",
+)
+
+def getObjectProperties(obj):
+	# what speakObject and handleGainFocus ask obj, as NVDA selects them
+	# (speech.getObjectSpeech, then getObjectPropertiesSpeech), following settings;
+	# independent of what the add-on selects from cache
+	presentation = conf["presentation"]
+	allowed = set(OBJECT_PROPERTIES)
+	if not presentation["reportObjectDescriptions"]:
+		allowed.discard("description")
+	if not presentation["reportKeyboardShortcuts"]:
+		allowed.discard("keyboardShortcut")
+	if not presentation["reportObjectPositionInformation"]:
+		allowed -= set(name for name in OBJECT_PROPERTIES if name.startswith("positionInfo_"))
+	props = {}
+	positionInfo = None
+	for name in OBJECT_PROPERTIES:
+		if name not in allowed:
+			continue
+		elif name.startswith("positionInfo_"):
+			if positionInfo is None:
+				positionInfo = obj.positionInfo or {}
+			key = name[len("positionInfo_"):]
+			if key in positionInfo:
+				props[name] = positionInfo[key]
+		else:
+			props[name] = getattr(obj, name)
+	if "description" in props and props["description"] == props["name"]:
+		del props["description"]
+	return props
+
+class Log(object):
+
+	def __init__(self):
+		self.messages = []
+
+	def _add(self, msg, *args, **kwargs):
+		self.messages.append(msg)
+
+	info = debug = warning = error = exception = debugWarning = _add
+
+class GlobalPlugin(object):
+
+	def __init__(self):
+		self._gestureMap = {}
+
+	def bindGesture(self, gestureIdentifier, scriptName):
+		self._gestureMap[gestureIdentifier.lower()] = scriptName
+
+	def clearGestureBindings(self):
+		self._gestureMap.clear()
+
+	def getScript(self, gesture):
+		scriptName = self._gestureMap.get("kb:%s"%gesture.name.lower())
+		return getattr(self, "script_%s"%scriptName, None) if scriptName else None
+
+	def terminate(self):
+		pass
+
+class NVDAObject(object):
+	presType_unavailable = "unavailable"
+	presType_layout = "layout"
+	presType_content = "content"
+
+class UIA(NVDAObject):
+	# as NVDA, the NVDAObject of an element, created with its overlay classes
+	# (see fakeRibbon.FakeUIAElement, replayTrace.ReplayUIAElement)
+
+	def __new__(cls, UIAElement=None):
+		return UIAElement.createObj()
+
+class TreeWalker(object):
+	# UIA raw view walker, elements give their relatives
+
+	def GetParentElementBuildCache(self, element, cacheRequest):
+		return element.relative("parent")
+
+	def GetNextSiblingElementBuildCache(self, element, cacheRequest):
+		return element.relative("next")
+
+	def GetPreviousSiblingElementBuildCache(self, element, cacheRequest):
+		return element.relative("previous")
+
+	def GetFirstChildElementBuildCache(self, element, cacheRequest):
+		return element.relative("firstChild")
+
+	def GetLastChildElementBuildCache(self, element, cacheRequest):
+		return element.relative("lastChild")
+
+class IAccessible(NVDAObject):
+
+	def script_caret_moveByLine(self, gesture):
+		pass
+
+class KeyboardInputGesture(object):
+	# set by the simulated application, to react to keys
+	sendHandler = None
+
+	def __init__(self, name):
+		self.name = name
+
+	@classmethod
+	def fromName(cls, name):
+		return cls(name)
+
+	def send(self):
+		_record("key", self.name)
+		if KeyboardInputGesture.sendHandler:
+			KeyboardInputGesture.sendHandler(self.name)
+
+def callLater(delay, func, *args, **kwargs):
+	timer = Timer(clock[0]+delay/1000.0, func, args, kwargs)
+	timers.append(timer)
+	return timer
+
+class Timer(object):
+
+	def __init__(self, due, func, args, kwargs):
+		self.due = due
+		self.func = func
+		self.args = args
+		self.kwargs = kwargs
+		self.stopped = False
+
+	def Stop(self):
+		self.stopped = True
+
+	def IsRunning(self):
+		return not self.stopped and self in timers
+
+def runTimers(seconds):
+	# advance simulated clock, running timers due in the meantime
+	end = clock[0]+seconds
+	while True:
+		due = [timer for timer in timers if timer.due <= end]
+		if not due:
+			break
+		timer = min(due, key=lambda t: t.due)
+		timers.remove(timer)
+		clock[0] = max(clock[0], timer.due)
+		if not timer.stopped:
+			timer.func(*timer.args, **timer.kwargs)
+	clock[0] = end
+
+class _Api(object):
+
+	def __init__(self):
+		self.focus = None
+		self.navigator = None
+
+# UIA property ids, as in UIAutomationClient
+UIA_PROPERTY_IDS = dict((name, 30000+index) for index, name in enumerate((
+	"UIA_RuntimeIdPropertyId", "UIA_NamePropertyId", "UIA_ControlTypePropertyId",
+	"UIA_ClassNamePropertyId", "UIA_AutomationIdPropertyId", "UIA_FullDescriptionPropertyId",
+	"UIA_HelpTextPropertyId", "UIA_IsEnabledPropertyId", "UIA_IsOffscreenPropertyId",
+	"UIA_IsKeyboardFocusablePropertyId", "UIA_HasKeyboardFocusPropertyId",
+	"UIA_ExpandCollapseExpandCollapseStatePropertyId", "UIA_SelectionItemIsSelectedPropertyId",
+	"UIA_PositionInSetPropertyId", "UIA_SizeOfSetPropertyId",
+	"UIA_IsTogglePatternAvailablePropertyId", "UIA_ToggleToggleStatePropertyId",
+	"UIA_AccessKeyPropertyId", "UIA_AcceleratorKeyPropertyId",
+)))
+
+class CacheRequest(object):
+
+	def __init__(self):
+		self.properties = []
+		self.TreeScope = None
+
+	def AddProperty(self, propertyId):
+		self.properties.append(propertyId)
+
+	def Clone(self):
+		request = CacheRequest()
+		request.properties = list(self.properties)
+		request.TreeScope = self.TreeScope
+		return request
+
+# (root key, path) -> {value name: data}, as Office 2016+ saves its UI language
+REGISTRY = {
+	(0x80000001, r"Software\Microsoft\Office\16.0\Common\LanguageResources"): {"UILanguageTag": "en-US"},
+}
+
+class RegistryKey(object):
+
+	def __init__(self, values):
+		self.values = values
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		return False
+
+def openKey(root, path):
+	values = REGISTRY.get((root, path))
+	if values is None:
+		raise FileNotFoundError(path)
+	return RegistryKey(values)
+
+def queryValueEx(key, name):
+	if name not in key.values:
+		raise FileNotFoundError(name)
+	return (key.values[name], 1)
+
+def install():
+	if "api" in sys.modules and getattr(sys.modules["api"], "_isStub", False):
+		return
+	builtins._ = lambda text: text
+	builtins.pgettext = lambda context, text: text
+	_module("tones", beep=lambda *args, **kwargs: None)
+	_module("globalPluginHandler", GlobalPlugin=GlobalPlugin)
+	_module("addonHandler", initTranslation=lambda: None)
+	_module("controlTypes", Role=Role, State=State, OutputReason=OutputReason, processAndLabelStates=processAndLabelStates)
+	_module("ui", message=lambda text, *args, **kwargs: _record("message", text))
+	apiState = _Api()
+	api = _module("api", _isStub=True, state=apiState)
+	api.getFocusObject = lambda: apiState.focus
+	api.getNavigatorObject = lambda: apiState.navigator
+	def setFocusObject(obj):
+		apiState.focus = obj
+		return True
+	def setNavigatorObject(obj, *args, **kwargs):
+		apiState.navigator = obj
+		return True
+	api.setFocusObject = setFocusObject
+	api.setNavigatorObject = setNavigatorObject
+	_module("config", conf=conf)
+	_module("speech",
+		getPropertiesSpeech=getPropertiesSpeech,
+		speakObject=lambda obj, reason=None, **kwargs: _record("speak", getPropertiesSpeech(reason, **getObjectProperties(obj))),
+		speak=lambda sequence, *args, **kwargs: _record("speak", list(sequence)),
+		speakText=lambda text, *args, **kwargs: _record("speak", [text]),
+		cancelSpeech=lambda: _record("cancel", None),
+	)
+	handler = types.SimpleNamespace(
+		handleGainFocus=lambda obj, *args, **kwargs: _record("braille", " ".join(getPropertiesSpeech(**getObjectProperties(obj)))),
+		message=lambda text: _record("brailleMessage", text),
+	)
+	_module("braille", handler=handler)
+	_module("keyboardHandler", KeyboardInputGesture=KeyboardInputGesture)
+	nvdaObjects = _module("NVDAObjects", NVDAObject=NVDAObject)
+	nvdaObjects.IAccessible = _module("NVDAObjects.IAccessible", IAccessible=IAccessible)
+	nvdaObjects.UIA = _module("NVDAObjects.UIA", UIA=UIA)
+	reviewState = {"mode": "object"}
+	def setCurrentMode(mode, updateReviewPosition=True):
+		reviewState["mode"] = mode
+		return True
+	_module("review", getCurrentMode=lambda: reviewState["mode"], setCurrentMode=setCurrentMode)
+	_module("scriptHandler", _lastScriptRef=None, getLastScriptRepeatCount=lambda: 0)
+	configPath = tempfile.mkdtemp(prefix="ribbonExplorerBench")
+	_module("globalVars", focusAncestors=[], appArgs=types.SimpleNamespace(configPath=configPath))
+	_module("logHandler", log=Log())
+	_module("core", callLater=callLater)
+	_module("queueHandler", eventQueue="eventQueue", queueFunction=lambda queue, func, *args, **kwargs: callLater(0, func, *args, **kwargs))
+	_module("appModuleHandler", runningTable={})
+	uia = _module("UIAHandler",
+		handler=types.SimpleNamespace(clientObject=types.SimpleNamespace(CreateCacheRequest=CacheRequest), baseTreeWalker=TreeWalker(), baseCacheRequest=CacheRequest()),
+		TreeScope_Element=1, TreeScope_Children=2, TreeScope_Descendants=4, TreeScope_Subtree=7,
+		ExpandCollapseState_Collapsed=0, ExpandCollapseState_Expanded=1,
+		ExpandCollapseState_PartiallyExpanded=2, ExpandCollapseState_LeafNode=3,
+		UIAControlTypesToNVDARoles=dict((role, role) for role in Role),
+		ToggleState_Off=0, ToggleState_On=1, ToggleState_Indeterminate=2,
+	)
+	uia.__dict__.update(UIA_PROPERTY_IDS)
+	_module("languageHandler", getLanguage=lambda: "en")
+	# Windows only: Office UI language (see appInfo.getOfficeLanguage)
+	_module("winreg", HKEY_CURRENT_USER=0x80000001, OpenKey=openKey, QueryValueEx=queryValueEx)
+
+def importAddon(addonPath=None):
+	# addonPath: a globalPlugins folder, to compare another version of the add-on
+	install()
+	if addonPath is None:
+		addonPath = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "addon", "globalPlugins")
+	addonPath = os.path.abspath(addonPath)
+	if addonPath not in sys.path:
+		sys.path.insert(0, addonPath)
+	import ribbonExplorer
+	return ribbonExplorer
+
+def reset(keepLayouts=False):
+	# keepLayouts: Ribbon layouts saved by previous sessions are kept (see layoutStore.py)
+	if not keepLayouts:
+		shutil.rmtree(os.path.join(sys.modules["globalVars"].appArgs.configPath, "ribbonExplorer", "layouts"), ignore_errors=True)
+	del output[:]
+	del timers[:]
+	api = sys.modules["api"]
+	api.state.focus = None
+	api.state.navigator = None
+	sys.modules["globalVars"].focusAncestors = []
+	sys.modules["scriptHandler"]._lastScriptRef = None
@@ -0,0 +1,449 @@
+# -*- coding: UTF-8 -*-
+# Author: Alberto Buffolino
+# License: GPLv2
+"""
+Deterministic replay of a session recorded by the add-on (see recorder.py),
+to measure a change against real Office traces instead of the simulated Ribbon.
+Events and scripts are delivered to the add-on in recorded order, with timers
+advanced by recorded time; objects answer properties with values read
+in the same point of the real session (or with their last snapshot),
+and navigate recorded Ribbon structure as NVDA would.
+Reports handler time and property reads per event type and script;
+properties asked but never recorded are reported as misses.
+Usage: python benchmarks/replayTrace.py TRACE [--addon GLOBALPLUGINS_PATH] [--latency MS] [--json FILE]
+"""
+import argparse
+import json
+import sys
+import time
+import weakref
+import nvdaStubs
+from nvdaStubs import Role, State
+from fakeRibbon import Stats, NVDAObjectBehavior
+
+# answers for properties not in trace
+DEFAULTS = {
+	"name": "",
+	"description": "",
+	"keyboardShortcut": "",
+	"value": None,
+	"roleText": None,
+	"current": None,
+	"placeholder": None,
+	"positionInfo": {},
+	"isFocusable": False,
+	"windowHandle": 0,
+	"windowClassName": "",
+	"children": [],
+	"childCount": 0,
+	"parent": None,
+	"next": None,
+	"previous": None,
+	"firstChild": None,
+	"lastChild": None,
+	"simpleParent": None,
+	"simpleNext": None,
+	"simplePrevious": None,
+	"simpleFirstChild": None,
+	"simpleLastChild": None,
+}
+MISSING = object()
+
+class ReplayUIAElement(object):
+
+	def __init__(self, world, objId):
+		self.world = world
+		self.objId = objId
+
+	@property
+	def cachedClassName(self):
+		Stats.remote()
+		return self.world.value(self.objId, "className")
+
+	@property
+	def cachedAutomationId(self):
+		Stats.remote()
+		return self.world.value(self.objId, "automationId")
+
+	def getRuntimeId(self):
+		Stats.remote()
+		return self.world.runtimeIds[self.objId]
+
+	def relative(self, relation):
+		# raw relations, as the tree walker reads them (see nvdaStubs.TreeWalker)
+		Stats.remote()
+		objId = self.world.relativeId(self.objId, relation)
+		return ReplayUIAElement(self.world, objId) if objId is not None else None
+
+	def createObj(self):
+		return self.world.obj(self.objId)
+
+class ReplayObj(NVDAObjectBehavior):
+	# relations come from recorded structure, if known,
+	# so simple navigation depends on presentationType chosen by add-on
+
+	def __init__(self, world, objId):
+		self.world = world
+		self.objId = objId
+		if world.runtimeIds.get(objId):
+			self.UIAElement = ReplayUIAElement(world, objId)
+		self.appModule = world.appModule
+		# as NVDA, overlay classes are chosen at every object creation
+		start = time.perf_counter()
+		reads = Stats.reads
+		world.plugin.chooseNVDAObjectOverlayClasses(self, [])
+		world.results.add("overlayClasses", (time.perf_counter()-start)*1000, Stats.reads-reads)
+
+	def __getattr__(self, attr):
+		if attr.startswith("_") or attr == "UIAElement":
+			raise AttributeError(attr)
+		Stats.remote()
+		return self.world.value(self.objId, attr)
+
+	def __eq__(self, other):
+		Stats.remote()
+		return isinstance(other, ReplayObj) and other.objId == self.objId
+
+	def __ne__(self, other):
+		return not self.__eq__(other)
+
+	def __hash__(self):
+		return self.objId
+
+	def __repr__(self):
+		return "<ReplayObj %d %s>"%(self.objId, self.world.snapshots.get(self.objId, {}).get("name"))
+
+	@property
+	def states(self):
+		Stats.remote()
+		return set(self.world.value(self.objId, "states"))
+
+	@property
+	def role(self):
+		Stats.remote()
+		return self.world.value(self.objId, "role")
+
+	@property
+	def hasFocus(self):
+		Stats.remote()
+		focus = self.world.focus
+		return focus is not None and focus.objId == self.objId
+
+	def _relation(self, attr):
+		Stats.remote()
+		world = self.world
+		if attr in ("children", "childCount"):
+			children = world.childrenOf.get(self.objId)
+			if children is None:
+				return world.value(self.objId, attr)
+			return [world.obj(child) for child in children] if attr == "children" else len(children)
+		return world.obj(world.relativeId(self.objId, attr))
+
+	parent = property(lambda self: self._relation("parent"))
+	next = property(lambda self: self._relation("next"))
+	previous = property(lambda self: self._relation("previous"))
+	firstChild = property(lambda self: self._relation("firstChild"))
+	lastChild = property(lambda self: self._relation("lastChild"))
+	children = property(lambda self: self._relation("children"))
+	childCount = property(lambda self: self._relation("childCount"))
+
+	def _simpleRelation(self, attr):
+		if self.world.hasStructure(self.objId):
+			return getattr(NVDAObjectBehavior, attr).fget(self)
+		# only what the recorded add-on saw
+		Stats.remote()
+		return self.world.value(self.objId, attr)
+
+	simpleParent = property(lambda self: self._simpleRelation("simpleParent"))
+	simpleNext = property(lambda self: self._simpleRelation("simpleNext"))
+	simplePrevious = property(lambda self: self._simpleRelation("simplePrevious"))
+	simpleFirstChild = property(lambda self: self._simpleRelation("simpleFirstChild"))
+	simpleLastChild = property(lambda self: self._simpleRelation("simpleLastChild"))
+
+	def setFocus(self):
+		# consequences are the recorded events
+		Stats.remote()
+
+	def doAction(self):
+		Stats.remote()
+
+class Gesture(object):
+
+	def __init__(self, name, mainKeyName=None):
+		self.name = name
+		self.mainKeyName = mainKeyName or name
+
+	def send(self):
+		nvdaStubs.KeyboardInputGesture(self.name).send()
+
+class Results(object):
+	# samples per event type/script, as (ms, reads)
+
+	def __init__(self):
+		self.samples = {}
+
+	def add(self, name, ms, reads):
+		self.samples.setdefault(name, []).append((ms, reads))
+
+	def rows(self):
+		res = []
+		for name in sorted(self.samples):
+			samples = self.samples[name]
+			count = len(samples)
+			res.append({
+				"name": name,
+				"runs": count,
+				"meanMs": round(sum(s[0] for s in samples)/count, 3),
+				"maxMs": round(max(s[0] for s in samples), 3),
+				"totalMs": round(sum(s[0] for s in samples), 3),
+				"reads": round(sum(s[1] for s in samples)/float(count), 1),
+			})
+		return res
+
+	def printTable(self, out=sys.stdout):
+		header = "%-28s %5s %10s %10s %11s %8s"%("event/script", "runs", "mean ms", "max ms", "total ms", "reads")
+		out.write(header+"\n"+"-"*len(header)+"\n")
+		for row in self.rows():
+			out.write("%-28s %5d %10.3f %10.3f %11.3f %8.1f\n"%(row["name"], row["runs"], row["meanMs"], row["maxMs"], row["totalMs"], row["reads"]))
+
+class World(object):
+	# the recorded Office, as known at current point of replay
+
+	def __init__(self, plugin, results):
+		self.plugin = plugin
+		self.results = results
+		self.appModule = None
+		# obj id -> first snapshot, runtime id
+		self.snapshots = {}
+		self.runtimeIds = {}
+		# recorded structure, as obj id -> parent id, obj id -> children ids
+		self.parentOf = {}
+		self.childrenOf = {}
+		# (obj id, property) -> last recorded value
+		self.values = {}
+		# (obj id, property) -> values read during current event/script, in order
+		self.pending = {}
+		# (property) -> times asked but not recorded
+		self.misses = {}
+		self.focus = None
+		self.ancestors = {}
+
+	def addObject(self, entry):
+		snapshot = entry["p"]
+		self.snapshots[entry["id"]] = snapshot
+		self.runtimeIds[entry["id"]] = tuple(entry["rid"]) if entry.get("rid") else None
+		if self.appModule is None and snapshot.get("productName"):
+			self.appModule = type("AppModule", (object,), {"productName": snapshot["productName"]})()
+
+	def addTree(self, entry):
+		nodes = entry["n"]
+		ids = [node[0] for node in nodes]
+		for objId, parentIndex, props in nodes:
+			snapshot = self.snapshots.setdefault(objId, {})
+			snapshot.update(props)
+			snapshot["isFocusable"] = "FOCUSABLE" in props.get("states", {}).get("s", ())
+			snapshot["windowHandle"] = entry["w"]
+			snapshot["windowClassName"] = entry["wc"]
+			self.runtimeIds.setdefault(objId, (0, objId))
+			for attr in props:
+				self.values.pop((objId, attr), None)
+			self.childrenOf[objId] = []
+			if parentIndex >= 0:
+				self.parentOf[objId] = ids[parentIndex]
+				self.childrenOf[ids[parentIndex]].append(objId)
+		root = ids[0]
+		parent = entry.get("pa")
+		if root not in self.parentOf and isinstance(parent, dict) and "o" in parent:
+			self.parentOf[root] = parent["o"]
+
+	def hasStructure(self, objId):
+		return objId in self.childrenOf
+
+	def startStep(self, reads):
+		# values of current step become the known ones,
+		# but served in read order, while they last
+		for key, values in self.pending.items():
+			self.values[key] = values[-1]
+		self.pending.clear()
+		for entry in reads:
+			if entry["k"] == "t":
+				self.addTree(entry)
+			else:
+				self.pending.setdefault((entry["o"], entry["p"]), []).append(entry["v"])
+
+	def value(self, objId, attr):
+		return self.decode(self.recorded(objId, attr), attr)
+
+	def recorded(self, objId, attr):
+		# value as in trace, not decoded
+		key = (objId, attr)
+		values = self.pending.get(key)
+		if values:
+			return values.pop(0) if len(values) > 1 else values[0]
+		value = self.values.get(key, MISSING)
+		if value is MISSING:
+			value = self.snapshots.get(objId, {}).get(attr, MISSING)
+		if value is MISSING:
+			self.misses[attr] = self.misses.get(attr, 0)+1
+			value = DEFAULTS.get(attr, MISSING)
+			if value is MISSING:
+				if attr == "role":
+					return Role.UNKNOWN
+				elif attr == "states":
+					return set()
+				raise AttributeError(attr)
+		return value
+
+	def relativeId(self, objId, attr):
+		# id of a raw relative (parent, next, etc), from recorded structure
+		# or recorded reads, without creating objects
+		if attr == "parent":
+			if objId in self.parentOf:
+				return self.parentOf[objId]
+		elif attr in ("next", "previous"):
+			siblings = self.childrenOf.get(self.parentOf.get(objId))
+			if siblings and objId in siblings:
+				index = siblings.index(objId)+(1 if attr == "next" else -1)
+				return siblings[index] if 0 <= index < len(siblings) else None
+		elif objId in self.childrenOf:
+			children = self.childrenOf[objId]
+			if not children:
+				return None
+			return children[0] if attr == "firstChild" else children[-1]
+		value = self.recorded(objId, attr)
+		return value["o"] if isinstance(value, dict) and "o" in value else None
+
+	def decode(self, value, attr=None):
+		if isinstance(value, list):
+			return [self.decode(item) for item in value]
+		elif not isinstance(value, dict):
+			return value
+		elif "o" in value:
+			return ReplayObj(self, value["o"])
+		elif "s" in value:
+			return set(State[name] for name in value["s"] if name in State.__members__)
+		elif "e" in value:
+			name = value["e"]
+			if attr != "states" and name in Role.__members__:
+				return Role[name]
+			return State[name] if name in State.__members__ else None
+		elif "d" in value:
+			return dict((key, self.decode(item)) for key, item in value["d"].items())
+		return value
+
+	def obj(self, objId):
+		return ReplayObj(self, objId) if objId is not None else None
+
+	def focusAncestors(self, ids):
+		# as NVDA, unchanged ancestors keep their instance
+		ancestors = [self.ancestors.get(objId) or self.obj(objId) for objId in ids]
+		self.ancestors = dict((obj.objId, obj) for obj in ancestors)
+		return ancestors
+
+def loadTrace(path):
+	with open(path) as f:
+		entries = [json.loads(line) for line in f if line.strip()]
+	if not entries or entries[0].get("k") != "h":
+		raise ValueError("%s is not a trace of RibbonExplorer"%path)
+	return entries
+
+def steps(entries, world):
+	# events and scripts, with reads (and subtrees) got while handling them
+	step = None
+	reads = []
+	for entry in entries:
+		kind = entry["k"]
+		if kind == "o":
+			world.addObject(entry)
+		elif kind in ("r", "t"):
+			reads.append(entry)
+		elif kind in ("e", "s"):
+			if step is not None:
+				yield step, reads
+			elif reads:
+				world.startStep(reads)
+			step = entry
+			reads = []
+	if step is not None:
+		yield step, reads
+
+def replay(entries, latency=0.0):
+	import api, globalVars
+	nvdaStubs.reset()
+	ribbonExplorer = sys.modules["ribbonExplorer"]
+	Stats.latency = latency/1000.0
+	results = Results()
+	plugin = ribbonExplorer.GlobalPlugin()
+	# recording starts in a supported application
+	plugin.supportedApp = True
+	world = World(plugin, results)
+	lastTime = 0.0
+	skipped = {}
+	errors = {}
+	for entry, reads in steps(entries, world):
+		world.startStep(reads)
+		kind = entry["k"]
+		nvdaStubs.runTimers(max(0.0, entry["t"]-lastTime)/1000.0)
+		lastTime = entry["t"]
+		if kind == "e":
+			name = entry["n"]
+			if entry.get("o") is not None and "st" in entry:
+				world.values[(entry["o"], "states")] = entry["st"]
+			obj = world.obj(entry.get("o"))
+			if name == "gainFocus":
+				world.focus = obj
+				api.setFocusObject(obj)
+				globalVars.focusAncestors = world.focusAncestors(entry.get("a", ()))
+				nextHandler = lambda: nvdaStubs._record("speakObject", obj)
+			else:
+				nextHandler = lambda: None
+			func = getattr(plugin, "event_%s"%name, None)
+			args = (obj, nextHandler)
+			label = "event_%s"%name
+		else:
+			name = entry["n"]
+			func = getattr(plugin, "script_%s"%name, None)
+			if func is not None:
+				sys.modules["scriptHandler"]._lastScriptRef = weakref.ref(getattr(type(plugin), "script_%s"%name))
+			args = (Gesture(name, entry.get("g")),)
+			label = "script_%s"%name
+			# as NVDA, gesture is resolved before running its script
+			plugin.getScript(args[0])
+		if func is None:
+			skipped[label] = skipped.get(label, 0)+1
+			continue
+		reads = Stats.reads
+		start = time.perf_counter()
+		try:
+			func(*args)
+		except Exception as e:
+			# as NVDA, log and go on
+			errors.setdefault(label, []).append("%s: %s"%(type(e).__name__, e))
+		results.add(label, (time.perf_counter()-start)*1000, Stats.reads-reads)
+	if plugin.exploring:
+		plugin.explorationEnd()
+	return results, world.misses, skipped, errors
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description="RibbonExplorer trace replay")
+	parser.add_argument("trace", help="a trace recorded by the add-on (.jsonl)")
+	parser.add_argument("--addon", help="globalPlugins folder of the add-on version to measure")
+	parser.add_argument("--latency", type=float, default=0.0, help="simulated latency of every remote read, in ms")
+	parser.add_argument("--json", help="also save results in this JSON file")
+	args = parser.parse_args(argv)
+	nvdaStubs.importAddon(args.addon)
+	results, misses, skipped, errors = replay(loadTrace(args.trace), args.latency)
+	results.printTable()
+	for label, messages in sorted(errors.items()):
+		sys.stdout.write("Errors in %s (%d), first: %s\n"%(label, len(messages), messages[0]))
+	if misses:
+		sys.stdout.write("Not recorded: %s\n"%", ".join("%s (%d)"%item for item in sorted(misses.items())))
+	if skipped:
+		sys.stdout.write("Not handled by this version: %s\n"%", ".join("%s (%d)"%item for item in sorted(skipped.items())))
+	if args.json:
+		with open(args.json, "w") as f:
+			json.dump({"trace": args.trace, "latencyMs": args.latency, "rows": results.rows(), "misses": misses, "skipped": skipped, "errors": errors}, f, indent=1)
+	return results
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,743 @@
+# -*- coding: UTF-8 -*-
+# Author: Alberto Buffolino
+# License: GPLv2
+"""
+Offline benchmarks of the add-on, on a simulated Ribbon (see fakeRibbon.py).
+For every Ribbon view (v1, v2, v3) and number of tabs, runs the main scripts
+and reports keystroke-to-speech latency and remote property reads per script;
+searchQuery is the time of a search in an index of all tabs (no reads);
+firstFocusable rows also count objects visited, in a combobox of 300 entries;
+layout rows are a session saving tabs it visited, and the next one loading them
+(see layoutStore.py): search start counts commands known, without and with them,
+once the Ribbon walk it asked (before idle prefetch did) came;
+save is on main thread only, the file written by a thread, and not again if unchanged;
+"(resumed)" rows explore again a window left with escape (see context.py),
+start counts model nodes already known, nextMenu reads of a round of all tabs,
+idle prefetch included;
+"(no event)" rows are silence after a key when Office does not send focus,
+in simulated ms, as expansions wait their deadline (see transaction.py);
+"(busy Office)" rows are a navigation whose Office call takes --busy ms,
+ended by the query timeout (see query.py), then the same key again.
+"report" rows are groups of a tab reported by NVDA from live objects,
+then from cached properties (see reporter.py), with the same speech.
+"leaks" rows end an exploration left in a submenu, normally or by a new start
+without end (as after an error), and count objects still alive once NVDA
+forgets them: with the context of the window, only its model nodes, then none.
+Between scripts, user is idle for --idle ms (timers run, so prefetch too);
+0 disables pauses, to measure without prefetch.
+Usage: python benchmarks/runBenchmarks.py [--latency MS] [--idle MS] [--busy MS] [--tabs 5,10,25,50] [--views v1,v2,v3] [--json FILE]
+"""
+import argparse
+import gc
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+import types
+import weakref
+import nvdaStubs
+ribbonExplorer = nvdaStubs.importAddon()
+from ribbonExplorer.nodeTable import NodeTable
+from ribbonExplorer import layoutStore
+from fakeRibbon import FakeOffice, Stats, Element, buildGroups
+from nvdaStubs import State
+
+SPEECH_KINDS = ("speakObject", "speak", "message")
+# seconds of idle time between checks of query thread
+IDLE_SLICE = 0.01
+
+class Gesture(object):
+
+	def __init__(self, name):
+		self.name = name
+		self.mainKeyName = name.split("+")[-1]
+
+	def send(self):
+		nvdaStubs.KeyboardInputGesture(self.name).send()
+
+class Session(object):
+	# a plugin instance exploring a simulated Office window
+	# seconds of user pause after every script
+	idle = 0.5
+	# seconds of a blocking Office call (see benchBusy)
+	busy = 0.5
+
+	def __init__(self, view="v2", tabs=10, groups=6, buttons=6, comboEntries=0, galleryItems=0, keepLayouts=False, trackObjs=False):
+		# trackObjs: objects created are tracked from start (see benchLeaks)
+		nvdaStubs.reset(keepLayouts)
+		self.plugin = ribbonExplorer.GlobalPlugin()
+		self.app = FakeOffice(self.plugin, view=view, tabs=tabs, groups=groups, buttons=buttons, comboEntries=comboEntries, galleryItems=galleryItems)
+		if trackObjs:
+			self.app.objRefs = []
+		nvdaStubs.KeyboardInputGesture.sendHandler = self.app.onKey
+		self.plugin.event_foreground(self.app.obj(self.app.document), lambda: None)
+		self.app.start()
+		self.pause()
+
+	def pause(self):
+		# user thinks, timers run (not measured);
+		# work posted to query thread ends between timers, as a thought
+		# lasts far longer than a query (see prefetch.py)
+		end = nvdaStubs.clock[0]+self.idle
+		while nvdaStubs.clock[0] < end:
+			nvdaStubs.runTimers(min(IDLE_SLICE, end-nvdaStubs.clock[0]))
+			self.app.pumpEvents()
+			self.waitQueries()
+
+	def waitQueries(self):
+		# work posted to query thread (see prefetch.py) ends while user thinks,
+		# and its result is handed to main thread
+		worker = self.plugin.queryWorker
+		if worker is None:
+			return
+		done = threading.Event()
+		worker.post(done.set)
+		done.wait(5)
+		nvdaStubs.runTimers(0)
+		self.app.pumpEvents()
+
+	def runScript(self, name, gestureName=None):
+		# returns (latency to first speech in ms, total ms, remote reads)
+		func = getattr(type(self.plugin), "script_%s"%name)
+		sys.modules["scriptHandler"]._lastScriptRef = weakref.ref(func)
+		outputStart = len(nvdaStubs.output)
+		reads = Stats.reads
+		start = time.perf_counter()
+		gesture = Gesture(gestureName or name)
+		self.plugin.getScript(gesture)
+		getattr(self.plugin, "script_%s"%name)(gesture)
+		self.app.pumpEvents()
+		end = time.perf_counter()
+		res = self._result(outputStart, start, end, reads)
+		self.pause()
+		return res
+
+	def runUntilSpeech(self, name, gestureName=None, limit=5.0):
+		# as runScript, but latency is simulated time to first speech,
+		# timers included (for Office not answering)
+		outputStart = len(nvdaStubs.output)
+		reads = Stats.reads
+		start = nvdaStubs.clock[0]
+		gesture = Gesture(gestureName or name)
+		self.plugin.getScript(gesture)
+		getattr(self.plugin, "script_%s"%name)(gesture)
+		self.app.pumpEvents()
+		while not [item for item in nvdaStubs.output[outputStart:] if item[1] in SPEECH_KINDS] and nvdaStubs.clock[0]-start < limit:
+			nvdaStubs.runTimers(0.01)
+			self.app.pumpEvents()
+		ms = (nvdaStubs.clock[0]-start)*1000
+		self.pause()
+		return (ms, ms, Stats.reads-reads)
+
+	def runCall(self, func, *args):
+		# as runScript, for a plugin method
+		outputStart = len(nvdaStubs.output)
+		reads = Stats.reads
+		start = time.perf_counter()
+		func(*args)
+		self.app.pumpEvents()
+		end = time.perf_counter()
+		res = self._result(outputStart, start, end, reads)
+		self.pause()
+		return res
+
+	def _result(self, outputStart, start, end, reads):
+		spoken = [item[0] for item in nvdaStubs.output[outputStart:] if item[1] in SPEECH_KINDS]
+		latency = (spoken[0] if spoken else end)-start
+		return (latency*1000, (end-start)*1000, Stats.reads-reads)
+
+	def end(self):
+		if self.plugin.exploring:
+			self.plugin.explorationEnd()
+		# layout of this session on disk, before next one loads it
+		layoutStore.waitWrites()
+		nvdaStubs.KeyboardInputGesture.sendHandler = None
+
+class Results(object):
+
+	def __init__(self):
+		self.rows = []
+
+	def add(self, view, tabs, script, samples, count=None):
+		# count: objects visited or commands found, if meaningful
+		if not samples:
+			return
+		self.rows.append({
+			"count": count,
+			"view": view,
+			"tabs": tabs,
+			"script": script,
+			"runs": len(samples),
+			"latencyMs": round(sum(s[0] for s in samples)/len(samples), 3),
+			"maxLatencyMs": round(max(s[0] for s in samples), 3),
+			"totalMs": round(sum(s[1] for s in samples)/len(samples), 3),
+			"reads": round(sum(s[2] for s in samples)/float(len(samples)), 1),
+		})
+
+	def printTable(self, out=sys.stdout):
+		header = "%-4s %5s %-26s %5s %11s %11s %8s %7s"%("view", "tabs", "script", "runs", "latency ms", "max ms", "reads", "count")
+		out.write(header+"\n"+"-"*len(header)+"\n")
+		for row in self.rows:
+			count = "%7d"%row["count"] if row["count"] is not None else ""
+			out.write("%-4s %5d %-26s %5d %11.3f %11.3f %8.1f %s\n"%(row["view"], row["tabs"], row["script"], row["runs"], row["latencyMs"], row["maxLatencyMs"], row["reads"], count))
+
+def benchNavigation(results, view, tabs, groups=6, buttons=6):
+	session = Session(view, tabs, groups, buttons)
+	plugin = session.plugin
+	assert plugin.exploring, "exploration not started"
+	samples = [session.runScript("rightArrow") for i in range(tabs)]
+	results.add(view, tabs, "nextMenu", samples)
+	samples = [session.runScript("leftArrow") for i in range(tabs)]
+	results.add(view, tabs, "prevMenu", samples)
+	# back to selected tab, then expand it
+	while plugin.userObj.name != session.app.selectedTab.name:
+		session.runScript("rightArrow")
+	results.add(view, tabs, "expandMenu", [session.runScript("downArrow")])
+	samples = [session.runScript("tab") for i in range(groups*2)]
+	results.add(view, tabs, "nextItem (groups)", samples)
+	samples = [session.runScript("shiftTab") for i in range(groups)]
+	results.add(view, tabs, "prevItem (groups)", samples)
+	results.add(view, tabs, "childItem", [session.runScript("rightArrow")])
+	samples = [session.runScript("tab") for i in range(buttons*2)]
+	results.add(view, tabs, "nextItem (commands)", samples)
+	# a collapsed split button, to expand/collapse its submenu
+	for i in range(buttons):
+		if plugin.userObj.role == ribbonExplorer.roles.SPLITBUTTON:
+			break
+		session.runScript("tab")
+	if plugin.userObj.role == ribbonExplorer.roles.SPLITBUTTON and plugin.userObjHasFocus:
+		results.add(view, tabs, "expandSubmenu", [session.runScript("altDownArrow", "alt+downArrow")])
+		samples = [session.runScript("downArrow") for i in range(4)]
+		results.add(view, tabs, "nextItem (submenu)", samples)
+		results.add(view, tabs, "collapseSubmenu", [session.runScript("altUpArrow", "alt+upArrow")])
+	# forceFocus on a command not focused
+	focusables = session.app.focusables()
+	target = focusables[len(focusables)//2]
+	results.add(view, tabs, "forceFocus", [session.runCall(plugin.forceFocus, session.app.obj(target))])
+	# a command few tab stops away from focus, reached by planned keys
+	if session.app.focus in focusables:
+		target = focusables[(focusables.index(session.app.focus)+3)%len(focusables)]
+		results.add(view, tabs, "forceFocus (planned)", [session.runCall(plugin.forceFocus, session.app.obj(target))])
+		assert session.app.focus is target, "planned focus not reached"
+	results.add(view, tabs, "collapseMenu", [session.runScript("escape")])
+	session.end()
+
+def benchClassification(results, view, tabs, groups=6, buttons=6):
+	# chooseNVDAObjectOverlayClasses, run at every object creation
+	session = Session(view, tabs, groups, buttons)
+	session.runScript("downArrow")
+	elements = list(session.app.root.walk())+list(session.app.window.walk())
+	samples = []
+	for element in elements:
+		reads = Stats.reads
+		start = time.perf_counter()
+		session.app.obj(element)
+		samples.append(((time.perf_counter()-start)*1000, (time.perf_counter()-start)*1000, Stats.reads-reads))
+	results.add(view, tabs, "overlayClasses", samples)
+	session.end()
+
+def benchSearch(results, view, tabs, groups=10, buttons=6):
+	# index of all tabs (as after visiting them), then queries and a jump
+	session = Session(view, tabs, groups, buttons)
+	plugin = session.plugin
+	app = session.app
+	selected = app.selectedTab
+	for tab in app.tabs[1:]:
+		app.selectTab(tab)
+		plugin.commandIndex.addTabContent(tab.name, ribbonExplorer.uiaCache.walkSubtree(app.obj(app.content)))
+	app.selectTab(selected, show=(view != "v2"))
+	# sorted words/names are rebuilt at first query after changes
+	plugin.commandIndex.search("c")
+	samples = []
+	for query in ("c", "com", "command 3", "tab %d command 2.4"%(tabs-1), "2.1", "zzz"):
+		start = time.perf_counter()
+		for i in range(10):
+			plugin.commandIndex.search(query)
+		ms = (time.perf_counter()-start)*100
+		samples.append((ms, ms, 0))
+	results.add(view, tabs, "searchQuery", samples)
+	target = "tab %d command %d.4"%(tabs-1, groups)
+	session.runScript("search", "control+f")
+	for char in target:
+		session.runScript("searchChar", "space" if char == " " else char)
+	results.add(view, tabs, "searchGoTo", [session.runScript("searchEnter", "enter")])
+	assert plugin.userObj.name.lower() == target, "search result not reached"
+	# Office busy while path is followed from focus events:
+	# steps are tried again when it answers
+	target = "tab %d command %d.4"%(tabs-2, groups)
+	session.runScript("search", "control+f")
+	for char in target:
+		session.runScript("searchChar", "space" if char == " " else char)
+	app.busyAfterFocus = session.busy
+	session.idle = 0
+	results.add(view, tabs, "searchGoTo (busy Office)", [session.runScript("searchEnter", "enter")])
+	assert plugin.exploring and plugin.queryWorker.timeouts, "busy Office not met"
+	time.sleep(session.busy)
+	session.idle = Session.idle
+	# retry timers run even with --idle 0
+	nvdaStubs.runTimers(1.0)
+	app.pumpEvents()
+	assert plugin.userObj.name.lower() == target, "search result not reached after busy Office"
+	session.end()
+
+def benchDeadlines(results, view, tabs, groups=6, buttons=6):
+	# Office not sending focus events: silence after key, in simulated ms
+	session = Session(view, tabs, groups, buttons)
+	plugin = session.plugin
+	app = session.app
+	while plugin.userObj.name != app.selectedTab.name:
+		session.runScript("rightArrow")
+	app.dropFocus = 1
+	results.add(view, tabs, "expandMenu (no event)", [session.runUntilSpeech("downArrow")])
+	# next key stops waiting, and expands again
+	session.runScript("downArrow")
+	assert not plugin.isExpandingMenu and plugin.menubar, "expansion not recovered"
+	session.runScript("rightArrow")
+	for i in range(buttons):
+		if plugin.userObj.role == ribbonExplorer.roles.SPLITBUTTON:
+			break
+		session.runScript("tab")
+	# with --idle 0, tabs are held keys, reported by next key
+	plugin.keyRepeat.flush()
+	app.pumpEvents()
+	assert plugin.userObjHasFocus, "split button not reached"
+	splitButton = plugin.userObj
+	app.dropFocus = 1
+	results.add(view, tabs, "expandSubmenu (no event)", [session.runUntilSpeech("altDownArrow", "alt+downArrow")])
+	# user waits, then waiting ends
+	nvdaStubs.runTimers(3)
+	assert not plugin.isExpandingSubmenu and plugin.exploring, "submenu expansion not recovered"
+	# a submenu expanded normally, then closed without event
+	app.closePopup()
+	app.pumpEvents()
+	assert plugin.userObj == splitButton and plugin.userObjHasFocus, "split button lost"
+	session.runScript("altDownArrow", "alt+downArrow")
+	assert plugin.expandedSubmenu, "submenu not expanded"
+	app.dropFocus = 1
+	results.add(view, tabs, "collapseSubmenu (no event)", [session.runUntilSpeech("altUpArrow", "alt+upArrow")])
+	assert not plugin.isCollapsingSubmenu and plugin.userObjHasFocus, "submenu collapse not recovered"
+	session.end()
+
+def benchBusy(results, view, tabs, groups=6, buttons=6):
+	# a call in Office blocking for Session.busy seconds, in wall time
+	session = Session(view, tabs, groups, buttons)
+	plugin = session.plugin
+	app = session.app
+	while plugin.userObj.name != app.selectedTab.name:
+		session.runScript("rightArrow")
+	session.runScript("downArrow")
+	userObj = plugin.userObj
+	outputStart = len(nvdaStubs.output)
+	app.busy = session.busy
+	results.add(view, tabs, "nextItem (busy Office)", [session.runScript("tab")])
+	messages = [item[2] for item in nvdaStubs.output[outputStart:] if item[1] == "message"]
+	assert plugin.userObj is userObj and messages and messages[0].startswith("Office busy"), "busy Office not reported"
+	# late answer fills the model, so the key works without Office
+	time.sleep(session.busy)
+	session.pause()
+	results.add(view, tabs, "nextItem (after busy)", [session.runScript("tab")])
+	assert plugin.userObj is not userObj, "late answer lost"
+	assert not app.offThreadObjs, "objects created by query thread"
+	session.end()
+	# idle prefetch of tabs not linked yet, while Office is busy:
+	# its reads are posted, main thread runs timers without waiting
+	session = Session(view, tabs, groups, buttons)
+	plugin = session.plugin
+	app = session.app
+	session.idle = 0
+	for i in range(ribbonExplorer.prefetch.NEIGHBOURS+1):
+		session.runScript("rightArrow")
+	app.busy = session.busy
+	# idle long enough for prefetch, even with --idle 0
+	idle = 2*ribbonExplorer.prefetch.IDLE_DELAY/1000.0
+	start = time.perf_counter()
+	nvdaStubs.runTimers(idle)
+	ms = (time.perf_counter()-start)*1000
+	results.add(view, tabs, "idle prefetch (busy Office)", [(ms, ms, 0)], count=plugin.prefetcher.done)
+	assert ms < ribbonExplorer.query.TIMEOUT*1000, "idle prefetch waited Office: %.1f ms"%ms
+	time.sleep(session.busy)
+	session.idle = idle
+	session.pause()
+	node = plugin.model.cachedNode(plugin.userObj)
+	assert node is not None and "simpleNext" in node.links, "next tab not prefetched after busy Office"
+	assert not app.offThreadObjs, "objects created by query thread"
+	session.end()
+
+def benchFocusable(results, view, tabs, groups=6, buttons=6, entries=300):
+	# first focusable descendant of a combobox with many entries (see expandSubmenu)
+	session = Session(view, tabs, groups, buttons, comboEntries=entries)
+	plugin = session.plugin
+	app = session.app
+	while plugin.userObj.name != app.selectedTab.name:
+		session.runScript("rightArrow")
+	session.runScript("downArrow")
+	combo = [element for element in app.content.walk() if element.role == ribbonExplorer.roles.COMBOBOX and element.children[0].role == ribbonExplorer.roles.LIST][0]
+	obj = app.obj(combo)
+	visits = []
+	def walk(obj):
+		# as findFirstFocusable was: depth first, whole subtree
+		for count, descendant in enumerate(obj.recursiveDescendants, 1):
+			if descendant.isFocusable:
+				visits.append(count)
+				return descendant
+	results.add(view, tabs, "firstFocusable (walk)", [session.runCall(walk, obj)], count=visits[-1])
+	model = plugin.model
+	for name in ("firstFocusable", "firstFocusable (memo)"):
+		before = model.focusableVisits
+		results.add(view, tabs, name, [session.runCall(model.firstFocusable, obj)], count=model.focusableVisits-before)
+	assert model.firstFocusable(obj).role == ribbonExplorer.roles.EDITABLETEXT, "combobox edit not found"
+	session.end()
+
+def benchLayout(results, view, tabs, groups=6, buttons=6):
+	# a session visits all tabs, so next one can search them at once
+	# search starts before idle prefetch walked the Ribbon:
+	# it does not wait the walk, and gets its commands later
+	idle = Session.idle
+	Session.idle = 0
+	try:
+		session = Session(view, tabs, groups, buttons)
+	finally:
+		Session.idle = idle
+	session.idle = 0
+	plugin = session.plugin
+	app = session.app
+	while plugin.userObj.name != app.selectedTab.name:
+		session.runScript("rightArrow")
+	sample = session.runScript("search", "control+f")
+	assert not plugin.commandIndex.crawled, "search waited the Ribbon walk"
+	target = app.tabs[-1].name.lower()
+	for char in target:
+		session.runScript("searchChar", "space" if char == " " else char)
+	assert not plugin.searchResults, "tab found before Ribbon walk"
+	session.waitQueries()
+	assert plugin.commandIndex.crawled and plugin.searchResults, "search not completed by Ribbon walk"
+	coldCount = len(plugin.commandIndex)
+	results.add(view, tabs, "search start (cold)", [sample], count=coldCount)
+	session.runScript("searchEscape", "escape")
+	session.idle = Session.idle
+	# every tab but File
+	for i in range(tabs-1):
+		session.runScript("downArrow")
+		session.runScript("escape")
+		session.runScript("rightArrow")
+	store = plugin.layoutStore
+	results.add(view, tabs, "layout save", [session.runCall(plugin.saveLayout)])
+	layoutStore.waitWrites()
+	assert os.path.isfile(store.path), "layout not written"
+	saved = store.stored
+	# same tab visited again: same layout, not written again
+	session.runScript("downArrow")
+	session.runScript("escape")
+	plugin.saveLayout()
+	assert store.stored is saved and not layoutStore.pendingWrites, "same layout written again"
+	session.end()
+	session = Session(view, tabs, groups, buttons, keepLayouts=True)
+	plugin = session.plugin
+	assert plugin.layoutStore.loaded, "layout not loaded"
+	results.add(view, tabs, "layout load", [session.runCall(plugin.layoutStore.load)], count=len(plugin.layoutStore.tabs))
+	sample = session.runScript("search", "control+f")
+	# Ribbon walk, if prefetch did not, ends while user hears the message
+	session.waitQueries()
+	results.add(view, tabs, "search start (warm)", [sample], count=len(plugin.commandIndex))
+	assert plugin.layoutStore.trusted and len(plugin.commandIndex) > coldCount, "layout not restored"
+	session.end()
+
+def benchResume(results, view, tabs, groups=6, buttons=6):
+	# leaving the Ribbon, then exploring it again in the same window
+	session = Session(view, tabs, groups, buttons)
+	plugin = session.plugin
+	app = session.app
+	session.runScript("escape")
+	reads = {}
+	for name in ("cold", "resumed"):
+		if name == "cold":
+			plugin.contexts.clear()
+		results.add(view, tabs, "start (%s)"%name, [session.runCall(app.start)], count=len(plugin.model.nodes))
+		assert plugin.exploring, "exploration not started"
+		if name == "resumed":
+			# tabs checked again, links between tabs kept
+			nodes = len(plugin.model.nodes)
+			results.add(view, tabs, "verifyContext", [session.runCall(plugin.verifyContext, None)])
+			assert len(plugin.model.nodes) >= nodes, "tabs forgotten"
+		# reads of idle prefetch too, that links neighbours in cold exploration
+		start = Stats.reads
+		samples = [session.runScript("rightArrow") for i in range(tabs)]
+		reads[name] = Stats.reads-start
+		results.add(view, tabs, "nextMenu (%s)"%name, samples, count=reads[name])
+		while plugin.userObj.name != app.selectedTab.name:
+			session.runScript("rightArrow")
+		results.add(view, tabs, "expandMenu (%s)"%name, [session.runScript("downArrow")])
+		session.runScript("escape")
+		# escape on a tab leaves the Ribbon
+		session.runScript("escape")
+		assert not plugin.exploring, "exploration not ended"
+	assert plugin.contexts.resumed, "context not resumed"
+	# links between tabs are kept, and their objs come from the walk of verifyContext
+	assert reads["resumed"] <= 0.5*reads["cold"], "resumed context not warm: %d reads, %d cold"%(reads["resumed"], reads["cold"])
+	session.end()
+
+def benchRepeat(results, view, tabs, groups=6, buttons=6, repeat=0.033):
+	# tab held down, at repeat seconds per key, against single taps
+	for name in ("taps", "held"):
+		session = Session(view, tabs, groups, buttons)
+		plugin = session.plugin
+		app = session.app
+		while plugin.userObj.name != app.selectedTab.name:
+			session.runScript("rightArrow")
+		session.runScript("downArrow")
+		session.runScript("rightArrow")
+		if name == "held":
+			session.idle = repeat
+		samples = [session.runScript("tab") for i in range(buttons*2)]
+		results.add(view, tabs, "nextItem (%s)"%name, samples)
+		if name == "held":
+			assert plugin.keyRepeat.pending, "repeats not deferred"
+			target = plugin.userObj
+			session.idle = Session.idle
+			results.add(view, tabs, "nextItem (held, commit)", [session.runCall(plugin.keyRepeat.flush)])
+			assert app.focus.name == target.name, "focus not on last object"
+		session.end()
+	# rightArrow held along tabs, then downArrow: focus of last tab,
+	# set by the report of held keys, comes after expansion started
+	session = Session(view, tabs, groups, buttons)
+	plugin = session.plugin
+	app = session.app
+	session.idle = repeat
+	# not to File tab, that has no content
+	for i in range(tabs//2):
+		session.runScript("rightArrow")
+	assert plugin.keyRepeat.pending, "repeats not deferred"
+	session.idle = Session.idle
+	tab = plugin.userObj
+	results.add(view, tabs, "expandMenu (after held)", [session.runScript("downArrow")])
+	assert plugin.exploring and plugin.menubar and plugin.menubar[-1].name == tab.name, "tab not expanded after held keys"
+	assert not plugin.isExpandingMenu and app.content is not None, "expansion not completed"
+	session.end()
+	# tab held to a submenu, then a repeat expanding it (as rightArrow does):
+	# real focus is still on a previous control, until the held report
+	session = Session(view, tabs, groups, buttons)
+	plugin = session.plugin
+	app = session.app
+	while plugin.userObj.name != app.selectedTab.name:
+		session.runScript("rightArrow")
+	session.runScript("downArrow")
+	session.runScript("rightArrow")
+	session.idle = repeat
+	while plugin.userObj.role != ribbonExplorer.roles.SPLITBUTTON:
+		session.runScript("tab")
+	assert plugin.keyRepeat.pending, "repeats not deferred"
+	session.idle = Session.idle
+	target = plugin.userObj
+	results.add(view, tabs, "expandSubmenu (after held)", [session.runCall(plugin.expandSubmenu, target)])
+	assert app.popupOpener is not None and app.popupOpener.name == target.name, "submenu of another control expanded"
+	assert plugin.expandedSubmenu and not plugin.isExpandingSubmenu, "expansion not completed"
+	session.end()
+
+def benchGallery(results, view, tabs, groups=6, buttons=6, sizes=(50, 500), pages=5, repeats=4):
+	# a submenu with a gallery of every size, paged by pageDown/pageUp
+	expansions = {}
+	for size in sizes:
+		session = Session(view, tabs, groups, buttons, galleryItems=size)
+		plugin = session.plugin
+		app = session.app
+		while plugin.userObj.name != app.selectedTab.name:
+			session.runScript("rightArrow")
+		session.runScript("downArrow")
+		session.runScript("rightArrow")
+		while plugin.userObj.role != ribbonExplorer.roles.SPLITBUTTON:
+			session.runScript("tab")
+		# built by Office before, not part of expansion
+		app.gallery(app.focus)
+		created = app.created
+		sample = session.runScript("altDownArrow", "alt+downArrow")
+		results.add(view, tabs, "expandSubmenu (%d items)"%size, [sample], count=app.created-created)
+		props = len(plugin.uiaCache.props)
+		# fastest of some expansions, for a comparison not spoiled by a pause
+		samples = [sample]
+		for i in range(repeats):
+			session.runScript("altUpArrow", "alt+upArrow")
+			# focus back on the opener, as after any move
+			session.runCall(plugin.forceFocus, plugin.userObj)
+			samples.append(session.runScript("altDownArrow", "alt+downArrow"))
+		expansions[size] = (sample[2], props, min(latency for latency, total, reads in samples))
+		# from gallery to its first item
+		session.runScript("rightArrow")
+		assert plugin.userObj.role == ribbonExplorer.roles.DATAITEM, "gallery not entered"
+		nodes = len(plugin.model.nodes)
+		samples = [session.runScript("pageDown") for i in range(pages)]
+		results.add(view, tabs, "pageDown (%d items)"%size, samples, count=len(plugin.gallery.items))
+		assert plugin.userObj.name.endswith(" style %d"%(min(size, pages*ribbonExplorer.PAGE_SIZE+1))), "wrong page"
+		samples = [session.runScript("pageUp") for i in range(pages)]
+		results.add(view, tabs, "pageUp (%d items)"%size, samples, count=len(plugin.gallery.items))
+		assert plugin.userObj.name.endswith(" style 1"), "wrong page"
+		assert len(plugin.model.nodes) == nodes, "gallery items kept by model"
+		session.end()
+	# a page of items is walked at expansion, whatever the gallery size
+	small, large = expansions[min(sizes)], expansions[max(sizes)]
+	assert large[:2] == small[:2], "expansion reads every gallery item"
+	assert large[2] < 2*small[2], "expansion time grows with gallery size: %.1f ms, %.1f ms"%(small[2], large[2])
+
+def measure(build):
+	# (result, ms, KB still allocated by build)
+	# garbage of previous samples, and cycles left by build, not counted
+	gc.collect()
+	tracemalloc.start()
+	before = tracemalloc.get_traced_memory()[0]
+	start = time.perf_counter()
+	res = build()
+	ms = (time.perf_counter()-start)*1000
+	gc.collect()
+	size = tracemalloc.get_traced_memory()[0]-before
+	tracemalloc.stop()
+	return res, ms, size//1024
+
+def benchMemory(results, view, tabs, groups=10, buttons=8):
+	# a Ribbon crawled with content of every tab, kept as NVDAObjects,
+	# as dicts of properties (before nodeTable.py), and as a table
+	nvdaStubs.reset()
+	plugin = ribbonExplorer.GlobalPlugin()
+	app = FakeOffice(plugin, view=view, tabs=tabs)
+	for tab in app.tabs[2:]:
+		app.root.append(Element(tab.name, ribbonExplorer.roles.PANE, className="NetUIPanViewer", children=buildGroups(tab.name, groups, buttons)))
+	root = app.obj(app.root)
+	elements = list(app.root.walk())
+	def buildObjects():
+		return [app.obj(element) for element in elements]
+	def buildDicts():
+		prefetched = {}
+		for runtimeId, parentId, props in ribbonExplorer.walkSubtree(root):
+			prefetched[runtimeId] = (parentId, props, [])
+			if parentId in prefetched:
+				prefetched[parentId][2].append(runtimeId)
+		return prefetched
+	def buildTable():
+		return NodeTable(ribbonExplorer.walkSubtree(root))
+	sizes = {}
+	for name, build in (("NVDAObjects", buildObjects), ("dicts", buildDicts), ("table", buildTable)):
+		res, ms, sizes[name] = measure(build)
+		results.add(view, tabs, "memory %s (KB)"%name, [(ms, ms, 0)], count=sizes[name])
+	assert sizes["table"] < sizes["dicts"], "table not compact: %d KB, dicts %d KB"%(sizes["table"], sizes["dicts"])
+	table = res
+	# walk of whole table by positions, as subtree does
+	def walk():
+		firstChild = table.firstChild
+		nextSibling = table.nextSibling
+		visited = 0
+		stack = [0]
+		while stack:
+			pos = stack.pop()
+			if pos < 0:
+				continue
+			visited += 1
+			stack.append(nextSibling[pos])
+			stack.append(firstChild[pos])
+		return visited
+	visited, ms, size = measure(walk)
+	assert visited == len(table) == len(elements), "table walk incomplete"
+	results.add(view, tabs, "table walk (%d nodes)"%visited, [(ms, ms, 0)], count=size)
+
+def benchReport(results, view, tabs, groups=6, buttons=6):
+	# groups are not focusable, so the add-on reports them
+	# cache is an option, off by default
+	spoken = {}
+	default = ribbonExplorer.reporter.ENABLED
+	for name, enabled in (("NVDA", False), ("cache", True)):
+		ribbonExplorer.reporter.ENABLED = enabled
+		try:
+			session = Session(view, tabs, groups, buttons)
+			plugin = session.plugin
+			while plugin.userObj.name != session.app.selectedTab.name:
+				session.runScript("rightArrow")
+			session.runScript("downArrow")
+			outputStart = len(nvdaStubs.output)
+			samples = [session.runScript("tab") for i in range(groups*2)]
+			spoken[name] = [item[2] for item in nvdaStubs.output[outputStart:] if item[1] in SPEECH_KINDS]
+			results.add(view, tabs, "report groups (%s)"%name, samples, count=plugin.reporter.cached)
+			session.end()
+		finally:
+			ribbonExplorer.reporter.ENABLED = default
+	assert spoken["NVDA"] == spoken["cache"], "different speech from cache"
+
+def benchLeaks(results, view, tabs, groups=6, buttons=6):
+	# Ribbon objects kept by the add-on after explorationEnd
+	for name in ("ended", "restarted"):
+		session = Session(view, tabs, groups, buttons, trackObjs=True)
+		plugin = session.plugin
+		app = session.app
+		while plugin.userObj.name != app.selectedTab.name:
+			session.runScript("rightArrow")
+		session.runScript("downArrow")
+		session.runScript("rightArrow")
+		while plugin.userObj.role != ribbonExplorer.roles.SPLITBUTTON:
+			session.runScript("tab")
+		session.runScript("altDownArrow", "alt+downArrow")
+		session.runScript("downArrow")
+		assert plugin.expandedSubmenu and plugin.collapsingMenuItem, "submenu not expanded"
+		if name == "restarted":
+			# exploration started again, previous one never ended
+			plugin.explorationStart(app.obj(app.root))
+		sample = session.runCall(plugin.explorationEnd)
+		# NVDA moves on: focus, navigator and spoken objects are forgotten
+		nvdaStubs.reset(keepLayouts=True)
+		gc.collect()
+		# context of window is kept, without Office objects
+		assert plugin.contexts.contexts, "context not kept"
+		alive = [ref() for ref in app.objRefs if ref() is not None]
+		assert not alive, "objects kept after explorationEnd: %s"%alive
+		results.add(view, tabs, "leaks (%s)"%name, [sample], count=len(alive))
+		session.end()
+
+class OtherAppModule(object):
+	productName = "Notepad"
+	appName = "notepad"
+
+def benchForeground(results, view, tabs, groups=6, buttons=6, switches=20):
+	# alt+tab between Office and another application, outside Ribbon
+	session = Session(view, tabs, groups, buttons)
+	plugin = session.plugin
+	app = session.app
+	if not plugin.appInfo.view:
+		# no idle prefetch (--idle 0), or its budget spent before walking Ribbon (a slow run)
+		plugin.crawlRibbon(plugin.uiaCache.prefetch(plugin.ribbonScope.root))
+	assert plugin.appInfo.view == view, "Ribbon view not detected"
+	office = app.obj(app.document)
+	other = types.SimpleNamespace(processID=5000, appModule=OtherAppModule())
+	sys.modules["appModuleHandler"].runningTable[other.processID] = other.appModule
+	nextHandler = lambda: None
+	for name, obj in (("Office", office), ("other", other)):
+		plugin.appInfos.clear()
+		results.add(view, tabs, "foreground %s (first)"%name, [session.runCall(plugin.event_foreground, obj, nextHandler)])
+		samples = [session.runCall(plugin.event_foreground, obj, nextHandler) for i in range(switches)]
+		results.add(view, tabs, "foreground %s (again)"%name, samples)
+	assert not plugin.supportedApp, "other app supported"
+	session.end()
+
+BENCHMARKS = (benchNavigation, benchClassification, benchSearch, benchDeadlines, benchBusy, benchFocusable, benchLayout, benchResume, benchForeground, benchRepeat, benchGallery, benchReport, benchLeaks, benchMemory)
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description="RibbonExplorer offline benchmarks")
+	parser.add_argument("--latency", type=float, default=0.05, help="simulated latency of every remote read, in ms")
+	parser.add_argument("--idle", type=float, default=500, help="user pause after every script, in ms")
+	parser.add_argument("--busy", type=float, default=500, help="duration of a blocking Office call, in ms")
+	parser.add_argument("--tabs", default="5,10,25,50", help="comma separated numbers of tabs")
+	parser.add_argument("--views", default="v1,v2,v3", help="comma separated Ribbon views")
+	parser.add_argument("--json", help="also save results in this JSON file")
+	args = parser.parse_args(argv)
+	Stats.latency = args.latency/1000.0
+	Session.idle = args.idle/1000.0
+	Session.busy = args.busy/1000.0
+	results = Results()
+	for view in args.views.split(","):
+		for tabs in [int(n) for n in args.tabs.split(",")]:
+			for benchmark in BENCHMARKS:
+				benchmark(results, view, tabs)
+	results.printTable()
+	if args.json:
+		with open(args.json, "w") as f:
+			json.dump({"latencyMs": args.latency, "rows": results.rows}, f, indent=1)
+	return results
+
+if __name__ == "__main__":
+	main()